@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+批量处理 CLI - 把一个目录中的人像一次提交为批量任务，结果写到磁盘（代替逐张走浏览器流程）
+
+流程: 逐张 uploadAsset → submitBatch（每张图片选择的姿势）→ streamBatch（--poll 时改为 getBatchStatus 轮询）
+      → 每个姿势完成即下载生成图 → 全部结束后写入 manifest.json
+
+输出目录结构:
+    <output>/<batchId>/<图片名>/<姿势>.<ext>
+    <output>/<batchId>/manifest.json     服务端清单 + 本地文件路径
+
+用法:
+    python batch_cli.py sys_init
+    python batch_cli.py sys_init --poses 正面头像,半身照 --output output/batch
+    python batch_cli.py "sys_init/6. Cindy Ruan.jpeg" --poll
+    python batch_cli.py --resume <batchId>              # 重新连接未结束的批量任务
+"""
+
+import argparse
+import json
+import mimetypes
+import os
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+from job_stream import ApiError, get_batch_status, stream_batch, submit_batch, upload_asset
+
+# 配置
+IMAGE_DIR = "sys_init"
+OUTPUT_DIR = "output/batch"
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+ALL_POSES = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def collect_images(path: str) -> list:
+    p = Path(path)
+    files = [p] if p.is_file() else sorted(f for f in p.iterdir() if f.suffix.lower() in IMAGE_SUFFIXES)
+    if not files:
+        raise SystemExit(f"❌ 没有找到图片: {path}")
+    return files
+
+
+def upload_images(args, files: list) -> list:
+    items = []
+    for f in files:
+        content_type = mimetypes.guess_type(f.name)[0] or "image/jpeg"
+        asset = upload_asset(args.base_url, args.code, f.read_bytes(), content_type)
+        items.append({"name": f.stem, "imageId": asset["assetId"], "photoTypes": args.poses})
+        print(f"   ⬆️  {f.name} ({asset['bytes'] // 1024}KB)")
+    return items
+
+
+class ResultWriter:
+    """每个姿势完成即下载生成图；按 jobId 去重（重新连接时服务端会重发已完成的姿势）"""
+
+    def __init__(self, args, batch_dir: Path):
+        self.args = args
+        self.batch_dir = batch_dir
+        self.files = {}
+        self.failed = {}
+
+    def handle(self, name: str, pose: dict):
+        job_id = pose["jobId"]
+        if job_id in self.files or job_id in self.failed:
+            return
+        if pose["status"] == "failed":
+            self.failed[job_id] = pose.get("error") or "unknown error"
+            print(f"   ❌ {name} / {pose['photoType']}: {self.failed[job_id]}")
+            return
+        if pose["status"] != "completed" or not pose.get("image"):
+            return
+        self.files[job_id] = str(self.download(name, pose))
+        score = (pose.get("review") or {}).get("overallScore", "-")
+        print(f"   ✅ {name} / {pose['photoType']} (评分 {score}) → {self.files[job_id]}")
+
+    def download(self, name: str, pose: dict) -> Path:
+        url = pose["image"]
+        if url.startswith("/"):
+            url = self.args.base_url.rstrip("/") + url
+        # 读取资源同样需要邀请码
+        request = urllib.request.Request(url, headers={"X-Invite-Code": self.args.code})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            body = response.read()
+            content_type = response.headers.get("Content-Type", "image/png").split(";")[0]
+        ext = mimetypes.guess_extension(content_type) or ".png"
+        target = self.batch_dir / name / f"{pose['photoType']}{ext}"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(body)
+        return target
+
+    def handle_manifest(self, manifest: dict):
+        for item in manifest["items"]:
+            for pose in item["poses"]:
+                self.handle(item["name"], pose)
+
+
+def wait_streaming(args, batch_id: str, writer: ResultWriter) -> dict:
+    # 服务端单个流最长 10 分钟，超时后重新订阅
+    while True:
+        for event in stream_batch(args.base_url, args.code, batch_id):
+            if event["event"] == "item":
+                writer.handle(event["status"]["name"], event["status"])
+            elif event["event"] == "done":
+                return event["status"]
+            elif event["event"] == "failed":
+                raise SystemExit(f"❌ {event['status'].get('error')}")
+        print("   … 状态流超时，重新订阅")
+
+
+def wait_polling(args, batch_id: str, writer: ResultWriter) -> dict:
+    while True:
+        manifest = get_batch_status(args.base_url, args.code, batch_id)
+        writer.handle_manifest(manifest)
+        if manifest["status"] in ("completed", "failed"):
+            return manifest
+        time.sleep(args.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量处理一个目录中的人像")
+    parser.add_argument("images", nargs="?", default=IMAGE_DIR, help="图片文件或目录")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--code", default=INVITE_CODE, help="邀请码")
+    parser.add_argument("--poses", default=",".join(ALL_POSES), help="每张图片的姿势，逗号分隔")
+    parser.add_argument("--speculative", type=int, help="每轮并行生成的候选数 K")
+    parser.add_argument("--poll", action="store_true", help="使用 getBatchStatus 轮询代替状态流")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--resume", metavar="BATCH_ID", help="不提交新任务，重新连接已有的批量任务")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    args = parser.parse_args()
+    args.poses = [p.strip() for p in args.poses.split(",") if p.strip()]
+
+    t0 = time.perf_counter()
+    try:
+        if args.resume:
+            manifest = get_batch_status(args.base_url, args.code, args.resume)
+        else:
+            files = collect_images(args.images)
+            print(f"🚀 {len(files)} 张图片 × {len(args.poses)} 个姿势 → {args.base_url}")
+            manifest = submit_batch(args.base_url, args.code, upload_images(args, files), args.speculative)
+        batch_id = manifest["batchId"]
+        print(f"📦 批量任务 {batch_id}: {manifest['counts']['poses']} 个姿势")
+
+        batch_dir = Path(args.output) / batch_id
+        writer = ResultWriter(args, batch_dir)
+        writer.handle_manifest(manifest)
+        final = (wait_polling if args.poll else wait_streaming)(args, batch_id, writer)
+        writer.handle_manifest(final)
+    except ApiError as e:
+        print(f"❌ {e}")
+        return 1
+
+    for item in final["items"]:
+        for pose in item["poses"]:
+            pose["file"] = writer.files.get(pose["jobId"])
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = batch_dir / "manifest.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().isoformat(), "wall_s": round(time.perf_counter() - t0, 1), **final},
+                  f, indent=2, ensure_ascii=False)
+
+    counts = final["counts"]
+    print(f"\n完成 {counts['completed']}/{counts['poses']}，失败 {counts['failed']}，用时 {time.perf_counter() - t0:.0f}s")
+    print(f"📄 清单: {manifest_path}")
+    return 0 if counts["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+// Prompt 构建与模型 JSON 解析的基准测试
+//
+//   npm run bench                       # 运行并与 bench/baseline.json 对比，回退超过阈值时退出码为 1
+//   npm run bench -- --save             # 运行并把结果写为新的基线（连同 commit 一起提交）
+//   npm run bench -- --filter parse     # 只运行名称包含 parse 的用例
+//   npm run bench -- --threshold 0.3    # 回退阈值（默认 0.2，即中位数慢 20%）
+//   npm run bench -- --json out.json    # 同时把本次结果写入文件
+//
+// 输入为 bench/fixtures 中录制的真实大小模型响应；micro 用例测单个函数，macro 用例按 5 个姿势走一遍
+// 流水线中的全部 prompt 构建与响应解析
+
+import { execSync } from 'node:child_process';
+import { readFileSync, writeFileSync, existsSync } from 'node:fs';
+import { arch, cpus, platform } from 'node:os';
+import { parseModelJson } from '../functions/utils/modelJson';
+import {
+  buildAnalyzePrompt,
+  buildComparisonPrompt,
+  buildDesignPrompt,
+  buildGenerationPrompt,
+  buildInputReviewPrompt,
+  buildPromptReviewText,
+  refinePromptText,
+} from '../functions/utils/prompts';
+
+interface BenchResult {
+  name: string;
+  group: 'micro' | 'macro';
+  medianNs: number;
+  p99Ns: number;
+  meanNs: number;
+  opsPerSec: number;
+  samples: number;
+}
+
+interface Baseline {
+  commit: string;
+  node: string;
+  cpu: string;
+  createdAt: string;
+  results: Record<string, BenchResult>;
+}
+
+const BASELINE_PATH = new URL('./baseline.json', import.meta.url);
+const PHOTO_TYPES = ['正面头像', '侧面头像', '肖像照', '半身照', '全身照'];
+const SAMPLE_TARGET_MS = 2; // 每个样本至少运行这么久，避免计时器精度影响结果
+const WARMUP_MS = 100;
+
+function fixture(name: string): string {
+  return readFileSync(new URL(`./fixtures/${name}`, import.meta.url), 'utf8');
+}
+
+const responses = {
+  analyze: fixture('analyze.txt'),
+  design: fixture('design.txt'),
+  reviewPrompt: fixture('reviewPrompt.txt'),
+  reviewResult: fixture('reviewResult.txt'),
+  reviewInput: fixture('reviewInput.txt'),
+  chatty: fixture('chatty.txt'),
+};
+const person = parseModelJson(responses.analyze);
+const design = parseModelJson(responses.design);
+const promptReview = parseModelJson(responses.reviewPrompt);
+const generationPrompt = buildGenerationPrompt(person, design, '正面头像');
+
+// 重构前各处复制的写法，作为对照
+function legacyParse(text: string): any {
+  return JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+}
+
+// 防止结果被优化掉
+let sink = 0;
+function consume(value: unknown) {
+  sink ^= typeof value === 'string' ? value.length : value ? 1 : 0;
+}
+
+const cases: Array<{ name: string; group: 'micro' | 'macro'; fn: () => unknown }> = [
+  { name: 'parse/legacy-regex analyze', group: 'micro', fn: () => legacyParse(responses.analyze) },
+  { name: 'parse/modelJson analyze', group: 'micro', fn: () => parseModelJson(responses.analyze) },
+  { name: 'parse/legacy-regex reviewResult', group: 'micro', fn: () => legacyParse(responses.reviewResult) },
+  { name: 'parse/modelJson reviewResult', group: 'micro', fn: () => parseModelJson(responses.reviewResult) },
+  { name: 'parse/modelJson chatty', group: 'micro', fn: () => parseModelJson(responses.chatty) },
+  { name: 'prompt/analyze', group: 'micro', fn: () => buildAnalyzePrompt() },
+  { name: 'prompt/inputReview', group: 'micro', fn: () => buildInputReviewPrompt() },
+  { name: 'prompt/design', group: 'micro', fn: () => buildDesignPrompt(person, '半身照') },
+  { name: 'prompt/generation', group: 'micro', fn: () => buildGenerationPrompt(person, design, '正面头像') },
+  { name: 'prompt/comparison', group: 'micro', fn: () => buildComparisonPrompt('', '', person, '侧面头像') },
+  { name: 'prompt/promptReview', group: 'micro', fn: () => buildPromptReviewText(generationPrompt, '正面头像', 1) },
+  { name: 'prompt/refine', group: 'micro', fn: () => refinePromptText(generationPrompt, promptReview) },
+  {
+    // 一张照片的 5 个姿势：分析 + 每个姿势的设计、prompt、prompt 评审、细化、结果评审
+    name: 'pipeline/5 poses',
+    group: 'macro',
+    fn: () => {
+      const analyzed = parseModelJson(responses.analyze);
+      consume(buildAnalyzePrompt());
+      for (const photoType of PHOTO_TYPES) {
+        consume(buildDesignPrompt(analyzed, photoType));
+        const poseDesign = parseModelJson(responses.design);
+        const prompt = buildGenerationPrompt(analyzed, poseDesign, photoType);
+        consume(buildPromptReviewText(prompt, photoType, 1));
+        const review = parseModelJson(responses.reviewPrompt);
+        consume(refinePromptText(prompt, review));
+        consume(buildComparisonPrompt('', '', analyzed, photoType));
+        consume(parseModelJson(responses.reviewResult));
+      }
+      return analyzed;
+    },
+  },
+];
+
+function runBatch(fn: () => unknown, iterations: number): number {
+  const start = process.hrtime.bigint();
+  for (let i = 0; i < iterations; i++) {
+    consume(fn());
+  }
+  return Number(process.hrtime.bigint() - start);
+}
+
+function percentile(sorted: number[], p: number): number {
+  return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+function measure(name: string, group: 'micro' | 'macro', fn: () => unknown, timeMs: number): BenchResult {
+  // 预热并估算每个样本需要的迭代次数
+  let iterations = 1;
+  const warmupEnd = Date.now() + WARMUP_MS;
+  while (Date.now() < warmupEnd) {
+    const ns = runBatch(fn, iterations);
+    if (ns < SAMPLE_TARGET_MS * 1e6) iterations *= 2;
+  }
+
+  const perOp: number[] = [];
+  const end = Date.now() + timeMs;
+  while (Date.now() < end || perOp.length < 10) {
+    perOp.push(runBatch(fn, iterations) / iterations);
+  }
+  perOp.sort((a, b) => a - b);
+  const meanNs = perOp.reduce((sum, ns) => sum + ns, 0) / perOp.length;
+  const medianNs = percentile(perOp, 0.5);
+  return {
+    name,
+    group,
+    medianNs: Math.round(medianNs),
+    p99Ns: Math.round(percentile(perOp, 0.99)),
+    meanNs: Math.round(meanNs),
+    opsPerSec: Math.round(1e9 / medianNs),
+    samples: perOp.length,
+  };
+}
+
+// 解析结果必须与旧写法一致（旧写法能解析的输入）；chatty 响应旧写法会失败
+function checkParser() {
+  for (const key of ['analyze', 'design', 'reviewPrompt', 'reviewResult', 'reviewInput'] as const) {
+    const expected = JSON.stringify(legacyParse(responses[key]));
+    const actual = JSON.stringify(parseModelJson(responses[key]));
+    if (expected !== actual) {
+      throw new Error(`parseModelJson result differs from legacy parser for ${key}`);
+    }
+  }
+  if (parseModelJson(responses.chatty).approved !== false) {
+    throw new Error('parseModelJson failed to extract JSON from chatty response');
+  }
+}
+
+function gitCommit(): string {
+  try {
+    return execSync('git rev-parse --short HEAD', { stdio: ['ignore', 'pipe', 'ignore'] }).toString().trim();
+  } catch {
+    return 'unknown';
+  }
+}
+
+function formatNs(ns: number): string {
+  if (ns >= 1e6) return `${(ns / 1e6).toFixed(2)}ms`;
+  if (ns >= 1e3) return `${(ns / 1e3).toFixed(2)}µs`;
+  return `${ns}ns`;
+}
+
+function parseArgs(argv: string[]) {
+  const args = { save: false, filter: '', threshold: 0.2, timeMs: 500, json: '' };
+  for (let i = 0; i < argv.length; i++) {
+    const arg = argv[i];
+    if (arg === '--save') args.save = true;
+    else if (arg === '--filter') args.filter = argv[++i] || '';
+    else if (arg === '--threshold') args.threshold = parseFloat(argv[++i]);
+    else if (arg === '--time') args.timeMs = parseInt(argv[++i], 10);
+    else if (arg === '--json') args.json = argv[++i] || '';
+  }
+  return args;
+}
+
+function main() {
+  const args = parseArgs(process.argv.slice(2));
+  checkParser();
+
+  const baseline: Baseline | undefined = existsSync(BASELINE_PATH)
+    ? JSON.parse(readFileSync(BASELINE_PATH, 'utf8'))
+    : undefined;
+  if (baseline) {
+    console.log(`Baseline: ${baseline.commit} (${baseline.createdAt}, node ${baseline.node})`);
+  } else {
+    console.log('No baseline yet; run with --save to record one.');
+  }
+
+  const results: BenchResult[] = [];
+  const regressions: string[] = [];
+  for (const c of cases) {
+    if (args.filter && !c.name.includes(args.filter)) continue;
+    const result = measure(c.name, c.group, c.fn, args.timeMs);
+    results.push(result);
+
+    const base = baseline?.results[c.name];
+    let delta = '';
+    if (base) {
+      const change = result.medianNs / base.medianNs - 1;
+      delta = `${change >= 0 ? '+' : ''}${(change * 100).toFixed(1)}%`;
+      if (change > args.threshold) {
+        regressions.push(`${c.name}: ${formatNs(base.medianNs)} -> ${formatNs(result.medianNs)} (${delta})`);
+        delta += '  REGRESSION';
+      }
+    }
+    console.log(
+      `${c.group.padEnd(5)}  ${c.name.padEnd(34)} median ${formatNs(result.medianNs).padStart(9)}` +
+      `  p99 ${formatNs(result.p99Ns).padStart(9)}  ${String(result.opsPerSec).padStart(9)} ops/s  ${delta}`
+    );
+  }
+
+  const run: Baseline = {
+    commit: gitCommit(),
+    node: process.version,
+    cpu: `${cpus()[0]?.model || 'unknown'} (${platform()}/${arch()})`,
+    createdAt: new Date().toISOString(),
+    results: Object.fromEntries(results.map(r => [r.name, r])),
+  };
+  if (args.json) {
+    writeFileSync(args.json, JSON.stringify(run, null, 2) + '\n');
+  }
+  if (args.save) {
+    // 只覆盖本次运行过的用例，--filter 时保留其他用例的基线
+    const merged = { ...run, results: { ...(baseline?.results || {}), ...run.results } };
+    writeFileSync(BASELINE_PATH, JSON.stringify(merged, null, 2) + '\n');
+    console.log(`Baseline saved to bench/baseline.json (${run.commit})`);
+  }
+
+  if (sink === -1) console.log(sink);
+  if (regressions.length > 0 && !args.save) {
+    console.error(`\n${regressions.length} regression(s) over ${(args.threshold * 100).toFixed(0)}%:`);
+    for (const r of regressions) console.error(`  ${r}`);
+    process.exit(1);
+  }
+}
+
+main();
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Gemini 调用录制管理 - 在 GEMINI_BACKEND=record / replay 的服务上导出、导入、清空 cassette
+
+用法:
+    # 真实 Gemini 跑一遍并录制，然后保存到磁盘
+    GEMINI_BACKEND=record npm run e2e:cli
+    python cassette.py export fixtures/cassettes/e2e.json
+
+    # 离线回放：导入录制，按 0.1 倍录制耗时回放（REPLAY_LATENCY_FACTOR=0 时只剩服务端开销）
+    GEMINI_BACKEND=replay REPLAY_LATENCY_FACTOR=0.1 CASSETTE=fixtures/cassettes/e2e.json npm run e2e:cli
+    python cassette.py import fixtures/cassettes/e2e.json
+
+    python cassette.py stats       # 录制条数、回放命中/未命中与录制耗时
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+from job_stream import ApiError, post_action
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+IMPORT_BATCH = 20  # 每次导入的条数；生成类响应含整张图片，避免单个请求过大
+
+
+def export_cassette(args) -> int:
+    entries = post_action(args.base_url, args.code, "cassette", {"op": "export"}, timeout=300)["result"]["entries"]
+    entries.sort(key=lambda e: e["recordedAt"])
+    os.makedirs(os.path.dirname(args.path) or ".", exist_ok=True)
+    with open(args.path, "w", encoding="utf-8") as f:
+        json.dump({"exported_at": datetime.now().isoformat(), "entries": entries}, f, ensure_ascii=False)
+    models = Counter(e["model"] for e in entries)
+    failed = sum(1 for e in entries if e.get("error"))
+    print(f"✅ 已导出 {len(entries)} 条录制到 {args.path}（失败 {failed} 条）")
+    for model, count in models.most_common():
+        print(f"   {model:<32} {count}")
+    return 0
+
+
+def import_cassette(args) -> int:
+    with open(args.path, encoding="utf-8") as f:
+        entries = json.load(f)["entries"]
+    if not args.append:
+        post_action(args.base_url, args.code, "cassette", {"op": "clear"})
+    for start in range(0, len(entries), IMPORT_BATCH):
+        batch = entries[start:start + IMPORT_BATCH]
+        post_action(args.base_url, args.code, "cassette", {"op": "import", "entries": batch}, timeout=300)
+    print(f"✅ 已导入 {len(entries)} 条录制")
+    return 0
+
+
+def clear_cassette(args) -> int:
+    post_action(args.base_url, args.code, "cassette", {"op": "clear"})
+    print("✅ 已清空 cassette")
+    return 0
+
+
+def show_stats(args) -> int:
+    stats = post_action(args.base_url, args.code, "stats")["result"].get("cassette")
+    if not stats:
+        print("当前实例还没有录制或回放过调用")
+        return 0
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    return 1 if stats.get("misses") else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini 调用录制管理")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--code", default=INVITE_CODE, help="邀请码")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="把服务端的录制保存到文件")
+    p.add_argument("path")
+    p.set_defaults(func=export_cassette)
+    p = sub.add_parser("import", help="把文件中的录制导入服务端（默认先清空）")
+    p.add_argument("path")
+    p.add_argument("--append", action="store_true", help="保留服务端已有的录制")
+    p.set_defaults(func=import_cassette)
+    sub.add_parser("clear", help="清空服务端的录制").set_defaults(func=clear_cassette)
+    sub.add_parser("stats", help="显示录制 / 回放统计，有未命中时退出码为 1").set_defaults(func=show_stats)
+    args = parser.parse_args()
+
+    try:
+        return args.func(args)
+    except ApiError as e:
+        print(f"❌ {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+pytest fixture - E2E 用例共享浏览器与登录状态
+
+    pytest ui_quick_test.py test_iteration_workflow.py ui_acceptance_test.py \\
+        --images "sys_init/*.jpeg" --poses 正面头像,肖像照 --poses all
+
+- browser：整个测试会话一个 Chromium（HEADLESS=0 显示窗口，SLOW_MO 毫秒）
+- auth_state：只登录一次（邀请码），之后所有 context 复用其 storage_state；使用协议每个页面勾选一次
+- context / page：每个用例独立的已登录 context，page 停在上传步骤
+- test_image / pose_subset：按 --images / --poses 参数化；未指定时使用测试模块的
+  TEST_IMAGE / SELECTED_POSES，再没有则为 sys_init 全部图片 / 全部姿势
+- 未安装 Playwright、服务未启动或没有测试图片时浏览器用例跳过；API 用例（test_job_stream.py、test_resume_job.py）不需要浏览器，
+  但同样需要测试图片和已启动的服务，缺任何一项时跳过
+"""
+
+import os
+import re
+from pathlib import Path
+
+import pytest
+
+from e2e_session import ALL_POSES, BASE_URL, IMAGE_DIR, E2ESession, collect_images, launch_session, parse_pose_subsets
+from job_stream import server_reachable
+
+PYTEST_OUTPUT_DIR = Path("e2e-test-output") / "pytest"
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("e2e", "E2E 参数化")
+    group.addoption("--images", default=os.environ.get("E2E_IMAGES"),
+                    help="测试图片：目录、单个文件或 glob（默认为测试模块的 TEST_IMAGE，没有则为 sys_init）")
+    group.addoption("--poses", action="append", default=None,
+                    help="姿势子集，逗号分隔；可重复指定，'all' 为全部姿势")
+
+
+def pytest_generate_tests(metafunc):
+    if "test_image" in metafunc.fixturenames:
+        spec = metafunc.config.getoption("images") or getattr(metafunc.module, "TEST_IMAGE", IMAGE_DIR)
+        try:
+            images = collect_images(spec)
+        except FileNotFoundError as e:
+            # 测试图片不在仓库中（sys_init 需自行准备），缺少时跳过而不是收集失败
+            metafunc.parametrize("test_image", [pytest.param(None, marks=pytest.mark.skip(reason=str(e)))])
+        else:
+            metafunc.parametrize("test_image", images, ids=[p.stem for p in images])
+    if "pose_subset" in metafunc.fixturenames:
+        subsets = parse_pose_subsets(metafunc.config.getoption("poses"))
+        if not subsets:
+            subsets = [list(getattr(metafunc.module, "SELECTED_POSES", ALL_POSES))]
+        metafunc.parametrize("pose_subset", subsets, ids=["+".join(s) for s in subsets])
+
+
+@pytest.fixture(scope="session")
+def e2e_session():
+    pytest.importorskip("playwright.sync_api")
+    if not server_reachable(BASE_URL):
+        pytest.skip(f"服务不可达: {BASE_URL}")
+    headless = os.environ.get("HEADLESS", "1") == "1"
+    slow_mo = int(os.environ.get("SLOW_MO", "0"))
+    with launch_session(headless=headless, slow_mo=slow_mo) as session:
+        yield session
+
+
+@pytest.fixture(scope="session")
+def browser(e2e_session: E2ESession):
+    return e2e_session.browser
+
+
+@pytest.fixture(scope="session")
+def auth_state(e2e_session: E2ESession):
+    return e2e_session.storage_state
+
+
+@pytest.fixture
+def run_dir(request):
+    """每个用例自己的输出目录（截图、视频、报告）"""
+    name = re.sub(r"[^\w.+-]+", "_", request.node.name).strip("_")
+    path = PYTEST_OUTPUT_DIR / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@pytest.fixture
+def context(e2e_session: E2ESession, auth_state):
+    ctx = e2e_session.new_context()
+    yield ctx
+    ctx.close()
+
+
+@pytest.fixture
+def page(e2e_session: E2ESession, context):
+    return e2e_session.new_page(context)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+E2E 会话复用 - 一个浏览器 + 一次登录，之后每个用例只新建 context
+
+登录（邀请码 + 使用协议）只做一次，结果保存为 storage_state（localStorage 中的
+invite_code），之后新建的 context 打开首页直接进入使用协议步骤。使用协议的同意只保存在
+页面状态中（前端原有行为，不做持久化），新页面在 open_upload_step 中勾选同意后停在上传步骤。
+
+用法（脚本）:
+    with launch_session(headless=True) as session:
+        page = session.new_page()          # 已在上传步骤
+        select_poses(page, ["正面头像"])
+
+用法（pytest）: 见 conftest.py 中的 browser / auth_state / context / page fixture
+"""
+
+import glob
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+# IMAGE_PREPROCESS=legacy 时前端使用旧的主线程压缩，用于对比 Worker 预处理前后的上传与分析耗时
+IMAGE_PREPROCESS = os.environ.get("IMAGE_PREPROCESS", "")
+IMAGE_DIR = "sys_init"
+ALL_POSES = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
+VIEWPORT = {"width": 1400, "height": 900}
+# 协议页正文里也有“上传照片”字样，按步骤标题区分
+UPLOAD_HEADING = "h2:has-text('上传照片')"
+CONSENT_HEADING = "h2:has-text('使用协议')"
+SUPPORTED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tiff"}
+
+
+def enter_invite_code(page, code=INVITE_CODE):
+    """在邀请码页输入邀请码并进入下一步"""
+    page.locator("form input[type='text']").fill(code)
+    page.locator("form button[type='submit']").click()
+
+
+def accept_consent(page):
+    """勾选并同意使用协议"""
+    page.wait_for_selector(CONSENT_HEADING, timeout=5000)
+    page.locator("input[type='checkbox']").check()
+    page.locator("button:has-text('同意并继续')").click()
+
+
+def login(page, base_url=BASE_URL, code=INVITE_CODE):
+    """完整登录流程：首页 → 邀请码 → 使用协议 → 上传步骤"""
+    page.goto(base_url, wait_until="networkidle")
+    enter_invite_code(page, code)
+    accept_consent(page)
+    page.wait_for_selector(UPLOAD_HEADING, timeout=5000)
+
+
+def open_upload_step(page, base_url=BASE_URL):
+    """用已登录的 context 打开首页，同意使用协议后停在上传步骤"""
+    page.goto(base_url, wait_until="networkidle")
+    page.locator(UPLOAD_HEADING).or_(page.locator(CONSENT_HEADING)).first.wait_for(timeout=10000)
+    if page.locator(CONSENT_HEADING).count() > 0:
+        accept_consent(page)
+        page.wait_for_selector(UPLOAD_HEADING, timeout=5000)
+
+
+def select_poses(page, poses):
+    """在姿势选择页只保留 poses（默认全部选中）"""
+    page.wait_for_selector("text=选择姿势", timeout=10000)
+    for pose in ALL_POSES:
+        checkbox = page.locator("label", has_text=pose).locator("input[type='checkbox']")
+        checkbox.set_checked(pose in poses)
+
+
+def collect_images(spec=IMAGE_DIR):
+    """图片目录、单个文件或 glob → 排序后的图片列表"""
+    path = Path(spec)
+    if path.is_dir():
+        candidates = path.iterdir()
+    elif path.is_file():
+        candidates = [path]
+    else:
+        candidates = (Path(p) for p in glob.glob(spec))
+    images = sorted(p for p in candidates if p.is_file() and p.suffix.lower() in SUPPORTED_IMAGE_EXTS)
+    if not images:
+        raise FileNotFoundError(f"没有可用图片: {spec}")
+    return images
+
+
+def parse_pose_subsets(values):
+    """["正面头像,肖像照", "all"] → [["正面头像", "肖像照"], ALL_POSES]"""
+    subsets = []
+    for value in values or []:
+        if value.strip().lower() == "all":
+            subsets.append(list(ALL_POSES))
+            continue
+        poses = [p.strip() for p in value.split(",") if p.strip()]
+        unknown = [p for p in poses if p not in ALL_POSES]
+        if unknown:
+            raise ValueError(f"未知姿势: {', '.join(unknown)}（可选: {', '.join(ALL_POSES)}）")
+        subsets.append(poses)
+    return subsets
+
+
+class E2ESession:
+    """共享一个浏览器；首次需要时登录一次并缓存 storage_state"""
+
+    def __init__(self, browser, base_url=BASE_URL, invite_code=INVITE_CODE):
+        self.browser = browser
+        self.base_url = base_url
+        self.invite_code = invite_code
+        self._storage_state = None
+
+    @property
+    def storage_state(self):
+        if self._storage_state is None:
+            context = self.browser.new_context(viewport=VIEWPORT)
+            try:
+                login(context.new_page(), self.base_url, self.invite_code)
+                self._storage_state = context.storage_state()
+            finally:
+                context.close()
+        return self._storage_state
+
+    def new_context(self, authenticated=True, **kwargs):
+        kwargs.setdefault("viewport", VIEWPORT)
+        if authenticated:
+            kwargs["storage_state"] = self.storage_state
+        context = self.browser.new_context(**kwargs)
+        if IMAGE_PREPROCESS:
+            context.add_init_script(f"localStorage.setItem('image_preprocess', {IMAGE_PREPROCESS!r})")
+        return context
+
+    def new_page(self, context=None, **kwargs):
+        """已登录的新页面，停在上传步骤；不传 context 时新建一个"""
+        page = (context or self.new_context(**kwargs)).new_page()
+        open_upload_step(page, self.base_url)
+        return page
+
+
+@contextmanager
+def launch_session(headless=True, slow_mo=0, base_url=BASE_URL, invite_code=INVITE_CODE):
+    # 用到浏览器时才导入 Playwright，只跑 API 用例（test_job_stream.py 等）时不需要安装
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=headless, slow_mo=slow_mo)
+        try:
+            yield E2ESession(browser, base_url, invite_code)
+        finally:
+            browser.close()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+E2E 阶段时间线 - 基于网络事件的等待与毫秒级计时
+
+用法:
+    timeline = StageTimeline()
+    watcher = ApiWatcher(page, timeline, expected_poses=2)
+    ...
+    timeline.mark("login")
+    watcher.wait_for("all_poses_done", timeout_ms=600000)
+    report["timeline"] = timeline.to_dict()
+    report["pose_spans"] = watcher.pose_spans()
+"""
+
+import json
+import time
+from datetime import datetime
+
+from job_stream import API_PATH, parse_sse_events
+
+
+def api_action_of(request):
+    """返回 /api/gemini 请求的 action；二进制上传通过 X-Action 头标识"""
+    if API_PATH not in request.url or request.method != "POST":
+        return None
+    header_action = request.headers.get("x-action")
+    if header_action:
+        return header_action
+    try:
+        return json.loads(request.post_data or "{}").get("action")
+    except ValueError:
+        return None
+
+
+class StageTimeline:
+    """记录每个阶段相对起点的毫秒时间戳"""
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self.started_at = datetime.now()
+        self.stages = []
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def mark(self, name: str, **extra) -> float:
+        elapsed = self.elapsed_ms()
+        self.stages.append({"name": name, "elapsed_ms": elapsed, "at": datetime.now().isoformat(), **extra})
+        return elapsed
+
+    def has(self, name: str) -> bool:
+        return any(s["name"] == name for s in self.stages)
+
+    def get(self, name: str):
+        for s in self.stages:
+            if s["name"] == name:
+                return s["elapsed_ms"]
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at.isoformat(),
+            "stages": self.stages,
+        }
+
+
+class ApiWatcher:
+    """
+    监听 /api/gemini 的响应，把后端阶段转换为时间线事件：
+
+    - upload_started: 开始上传原图（附带前端预处理摘要 X-Image-Preprocess）
+    - upload_done:   原图上传完成（uploadAsset）
+    - analysis_started / analysis_done: analyze 发出 / 返回成功
+    - pose_done:     某个任务的 getJobStatus / streamJobStatus 首次返回 completed（每个姿势一次）
+    - first_pose_done / all_poses_done
+    - pose_failed:   某个任务返回 failed
+    """
+
+    def __init__(self, page, timeline: StageTimeline, expected_poses: int = 0):
+        self.page = page
+        self.timeline = timeline
+        self.expected_poses = expected_poses
+        self.completed_jobs = {}
+        self.failed_jobs = {}
+        self.api_errors = []
+        page.on("request", self._on_request)
+        page.on("response", self._on_response)
+        page.on("requestfinished", self._on_request_finished)
+
+    @staticmethod
+    def _action_of(request):
+        return api_action_of(request)
+
+    def _on_request(self, request):
+        action = self._action_of(request)
+        if action == "uploadAsset" and not self.timeline.has("upload_started"):
+            self.timeline.mark("upload_started", preprocess=parse_preprocess_header(request.headers.get("x-image-preprocess")))
+        elif action == "analyze" and not self.timeline.has("analysis_started"):
+            self.timeline.mark("analysis_started")
+
+    def _on_response(self, response):
+        action = self._action_of(response.request)
+        # SSE 响应体要到流结束才完整，交给 _on_request_finished 处理
+        if action is None or action == "streamJobStatus":
+            return
+        try:
+            body = response.json()
+        except Exception:
+            body = {}
+
+        if not response.ok:
+            self.api_errors.append({"action": action, "status": response.status, "error": body.get("error")})
+            return
+
+        if action == "uploadAsset" and not self.timeline.has("upload_done"):
+            self.timeline.mark("upload_done", bytes=(body.get("result") or {}).get("bytes"))
+        elif action == "analyze" and not self.timeline.has("analysis_done"):
+            self.timeline.mark("analysis_done")
+        elif action == "getJobStatus":
+            self._on_job_status(body.get("result") or {})
+
+    def _on_request_finished(self, request):
+        if self._action_of(request) != "streamJobStatus":
+            return
+        response = request.response()
+        if response is None:
+            return
+        if not response.ok:
+            self.api_errors.append({"action": "streamJobStatus", "status": response.status, "error": None})
+            return
+        try:
+            events = parse_sse_events(response.text())
+        except Exception:
+            return
+        for e in events:
+            if e["event"] in ("completed", "failed"):
+                self._on_job_status(e["status"])
+
+    def _on_job_status(self, status: dict):
+        job_id = status.get("jobId")
+        if not job_id:
+            return
+        if status.get("status") == "completed" and job_id not in self.completed_jobs:
+            self.completed_jobs[job_id] = status
+            self.timeline.mark("pose_done", jobId=job_id)
+            if len(self.completed_jobs) == 1:
+                self.timeline.mark("first_pose_done")
+            if self.expected_poses and len(self.completed_jobs) >= self.expected_poses:
+                self.timeline.mark("all_poses_done")
+        elif status.get("status") == "failed" and job_id not in self.failed_jobs:
+            self.failed_jobs[job_id] = status
+            self.timeline.mark("pose_failed", jobId=job_id, error=status.get("error"))
+            if self.expected_poses and len(self.completed_jobs) + len(self.failed_jobs) >= self.expected_poses:
+                self.timeline.mark("all_poses_settled")
+
+    def pose_spans(self) -> list:
+        """每个完成/失败任务的模型调用 span（来自 getJobStatus 的 spans 字段）"""
+        poses = []
+        for job_id, status in list(self.completed_jobs.items()) + list(self.failed_jobs.items()):
+            poses.append({
+                "jobId": job_id,
+                "photoType": status.get("photoType"),
+                "status": status.get("status"),
+                "spans": status.get("spans") or [],
+            })
+        return poses
+
+    def wait_for(self, stage: str, timeout_ms: float = 600000):
+        """等待阶段出现；只在有请求完成时醒来检查，不做固定间隔轮询"""
+        deadline = time.perf_counter() + timeout_ms / 1000
+        while not self.timeline.has(stage):
+            if stage == "all_poses_done" and self.timeline.has("all_poses_settled"):
+                raise RuntimeError(f"{len(self.failed_jobs)} 个姿势生成失败")
+            remaining = (deadline - time.perf_counter()) * 1000
+            if remaining <= 0:
+                raise TimeoutError(f"等待阶段 {stage} 超时 ({timeout_ms / 1000:.0f}秒)")
+            self.page.wait_for_event("requestfinished", timeout=remaining)
+        return self.timeline.get(stage)
+
+
+def parse_preprocess_header(value):
+    """"mode=worker; ms=143; quality=0.84" → {"mode": "worker", "ms": 143, "quality": 0.84}"""
+    if not value:
+        return None
+    summary = {}
+    for part in value.split(";"):
+        key, _, raw = part.strip().partition("=")
+        if not key:
+            continue
+        try:
+            summary[key] = int(raw)
+        except ValueError:
+            try:
+                summary[key] = float(raw)
+            except ValueError:
+                summary[key] = raw
+    return summary
+
+
+def upload_metrics(timeline: StageTimeline) -> dict:
+    """上传与分析相关的指标，用于对比前端预处理前后（IMAGE_PREPROCESS=legacy 为旧流程）"""
+    def stage(name):
+        return next((s for s in timeline.stages if s["name"] == name), {})
+
+    def between(start, end):
+        a, b = timeline.get(start), timeline.get(end)
+        return round(b - a, 1) if a is not None and b is not None else None
+
+    preprocess = stage("upload_started").get("preprocess") or {}
+    return {
+        "mode": preprocess.get("mode"),
+        "preprocess_ms": preprocess.get("ms"),
+        "source_bytes": preprocess.get("source"),
+        "upload_bytes": stage("upload_done").get("bytes"),
+        "upload_ms": between("upload_started", "upload_done"),
+        "analysis_ms": between("analysis_started", "analysis_done"),
+        "upload_to_analysis_ms": between("upload_done", "analysis_done"),
+        "preprocess": preprocess or None,
+    }
+
+
+def format_upload_metrics(metrics: dict) -> str:
+    def ms(v):
+        return f"{v / 1000:.2f}s" if v is not None else "?"
+    size = _format_bytes(metrics["upload_bytes"]) if metrics.get("upload_bytes") else "?"
+    source = _format_bytes(metrics["source_bytes"]) if metrics.get("source_bytes") else "?"
+    return (f"   预处理 {metrics.get('mode') or '?'} {ms(metrics.get('preprocess_ms'))}, {source} → {size}, "
+            f"上传 {ms(metrics.get('upload_ms'))}, 分析 {ms(metrics.get('analysis_ms'))}, "
+            f"上传→分析完成 {ms(metrics.get('upload_to_analysis_ms'))}")
+
+
+def format_timeline(timeline: StageTimeline) -> str:
+    lines = []
+    for s in timeline.stages:
+        lines.append(f"   {s['elapsed_ms'] / 1000:8.3f}s  {s['name']}")
+    return "\n".join(lines)
+
+
+def _format_bytes(n: int) -> str:
+    if n >= 1024 * 1024:
+        return f"{n / 1024 / 1024:.1f}MB"
+    if n >= 1024:
+        return f"{n / 1024:.1f}KB"
+    return f"{n}B"
+
+
+def format_span_timeline(pose: dict, width: int = 40) -> str:
+    """把一个姿势的 span 画成火焰图式的文本时间线"""
+    spans = pose.get("spans") or []
+    title = f"{pose.get('photoType') or '?'} ({pose.get('jobId')})"
+    if not spans:
+        return f"   {title}: 无 span 数据"
+    total = max(s["startMs"] + s["durationMs"] for s in spans) or 1
+    lines = [f"   {title}  total {total / 1000:.2f}s"]
+    for s in spans:
+        start = min(int(s["startMs"] / total * width), width - 1)
+        length = max(1, int(s["durationMs"] / total * width))
+        bar = " " * start + "█" * min(length, width - start)
+        marker = "" if s.get("status") == "ok" else f"  [{s.get('status')}]"
+        if s.get("queueMs"):
+            marker += f"  (排队 {s['queueMs'] / 1000:.2f}s)"
+        lines.append(
+            f"     {s['stage']:<13} |{bar:<{width}}| "
+            f"{s['startMs'] / 1000:6.2f}s +{s['durationMs'] / 1000:6.2f}s  "
+            f"{s['model']}#{s['attempt']}  "
+            f"{_format_bytes(s.get('requestBytes', 0))}→{_format_bytes(s.get('responseBytes', 0))}{marker}"
+        )
+    return "\n".join(lines)
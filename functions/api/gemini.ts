@@ -1,11 +1,70 @@
 import {
   GoogleGenerativeAI,
 } from '@google/generative-ai';
+import type { GeminiClient } from '../utils/geminiClient';
+import { ModelScheduler, parseModelRates, retryAfterMsOf, type Lease, type Priority } from '../utils/modelScheduler';
+import { createStubGeminiClient, parseStubFault, parseStubOptions, withStubFault, type StubEnv } from '../utils/stubGemini';
+import {
+  CassetteMissError,
+  KVCassetteStore,
+  MemoryCassetteStore,
+  createCassetteStats,
+  createRecordingClient,
+  createReplayClient,
+  type CassetteEntry,
+  type CassetteStats,
+  type CassetteStore,
+} from '../utils/cassette';
+import { JobRecordWriter, KVJobStore, MemoryJobStore, type JobStore, type StoredJob } from '../utils/jobStore';
+import { LRUCache, sha256Hex, stableStringify } from '../utils/resultCache';
+import { BoundedMap } from '../utils/boundedMap';
+import { WorkerPool } from '../utils/workerPool';
+import { BYTES_BUCKETS, COUNT_BUCKETS, MetricsRegistry, type Labels } from '../utils/metrics';
+import { parseModelJson } from '../utils/modelJson';
+import {
+  checkGeneratedImage,
+  checkPromptText,
+  classifyFastScores,
+  createPrescreenStats,
+  parsePrescreenOptions,
+  recordFullReview,
+  recordPrescreen,
+  scoreOf,
+  summarizePrescreen,
+  type PrescreenDecision,
+  type PrescreenEnv,
+  type PrescreenOptions,
+  type PrescreenStage,
+} from '../utils/prescreen';
+import {
+  buildAnalyzePrompt,
+  buildComparisonPrompt,
+  buildDesignPrompt,
+  buildGenerationPrompt,
+  buildInputReviewPrompt,
+  buildPromptPrescreenText,
+  buildPromptReviewText,
+  buildResultPrescreenPrompt,
+  refinePromptText,
+} from '../utils/prompts';
+import {
+  AssetNotFoundError,
+  MemoryAssetStore,
+  R2AssetStore,
+  assetIdOf,
+  base64ToBytes,
+  imagePartFromAsset,
+  imagePartFromDataUrl,
+  isAssetId,
+  type AssetStore,
+  type ImagePart,
+} from '../utils/assetStore';
 
 // --- Types ---
 
-interface Env {
+interface Env extends StubEnv, PrescreenEnv {
   GEMINI_API_KEY: string;
+  GEMINI_BACKEND?: string; // 'stub' 使用离线替身，'record' / 'replay' 录制或回放调用，默认调用真实 Gemini
   INVITE_CODES?: string;
   API_SECRET?: string;
   FAST_MODEL?: string;
@@ -23,6 +82,31 @@ interface Env {
   ENABLE_RATE_LIMIT?: string;
   RATE_LIMIT_REQUESTS?: string;
   RATE_LIMIT_WINDOW?: string;
+  JOBS_KV?: KVNamespace;
+  JOB_TTL_SECONDS?: string;
+  MAX_JOB_RESULT_BYTES?: string;
+  MAX_JOBS_IN_MEMORY?: string;
+  MAX_JOB_MEMORY_BYTES?: string;
+  BATCH_CONCURRENCY?: string;
+  BATCH_MAX_ITEMS?: string;
+  JOB_DEDUP_TTL_SECONDS?: string;
+  RESULT_CACHE_TTL_SECONDS?: string;
+  RESULT_CACHE_MAX_ENTRIES?: string;
+  MAX_CONCURRENT_MODEL_CALLS?: string;
+  MODEL_RATE_PER_MINUTE?: string;
+  MODEL_RATE_LIMITS?: string;
+  MODEL_BURST?: string;
+  MODEL_COOLDOWN_MS?: string;
+  MODEL_QUEUE_TIMEOUT_MS?: string;
+  SPECULATIVE_CANDIDATES?: string;
+  ASSETS_BUCKET?: R2Bucket;
+  MAX_ASSET_BYTES?: string;
+  ASSET_MEMORY_LIMIT_BYTES?: string;
+  ASSET_TTL_SECONDS?: string;
+  CASSETTE_KV?: KVNamespace;
+  CASSETTE_MEMORY_LIMIT_BYTES?: string;
+  REPLAY_LATENCY_FACTOR?: string;
+  METRICS_TOKEN?: string;
 }
 
 interface Config {
@@ -57,65 +141,483 @@ const DEFAULT_ENV: Partial<Env> = {
 const ITERATION_LIMITS = {
   MAX_PROMPT_ITERATIONS: 2,
   MAX_GENERATION_ITERATIONS: 2,
+  MAX_SPECULATIVE_CANDIDATES: 4,
 };
 
-const codeUsage = new Map<string, number>();
+// 邀请码使用次数（当前实例）：24 小时无使用后清零，最多记录 1000 个邀请码
+const codeUsage = new BoundedMap<string, number>({ maxEntries: 1000, ttlMs: 24 * 3600 * 1000 });
 
-// 任务存储 (使用全局内存存储，适合单实例；生产环境建议使用 KV 或 Durable Objects)
-interface Job {
-  id: string;
+// 任务存储：绑定 JOBS_KV 时跨实例共享；否则使用当前实例内存 (带 TTL、数量与内存上限)
+interface Job extends StoredJob {
   status: 'pending' | 'processing' | 'completed' | 'failed';
   action: string;
-  data: any;
+  data: any; // 仅保存任务参数摘要，不保存图片
   result?: any;
+  spans?: ModelCallSpan[];
+  progress?: JobProgress;
+  progressLog?: JobProgress[]; // 全部步骤，按发生顺序
+  contentKey?: string; // 图片 + 参数的哈希，用于合并重复提交
+  checkpoint?: PoseCheckpoint; // processPose 各阶段的中间结果，失败后 resumeJob 从这里继续
+  attempts?: Array<{ error?: string; spans?: ModelCallSpan[] }>; // 恢复前各次失败的错误与 span
+  resumeToken?: string; // 最近一次 resumeJob 写入的标记，写入后读回比较；KV 没有条件写入，跨实例只能尽力而为
+  batch?: { items: BatchItem[] }; // action 为 batch 时的清单
+}
+
+// 批量任务：多张图片 × 各自选择的姿势；每个姿势是一个普通的 processPose 子任务（有自己的 jobId、进度与检查点）
+interface BatchPose {
+  photoType: string;
+  jobId: string;
+  status: Job['status'];
+  image?: string;   // 生成图地址
+  imageId?: string;
+  review?: any;
   error?: string;
-  createdAt: number;
-  updatedAt: number;
+  updatedAt?: number;
+}
+
+interface BatchItem {
+  name: string;
+  imageId: string;
+  poses: BatchPose[];
+}
+
+let memoryJobStore: MemoryJobStore<Job> | undefined;
+
+function getJobStore(env: Env): JobStore<Job> {
+  const options = {
+    ttlMs: (parseInt(env.JOB_TTL_SECONDS || '') || 3600) * 1000,
+    maxResultBytes: parseInt(env.MAX_JOB_RESULT_BYTES || '') || 8 * 1024 * 1024,
+  };
+  if (env.JOBS_KV) {
+    return new KVJobStore<Job>(env.JOBS_KV, options);
+  }
+  if (!memoryJobStore) {
+    memoryJobStore = new MemoryJobStore<Job>({
+      ...options,
+      maxJobs: parseInt(env.MAX_JOBS_IN_MEMORY || '') || 200,
+      maxBytes: parseInt(env.MAX_JOB_MEMORY_BYTES || '') || 64 * 1024 * 1024,
+    });
+  }
+  return memoryJobStore;
+}
+
+// 批量任务的工作池：当前实例所有批量任务共享同一个姿势并发上限
+let batchPool: WorkerPool | undefined;
+
+function getBatchPool(env: Env): WorkerPool {
+  if (!batchPool) {
+    batchPool = new WorkerPool(parseInt(env.BATCH_CONCURRENCY || '') || 4);
+  }
+  return batchPool;
+}
+
+// 人脸分析 / 设计结果缓存 (当前实例内存)
+let resultCache: LRUCache<any> | undefined;
+
+function getResultCache(env: Env): LRUCache<any> {
+  if (!resultCache) {
+    resultCache = new LRUCache<any>({
+      maxEntries: parseInt(env.RESULT_CACHE_MAX_ENTRIES || '') || 500,
+      ttlMs: (parseInt(env.RESULT_CACHE_TTL_SECONDS || '') || 6 * 3600) * 1000,
+    });
+  }
+  return resultCache;
+}
+
+// 模型调用调度器，当前实例的所有请求共享；首次请求时按环境变量创建
+let modelScheduler: ModelScheduler | undefined;
+
+function getModelScheduler(env: Partial<Env> = {}): ModelScheduler {
+  if (!modelScheduler) {
+    const cooldownMs = parseInt(env.MODEL_COOLDOWN_MS || '') || 30000;
+    modelScheduler = new ModelScheduler({
+      // 未配置时不限制在途调用数，只由各模型的令牌桶限速
+      maxInFlight: parseInt(env.MAX_CONCURRENT_MODEL_CALLS || '') || Infinity,
+      ratePerMinute: parseFloat(env.MODEL_RATE_PER_MINUTE || '') || 60,
+      modelRates: parseModelRates(env.MODEL_RATE_LIMITS),
+      burst: parseInt(env.MODEL_BURST || '') || 10,
+      cooldownMs,
+      maxCooldownMs: cooldownMs * 8,
+      queueTimeoutMs: parseInt(env.MODEL_QUEUE_TIMEOUT_MS || '') || 120000,
+    });
+  }
+  return modelScheduler;
 }
 
-const jobs = new Map<string, Job>();
+// 图片资源存储：绑定 R2 时使用 ASSETS_BUCKET，否则使用当前实例内存
+let memoryAssetStore: MemoryAssetStore | undefined;
+
+function getAssetStore(env: Env): AssetStore {
+  if (env.ASSETS_BUCKET) {
+    return new R2AssetStore(env.ASSETS_BUCKET);
+  }
+  if (!memoryAssetStore) {
+    memoryAssetStore = new MemoryAssetStore({
+      maxBytes: parseInt(env.ASSET_MEMORY_LIMIT_BYTES || '') || 64 * 1024 * 1024,
+      ttlMs: (parseInt(env.ASSET_TTL_SECONDS || '') || 3600) * 1000,
+    });
+  }
+  return memoryAssetStore;
+}
+
+// Gemini 调用录制 (GEMINI_BACKEND=record / replay)：绑定 CASSETTE_KV 时写入 KV，否则使用当前实例内存
+let memoryCassetteStore: MemoryCassetteStore | undefined;
+let cassetteStats: CassetteStats | undefined;
+
+function getCassetteStore(env: Env): CassetteStore {
+  if (env.CASSETTE_KV) {
+    return new KVCassetteStore(env.CASSETTE_KV);
+  }
+  if (!memoryCassetteStore) {
+    memoryCassetteStore = new MemoryCassetteStore({
+      maxEntries: 10000,
+      maxBytes: parseInt(env.CASSETTE_MEMORY_LIMIT_BYTES || '') || 64 * 1024 * 1024,
+    });
+  }
+  return memoryCassetteStore;
+}
+
+function getCassetteStats(mode: CassetteStats['mode']): CassetteStats {
+  if (!cassetteStats || cassetteStats.mode !== mode) {
+    cassetteStats = createCassetteStats(mode);
+  }
+  return cassetteStats;
+}
+
+// 指标（当前实例）：metrics action 以 Prometheus 文本格式输出
+// action 标签只取已知的 action，其余记为 other，避免任意字符串生成新的时间序列
+const METRIC_ACTIONS = new Set([
+  'uploadAsset', 'analyze', 'design', 'generate', 'review', 'reviewInput', 'reviewPrompt', 'reviewResult',
+  'processAll', 'processPose', 'submitJob', 'resumeJob', 'submitBatch', 'getBatchStatus', 'streamBatch',
+  'getJobStatus', 'streamJobStatus', 'stats', 'cassette', 'metrics',
+]);
+const metrics = new MetricsRegistry();
+const requestsTotal = metrics.counter('gemini_requests_total', 'API requests by action and HTTP status');
+const requestDuration = metrics.histogram('gemini_request_duration_seconds', 'Time to produce the response (streams: until headers)');
+const requestBytesHistogram = metrics.histogram('gemini_request_bytes', 'Request body size', BYTES_BUCKETS);
+const responseBytesHistogram = metrics.histogram('gemini_response_bytes', 'JSON response body size', BYTES_BUCKETS);
+const modelCalls = metrics.counter('gemini_model_calls_total', 'Model calls by stage, model and outcome (ok, rate_limited, error)');
+const modelCallDuration = metrics.histogram('gemini_model_call_duration_seconds', 'Model call latency, excluding scheduler queueing');
+const modelQueueDuration = metrics.histogram('gemini_model_queue_seconds', 'Time spent waiting in the model scheduler');
+const modelFallbacks = metrics.counter('gemini_model_fallbacks_total', 'Model calls served by a model other than the first candidate');
+const modelPayloadBytes = metrics.histogram('gemini_model_payload_bytes', 'Model request / response payload size', BYTES_BUCKETS);
+const jobsTotal = metrics.counter('gemini_jobs_total', 'Background jobs finished by action and status');
+const jobStoreWriteFailures = metrics.counter('gemini_job_store_write_failures_total', 'Final job status writes that failed after retries');
+const jobDuration = metrics.histogram('gemini_job_duration_seconds', 'Background job duration', [1, 5, 10, 20, 40, 60, 90, 120, 180, 300, 600]);
+const prescreenDecisions = metrics.counter('gemini_prescreen_decisions_total', 'Review pre-screen decisions by stage, tier and verdict');
+const poseIterations = metrics.histogram('gemini_pose_iterations', 'Prompt / generation iterations per finished pose', COUNT_BUCKETS);
+let jobsInFlight = 0;
+metrics.gauge('gemini_jobs_in_flight', 'Background jobs currently running on this instance', () => jobsInFlight);
+metrics.gauge('gemini_scheduler_queue_depth', 'Model calls waiting in the scheduler by priority', () => {
+  const queued = modelScheduler?.stats().queued ?? { interactive: 0, background: 0 };
+  return [[{ priority: 'interactive' }, queued.interactive], [{ priority: 'background' }, queued.background]];
+});
+metrics.gauge('gemini_scheduler_in_flight', 'Model calls currently holding a scheduler slot', () => modelScheduler?.stats().inFlight ?? 0);
+metrics.gauge('gemini_batch_pool', 'Batch worker pool slots by state', () => {
+  const stats = batchPool?.stats() ?? { active: 0, queued: 0 };
+  return [[{ state: 'active' }, stats.active], [{ state: 'queued' }, stats.queued]];
+});
+metrics.gauge('gemini_memory_table_bytes', 'Accounted bytes of in-memory tables', () => {
+  const tables: Record<string, { bytes: number }> = { codeUsage: codeUsage.stats(), ...(memoryJobStore?.stats() ?? {}) };
+  if (memoryAssetStore) tables.assets = { bytes: memoryAssetStore.bytes };
+  return Object.entries(tables).map(([table, stats]): [Labels, number] => [{ table }, stats.bytes]);
+});
+metrics.gauge('gemini_prescreen_saved_seconds', 'Estimated review latency saved by the pre-screen (negative when escalations cost more)', () =>
+  Object.entries(prescreenStats.stages).map(([stage, s]): [Labels, number] => [{ stage }, s.savedMs / 1000]));
+metrics.gauge('gemini_result_cache_hit_ratio', 'Analysis / design result cache hit ratio', () => resultCache?.stats().hitRate ?? 0);
+
+function metricAction(action: unknown): string {
+  return typeof action === 'string' && METRIC_ACTIONS.has(action) ? action : 'other';
+}
+
+// 按 ID 或 data URL 取得图片；ID 优先
+async function resolveImage(store: AssetStore, image?: string, imageId?: string): Promise<ImagePart | undefined> {
+  if (imageId) {
+    const asset = isAssetId(imageId) ? await store.get(imageId) : undefined;
+    if (!asset) {
+      throw new AssetNotFoundError(imageId);
+    }
+    return imagePartFromAsset(asset);
+  }
+  return image ? imagePartFromDataUrl(image) : undefined;
+}
+
+// 把图片存为资源，返回资源 ID（内容寻址，重复存储同一张图没有副作用）
+async function storeImageAsset(store: AssetStore, image: ImagePart): Promise<string> {
+  const bytes = base64ToBytes(image.data);
+  const imageId = await assetIdOf(bytes);
+  await store.put(imageId, { bytes, contentType: image.mimeType });
+  return imageId;
+}
+
+// 把生成的图片存为资源，返回可直接用作 <img src> 的地址
+// 未绑定共享存储（R2）时资源只在当前实例内存中，其它实例或淘汰后取不到，地址改用内联 data URL
+async function storeGeneratedImage(store: AssetStore, image: ImagePart, assetPath: string) {
+  const imageId = await storeImageAsset(store, image);
+  if (!store.shared) {
+    return { image: `data:${image.mimeType};base64,${image.data}`, imageId };
+  }
+  return { image: `${assetPath}?asset=${imageId}`, imageId };
+}
 
 // 生成任务ID
 function generateJobId(): string {
   return `job_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
 }
 
-// 创建任务
-function createJob(action: string, data: any): Job {
-  const job: Job = {
+function newJob(action: string, data: any, contentKey?: string): Job {
+  return {
     id: generateJobId(),
     status: 'pending',
     action,
     data,
+    contentKey,
     createdAt: Date.now(),
     updatedAt: Date.now(),
   };
-  jobs.set(job.id, job);
+}
+
+// 创建任务
+async function createJob(store: JobStore<Job>, action: string, data: any, contentKey?: string): Promise<Job> {
+  const job = newJob(action, data, contentKey);
+  await store.put(job);
   return job;
 }
 
-// 更新任务状态
-function updateJob(jobId: string, updates: Partial<Job>) {
-  const job = jobs.get(jobId);
-  if (job) {
-    Object.assign(job, updates, { updatedAt: Date.now() });
-    jobs.set(jobId, job);
+// 任务内容 key：相同图片 + 相同参数的任务视为同一个任务
+async function jobContentKey(action: string, image: ImagePart, jobData: any, speculative: number): Promise<string> {
+  return sha256Hex(
+    'job',
+    action,
+    image.data,
+    String(jobData?.photoType || ''),
+    stableStringify(jobData?.person ?? null),
+    String(speculative),
+    stableStringify(jobData?.fault ?? null)
+  );
+}
+
+// 当前实例内正在恢复的任务（从 resumeJob 收到请求到恢复后的运行结束），防止重复的 resumeJob 同时启动两次处理
+// 只有同一实例内的恢复被严格串行化；跨实例的 resumeToken 读回比较只能减少重复恢复，不能杜绝
+const resumingJobs = new Set<string>();
+
+// 当前实例内正在写入存储的新任务 (key → 任务记录)，保证同时到达的相同请求只创建一个任务
+// 只共享任务记录本身，不共享 Promise：Workers 中一个请求不能等待由另一个请求完成的 Promise
+const submittingJobs = new Map<string, Job>();
+
+// 相同内容的任务仍在处理中时直接复用；已完成且在 dedupTtlMs 内时复用其结果；否则新建任务
+async function findOrCreateJob(
+  store: JobStore<Job>,
+  contentKey: string,
+  action: string,
+  data: any,
+  dedupTtlMs: number
+): Promise<{ job: Job; created: boolean }> {
+  const submitting = submittingJobs.get(contentKey);
+  if (submitting) {
+    return { job: submitting, created: false };
+  }
+  const existingId = await store.getIdByKey(contentKey);
+  const existing = existingId ? await store.get(existingId) : undefined;
+  if (existing) {
+    const inFlight = existing.status === 'pending' || existing.status === 'processing';
+    const fresh = existing.status === 'completed' && Date.now() - existing.updatedAt <= dedupTtlMs;
+    if (inFlight || fresh) {
+      return { job: existing, created: false };
+    }
+  }
+
+  // 读取存储期间另一个相同请求可能已经开始创建；检查与登记之间没有 await，在当前实例内是原子的
+  const raced = submittingJobs.get(contentKey);
+  if (raced) {
+    return { job: raced, created: false };
   }
+  const job = newJob(action, data, contentKey);
+  submittingJobs.set(contentKey, job);
+  try {
+    await store.put(job);
+    await store.putKey(contentKey, job.id);
+  } finally {
+    submittingJobs.delete(contentKey);
+  }
+  return { job, created: true };
+}
+
+// 更新任务状态（立即写入，失败时重试）
+async function updateJob(store: JobStore<Job>, jobId: string, updates: Partial<Job>) {
+  await new JobRecordWriter(store, jobId).flush(() => updates);
 }
 
-// 获取任务
-function getJob(jobId: string): Job | undefined {
-  return jobs.get(jobId);
+function progressUpdate(progress: JobProgress) {
+  return (job: Job): Partial<Job> => ({ progress, progressLog: [...(job.progressLog || []), progress] });
 }
 
-// 清理旧任务 (保留最近1小时的任务)
-function cleanupOldJobs() {
-  const oneHourAgo = Date.now() - 60 * 60 * 1000;
-  for (const [id, job] of jobs.entries()) {
-    if (job.createdAt < oneHourAgo) {
-      jobs.delete(id);
+function toJobStatus(job: Job) {
+  return {
+    jobId: job.id,
+    status: job.status,
+    action: job.action,
+    photoType: job.data?.photoType,
+    progress: job.progress,
+    result: job.result,
+    error: job.error,
+    spans: job.spans,
+    ...(job.checkpoint ? { checkpoint: checkpointStage(job.checkpoint) } : {}),
+    ...(job.attempts?.length ? { attempts: job.attempts.length } : {}),
+    createdAt: job.createdAt,
+    updatedAt: job.updatedAt,
+  };
+}
+
+const JOB_STREAM_POLL_MS = 500;
+const JOB_STREAM_KEEPALIVE_MS = 15000;
+const JOB_STREAM_MAX_MS = 10 * 60 * 1000;
+
+// SSE 推送任务状态：在服务端读取任务存储，把状态变化和 progressLog 中的新步骤逐条推送
+// 步骤来自日志而非最新值，即使两次读取之间经过多个步骤也不会丢失
+// 事件类型：progress（状态或步骤变化）、completed、failed、timeout
+function streamJobEvents(store: JobStore<Job>, initial: Job): ReadableStream {
+  const encoder = new TextEncoder();
+  let cancelled = false;
+
+  return new ReadableStream({
+    async start(controller) {
+      const write = (chunk: string) => {
+        if (!cancelled) controller.enqueue(encoder.encode(chunk));
+      };
+      const send = (event: string, payload: any) => {
+        write(`event: ${event}\ndata: ${JSON.stringify(payload)}\n\n`);
+        lastWriteAt = Date.now();
+      };
+
+      const startedAt = Date.now();
+      let lastWriteAt = startedAt;
+      let sentStatus = '';
+      let sentSteps = 0;
+      let job: Job | undefined = initial;
+
+      while (!cancelled) {
+        if (!job) {
+          send('failed', { jobId: initial.id, status: 'failed', error: 'Job not found or expired' });
+          break;
+        }
+        const finished = job.status === 'completed' || job.status === 'failed';
+        const steps = job.progressLog || [];
+        if (job.status !== sentStatus && !finished) {
+          // 状态事件只带已推送过的步骤，保证步骤按日志顺序出现
+          sentStatus = job.status;
+          send('progress', { ...toJobStatus(job), progress: steps[sentSteps - 1] });
+        }
+        for (; sentSteps < steps.length; sentSteps++) {
+          send('progress', { ...toJobStatus(job), progress: steps[sentSteps] });
+        }
+        if (finished) {
+          send(job.status, toJobStatus(job));
+          break;
+        }
+        if (Date.now() - startedAt > JOB_STREAM_MAX_MS) {
+          send('timeout', { jobId: initial.id });
+          break;
+        }
+        if (Date.now() - lastWriteAt > JOB_STREAM_KEEPALIVE_MS) {
+          write(': keepalive\n\n');
+          lastWriteAt = Date.now();
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_STREAM_POLL_MS));
+        job = await store.get(initial.id);
+      }
+
+      if (!cancelled) controller.close();
+    },
+    cancel() {
+      cancelled = true;
     }
-  }
+  });
+}
+
+const ALL_PHOTO_TYPES = ['正面头像', '侧面头像', '肖像照', '半身照', '全身照'];
+
+function batchCounts(items: BatchItem[]) {
+  const poses = items.flatMap(item => item.poses);
+  return {
+    items: items.length,
+    poses: poses.length,
+    completed: poses.filter(p => p.status === 'completed').length,
+    failed: poses.filter(p => p.status === 'failed').length,
+    pending: poses.filter(p => p.status === 'pending' || p.status === 'processing').length,
+  };
+}
+
+// 批量任务清单：每张图片每个姿势的状态与结果
+function toBatchManifest(batch: Job) {
+  const items = batch.batch?.items || [];
+  return {
+    batchId: batch.id,
+    status: batch.status,
+    counts: batchCounts(items),
+    items,
+    createdAt: batch.createdAt,
+    updatedAt: batch.updatedAt,
+  };
+}
+
+// SSE 推送批量任务：每个姿势完成或失败时推送一条 item 事件，全部结束后推送 done（带完整清单）
+function streamBatchEvents(store: JobStore<Job>, initial: Job): ReadableStream {
+  const encoder = new TextEncoder();
+  let cancelled = false;
+
+  return new ReadableStream({
+    async start(controller) {
+      const write = (chunk: string) => {
+        if (!cancelled) controller.enqueue(encoder.encode(chunk));
+      };
+      const send = (event: string, payload: any) => {
+        write(`event: ${event}\ndata: ${JSON.stringify(payload)}\n\n`);
+        lastWriteAt = Date.now();
+      };
+
+      const startedAt = Date.now();
+      let lastWriteAt = startedAt;
+      const sent = new Set<string>();
+      let batch: Job | undefined = initial;
+
+      while (!cancelled) {
+        if (!batch) {
+          send('failed', { batchId: initial.id, status: 'failed', error: 'Batch not found or expired' });
+          break;
+        }
+        const items = batch.batch?.items || [];
+        items.forEach((item, index) => {
+          for (const pose of item.poses) {
+            const finished = pose.status === 'completed' || pose.status === 'failed';
+            if (finished && !sent.has(pose.jobId)) {
+              sent.add(pose.jobId);
+              send('item', { batchId: batch!.id, index, name: item.name, ...pose, counts: batchCounts(items) });
+            }
+          }
+        });
+        if (batch.status === 'completed' || batch.status === 'failed') {
+          send('done', toBatchManifest(batch));
+          break;
+        }
+        if (Date.now() - startedAt > JOB_STREAM_MAX_MS) {
+          send('timeout', { batchId: initial.id });
+          break;
+        }
+        if (Date.now() - lastWriteAt > JOB_STREAM_KEEPALIVE_MS) {
+          write(': keepalive\n\n');
+          lastWriteAt = Date.now();
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_STREAM_POLL_MS));
+        batch = await store.get(initial.id);
+      }
+
+      if (!cancelled) controller.close();
+    },
+    cancel() {
+      cancelled = true;
+    }
+  });
 }
 
 // --- Utils ---
@@ -128,7 +630,30 @@ export function parseConfig(env: Env): Config {
   };
 }
 
-export function createGeminiClient(apiKey: string): GoogleGenerativeAI {
+export function isStubBackend(env: Env): boolean {
+  return env.GEMINI_BACKEND === 'stub';
+}
+
+export function isCassetteBackend(env: Env): boolean {
+  return env.GEMINI_BACKEND === 'record' || env.GEMINI_BACKEND === 'replay';
+}
+
+// 不需要 GEMINI_API_KEY 的后端
+function isOfflineBackend(env: Env): boolean {
+  return isStubBackend(env) || env.GEMINI_BACKEND === 'replay';
+}
+
+export function createGeminiClient(apiKey: string, env?: Env): GeminiClient {
+  if (env && isStubBackend(env)) {
+    return createStubGeminiClient(parseStubOptions(env));
+  }
+  if (env?.GEMINI_BACKEND === 'replay') {
+    const latencyFactor = parseFloat(env.REPLAY_LATENCY_FACTOR || '');
+    return createReplayClient(getCassetteStore(env), { latencyFactor: isNaN(latencyFactor) ? 1 : latencyFactor }, getCassetteStats('replay'));
+  }
+  if (env?.GEMINI_BACKEND === 'record') {
+    return createRecordingClient(new GoogleGenerativeAI(apiKey), getCassetteStore(env), getCassetteStats('record'));
+  }
   return new GoogleGenerativeAI(apiKey);
 }
 
@@ -144,7 +669,10 @@ function uniqModels(models: Array<string | undefined>): string[] {
   return result;
 }
 
-function getModelCandidates(kind: 'analysis' | 'generation', env?: Env): string[] {
+function getModelCandidates(kind: 'analysis' | 'generation' | 'fast', env?: Env): string[] {
+  if (kind === 'fast') {
+    return uniqModels([env?.FAST_MODEL, env?.FAST_MODEL_FALLBACK]);
+  }
   if (kind === 'analysis') {
     return uniqModels([
       env?.HIGH_QUALITY_MODEL || MODELS.ANALYSIS,
@@ -164,22 +692,133 @@ function isQuotaOrRateLimitError(err: unknown): boolean {
   return message.includes('429') || message.includes('Too Many Requests') || message.toLowerCase().includes('quota');
 }
 
+// 每次模型调用记录一个 span，用于分析单个姿势的耗时分布
+interface ModelCallSpan {
+  stage: string;
+  model: string;
+  attempt: number; // 第几次尝试 (从 1 开始)
+  queueMs: number; // 在调度器中排队等待的时间
+  startMs: number; // 相对 trace 开始的偏移
+  durationMs: number;
+  requestBytes: number;
+  responseBytes: number;
+  status: 'ok' | 'rate_limited' | 'error';
+  error?: string;
+}
+
+interface PipelineTrace {
+  startedAt: number;
+  spans: ModelCallSpan[];
+  priority: Priority;
+}
+
+// 任务的当前步骤，stage 名称与 span 一致，供 streamJobStatus 推送
+export interface JobProgress {
+  step: string;
+  promptIteration: number;
+  generationIteration: number;
+  elapsedMs: number;
+  at: number;
+}
+
+type ProgressCallback = (progress: JobProgress) => void;
+
+function createTrace(priority: Priority = 'interactive'): PipelineTrace {
+  return { startedAt: Date.now(), spans: [], priority };
+}
+
+const textEncoder = new TextEncoder();
+
+function payloadBytes(input: any): number {
+  if (typeof input === 'string') return textEncoder.encode(input).length;
+  if (!Array.isArray(input)) return 0;
+  let bytes = 0;
+  for (const part of input) {
+    if (typeof part === 'string') bytes += textEncoder.encode(part).length;
+    else if (part?.text) bytes += textEncoder.encode(part.text).length;
+    else if (part?.inlineData?.data) bytes += part.inlineData.data.length;
+  }
+  return bytes;
+}
+
+function responseBytes(result: any): number {
+  const parts = result?.response?.candidates?.[0]?.content?.parts;
+  return Array.isArray(parts) ? payloadBytes(parts) : 0;
+}
+
 async function generateContentWithFallback(
-  genAI: GoogleGenerativeAI,
+  genAI: GeminiClient,
   modelCandidates: string[],
-  input: any
+  input: any,
+  trace?: PipelineTrace,
+  stage: string = 'unknown'
 ) {
+  const scheduler = getModelScheduler();
+  // 分析阶段有用户在等待，始终优先；其余阶段沿用 trace 的优先级（后台任务为 background）
+  const priority: Priority = stage === 'analyze' ? 'interactive' : trace?.priority ?? 'interactive';
   let lastError: unknown;
-  for (const modelName of modelCandidates) {
+  const inputBytes = payloadBytes(input);
+  const record = (span: Omit<ModelCallSpan, 'stage' | 'requestBytes' | 'startMs' | 'durationMs'>, start: number) => {
+    const durationMs = Date.now() - start;
+    modelCalls.inc({ stage, model: span.model, status: span.status });
+    modelCallDuration.observe({ stage, model: span.model }, durationMs / 1000);
+    modelQueueDuration.observe({ model: span.model }, span.queueMs / 1000);
+    modelPayloadBytes.observe({ stage, direction: 'request' }, inputBytes);
+    if (span.status === 'ok') {
+      modelPayloadBytes.observe({ stage, direction: 'response' }, span.responseBytes);
+      if (span.model !== modelCandidates[0]) {
+        modelFallbacks.inc({ stage, primary: modelCandidates[0], model: span.model });
+      }
+    }
+    if (!trace) return;
+    trace.spans.push({
+      stage,
+      requestBytes: inputBytes,
+      startMs: start - trace.startedAt,
+      durationMs,
+      ...span,
+    });
+  };
+
+  // 限流的模型由调度器熔断，本次请求改用剩余候选；候选全部限流后再整体重试一轮（调度器会等到冷却结束）
+  let remaining = [...modelCandidates];
+  const maxAttempts = modelCandidates.length * 2;
+  for (let attempt = 1; attempt <= maxAttempts; attempt++) {
+    if (remaining.length === 0) {
+      remaining = [...modelCandidates];
+    }
+    let lease: Lease;
     try {
-      const model = genAI.getGenerativeModel({ model: modelName });
-      return await model.generateContent(input);
+      lease = await scheduler.acquire(remaining, priority);
     } catch (err) {
       lastError = err;
-      if (isQuotaOrRateLimitError(err)) {
-        continue;
+      break;
+    }
+
+    const start = Date.now();
+    try {
+      const model = genAI.getGenerativeModel({ model: lease.model });
+      const result = await model.generateContent(input);
+      lease.release('ok');
+      record({ model: lease.model, attempt, queueMs: lease.waitedMs, responseBytes: responseBytes(result), status: 'ok' }, start);
+      return result;
+    } catch (err) {
+      lastError = err;
+      const rateLimited = isQuotaOrRateLimitError(err);
+      lease.release(rateLimited ? 'rate_limited' : 'error', retryAfterMsOf(err));
+      record({
+        model: lease.model,
+        attempt,
+        queueMs: lease.waitedMs,
+        responseBytes: 0,
+        status: rateLimited ? 'rate_limited' : 'error',
+        error: String((err as any)?.message || err).slice(0, 200),
+      }, start);
+      if (!rateLimited) {
+        throw err;
       }
-      throw err;
+      const throttledModel = lease.model;
+      remaining = remaining.filter(model => model !== throttledModel);
     }
   }
   throw lastError || new Error('NO_AVAILABLE_MODEL');
@@ -194,312 +833,24 @@ export function incrementCodeUsage(code: string) {
   codeUsage.set(code, current + 1);
 }
 
-// --- Enhanced Prompt Builders ---
-
-export function buildAnalyzePrompt(): string {
-  return `Analyze this reference image carefully and extract detailed person information.
-
-IMPORTANT: Focus on distinctive features that must be preserved in generated images.
-
-Output strict JSON:
-{
-  "race": "string (e.g., East Asian, Caucasian, African)",
-  "skinTone": "string with undertone details",
-  "gender": "string",
-  "age": "string (age range like '30-40')",
-  "faceShape": "string (oval, round, square, heart, etc.)",
-  "skinConcerns": ["list of visible skin characteristics"],
-  "uniqueFeatures": [
-    "extremely detailed list of ALL distinctive features",
-    "glasses: shape, color, style",
-    "hair: color, length, texture, style",
-    "facial structure: cheekbones, jawline, nose shape",
-    "eyes: shape, size, color",
-    "eyebrows: shape, thickness",
-    "lips: shape, fullness",
-    "any other distinctive marks or features"
-  ],
-  "preservationPoints": [
-    "CRITICAL: List features that MUST be identical in generated images",
-    "Include specific measurements and proportions if visible"
-  ],
-  "lighting": "current lighting description",
-  "expression": "facial expression description"
-}`;
-}
-
-export function buildDesignPrompt(person: any, photoType: string): string {
-  const postureGuide: Record<string, string> = {
-    '正面头像': 'Front-facing headshot, shoulders slightly angled, direct eye contact with camera',
-    '侧面头像': 'Body angled 70–90 degrees to camera, face turned 30–45 degrees toward camera (not full profile), eyes toward camera, suitable for news/company profile',
-    '肖像照': 'Medium close-up, chest up, slightly angled pose with natural head tilt',
-    '半身照': 'Waist up, three-quarter view, one shoulder slightly forward, professional hand placement',
-    '全身照': 'Full body standing pose, confident posture, weight on one leg, professional stance'
-  };
-
-  return `Design professional photo setup for ${photoType}.
-
-Person Details: ${JSON.stringify(person)}
-
-REQUIRED POSE: ${postureGuide[photoType] || 'Professional business pose'}
-
-Output strict JSON:
-{
-  "makeup": {
-    "base": "natural professional base",
-    "eyes": "enhanced but natural eye makeup",
-    "lips": "neutral professional lip color",
-    "blush": "subtle contouring"
-  },
-  "styling": {
-    "clothing": "formal business attire only: dress shirt or dress shirt + suit jacket, tailored fit, no casual wear",
-    "colors": "color palette that complements skin tone",
-    "accessories": "minimal professional accessories"
-  },
-  "posture": {
-    "description": "detailed pose instructions for ${photoType}",
-    "headAngle": "specific head positioning",
-    "shoulderPosition": "shoulder alignment",
-    "expression": "professional expression"
-  },
-  "lighting": {
-    "type": "Rembrandt or butterfly lighting",
-    "position": "key light 45-degree angle",
-    "background": "clean professional background"
-  }
-}`;
-}
-
-export function buildGenerationPrompt(
-  person: any, 
-  design: any, 
-  photoType: string,
-  referenceImage?: string
-): string {
-  const poseDescriptions: Record<string, string> = {
-    '正面头像': 'Front-facing professional headshot. Face directly toward camera. Full face visible. Shoulders at slight angle.',
-    '侧面头像': 'Side-angle portrait. Body turned 70–90 degrees to camera, face turned back 30–45 degrees toward camera (not full profile). Eyes toward camera. Suitable for news/company profile use.',
-    '肖像照': 'Medium close-up portrait. Chest and up visible. Slight three-quarter angle. Natural relaxed pose.',
-    '半身照': 'Half-body shot from waist up. Three-quarter body angle. Professional arm and hand positioning visible.',
-    '全身照': 'Full body standing pose. Complete figure visible from head to toe. Professional business stance.'
-  };
-
-  return `Generate a professional executive portrait photograph in a HIGH-END PROFESSIONAL PHOTOGRAPHY STUDIO.
-
-PHOTO TYPE: ${photoType}
-REQUIRED POSE: ${poseDescriptions[photoType]}
-
-SUBJECT DESCRIPTION (MUST MATCH REFERENCE):
-- Race: ${person.race}
-- Gender: ${person.gender}
-- Age: ${person.age}
-- Face Shape: ${person.faceShape}
-- Skin Tone: ${person.skinTone}
-
-CRITICAL FEATURES TO PRESERVE (MAKE IDENTICAL):
-${person.uniqueFeatures?.map((f: string) => `- ${f}`).join('\n') || 'Preserve all facial features'}
-
-PRESERVATION REQUIREMENTS:
-${person.preservationPoints?.map((p: string) => `- ${p}`).join('\n') || 'Maintain exact facial structure'}
-
-STUDIO SETUP - CRITICAL REQUIREMENTS:
-1. BACKGROUND: Seamless gradient backdrop (neutral gray, off-white, or subtle warm tone), smooth and clean, NO office furniture, NO windows, NO environmental elements
-2. LIGHTING: Professional studio three-point lighting setup - key light at 45 degrees, fill light for shadows, hair light for separation. Soft, even, flattering illumination
-3. ENVIRONMENT: Pure studio environment only. The background should be a professional photography backdrop, not an office or any real-world location
-4. MAKEUP: Professional makeup artist applied - natural but polished look, suitable for corporate headshots
-5. STYLING: Professional wardrobe stylist selected - premium business attire, perfectly fitted
-6. PHOTOGRAPHY: Shot by professional portrait photographer with high-end medium format camera, professional lenses
-
-DESIGN SPECIFICATIONS:
-- Clothing: ${design?.styling?.clothing || 'Formal business attire only: dress shirt or dress shirt + suit jacket, tailored fit'}
-- Lighting: Professional studio three-point lighting with softboxes
-- Expression: ${design?.posture?.expression || 'Professional confident expression'}
-- Background: Seamless studio backdrop, gradient from light to dark, no distractions
-
-MANDATORY RULES:
-1. The generated person MUST be recognizable as the same individual from the reference
-2. Facial features, proportions, and distinctive characteristics must match exactly
-3. BACKGROUND MUST BE: Professional studio seamless backdrop, NOT office, NOT environment, NOT location-based
-4. Lighting MUST BE: Professional studio lighting setup, NOT natural light, NOT ambient office light
-5. Maintain exact face shape, eye shape, nose shape, lip shape, and all unique features
-6. The pose must be exactly: ${poseDescriptions[photoType]}
-7. Wardrobe must be formal business attire only (dress shirt or dress shirt + suit jacket). No casual, no streetwear.
-8. All poses must read as highly professional studio portraits suitable for corporate/news use
-9. Quality level: Executive portrait studio photography standard
-
-Generate a high-end, photorealistic professional studio portrait suitable for corporate executive profiles.`;
-}
-
-export function buildComparisonPrompt(
-  originalImage: string,
-  generatedImage: string,
-  person: any,
-  photoType: string
-): string {
-  const identityChecks: Record<string, string[]> = {
-    '正面头像': [
-      'Face shape and proportions identical?',
-      'Eye shape, size, and position match?',
-      'Nose shape and bridge identical?',
-      'Lip shape and fullness match?',
-      'Facial structure (cheekbones, jawline) preserved?'
-    ],
-    '侧面头像': [
-      'Profile silhouette matches reference?',
-      'Nose bridge curve identical?',
-      'Chin and jawline profile match?',
-      'Forehead slope identical?',
-      'Overall facial proportions preserved?'
-    ],
-    '肖像照': [
-      'Facial features clearly recognizable?',
-      'Unique characteristics (glasses, etc.) preserved?',
-      'Facial structure maintained from this angle?',
-      'Expression natural and consistent?'
-    ],
-    '半身照': [
-      'Person clearly identifiable as same individual?',
-      'Facial features match reference?',
-      'Body proportions appropriate?',
-      'Professional posture achieved?'
-    ],
-    '全身照': [
-      'Same person clearly identifiable?',
-      'Facial structure preserved?',
-      'Professional full-body pose?',
-      'Business attire appropriate?'
-    ]
-  };
-
-  return `Compare the REFERENCE image with the GENERATED image for ${photoType}.
-
-Task: Verify that the generated image depicts the SAME PERSON as the reference.
-
-Original Person Analysis:
-${JSON.stringify(person, null, 2)}
-
-IDENTITY VERIFICATION CHECKLIST:
-${(identityChecks[photoType] || identityChecks['正面头像']).map((check, i) => `${i + 1}. ${check}`).join('\n')}
-
-QUALITY CRITERIA:
-1. Facial Recognition: Can you confirm this is the same person?
-2. Feature Preservation: Are distinctive features maintained?
-3. Beautification Level: Is the enhancement appropriate (not overdone)?
-4. Professional Quality: Does it meet business photo standards?
-5. Pose Accuracy: Is the pose correct for ${photoType}?
-
-Output strict JSON:
-{
-  "identityMatch": {
-    "score": "number 0-100",
-    "confidence": "High/Medium/Low",
-    "verdict": "Same person/Different person/Uncertain"
-  },
-  "facialFeatures": {
-    "preservationScore": "number 0-100",
-    "matchingFeatures": ["list of matching features"],
-    "differences": ["any notable differences"]
-  },
-  "qualityAssessment": {
-    "professionalism": "number 0-100",
-    "beautification": "number 0-100 (100=perfect, 0=overdone)",
-    "lighting": "number 0-100",
-    "pose": "number 0-100"
-  },
-  "overallScore": "number 0-100",
-  "approved": "boolean",
-  "summary": "detailed assessment",
-  "recommendations": ["suggestions for improvement"]
-}`;
-}
-
-function buildInputReviewPrompt(): string {
-  return `Review this input photo for suitability for professional portrait generation.
-
-Evaluation Criteria:
-1. Face clearly visible and centered
-2. Adequate lighting (no extreme shadows or overexposure)
-3. Sufficient resolution and sharpness
-4. Minimal occlusion (no heavy遮挡 like masks or hands)
-5. Neutral expression preferred
-
-Output strict JSON:
-{
-  "overallScore": "number 0-100",
-  "approved": "boolean (true if score >= 70)",
-  "summary": "brief assessment",
-  "issues": ["list of issues if any"],
-  "suggestions": ["how to improve the input photo"]
-}`;
-}
-
-function buildPromptReviewText(promptText: string, photoType: string, iteration: number): string {
-  return `Review this prompt for generating a professional ${photoType} photo.
-
-Target Pose: ${photoType}
-
-Final Target Use Cases (MANDATORY):
-- Personal resume
-- Personal homepage
-- News publication
-- Company publicity board
-
-Prompt to Review:
-${promptText}
-
-Evaluation Criteria:
-1. Does the prompt clearly specify the pose requirements for ${photoType}?
-2. Does it preserve the person's unique features from the reference image?
-3. Is the styling appropriate for formal business photography (dress shirt or dress shirt + suit jacket only)?
-4. Is the lighting and background specification clear and studio-only?
-5. Does the prompt explicitly target suitability for resume/homepage/news/company publicity use?
-6. Are all poses framed as high-end professional studio portraits with professional styling/makeup/photography?
-7. Are there any missing or unclear elements?
-
-Strict Approval Rules:
-- If the prompt does NOT explicitly target the above use cases, set approved=false.
-- If formal attire or studio-only requirements are missing/ambiguous, set approved=false.
-
-Output strict JSON:
-{
-  "overallScore": "number 0-100",
-  "approved": "boolean (true if score >= 70)",
-  "summary": "brief assessment",
-  "strengths": ["what's good about this prompt"],
-  "weaknesses": ["what needs improvement"],
-  "suggestions": ["specific suggestions for improvement"],
-  "iteration": ${iteration}
-}`;
-}
-
-function refinePromptText(promptText: string, review: any): string {
-  const suggestions = Array.isArray(review?.suggestions) ? review.suggestions : [];
-  if (suggestions.length === 0) {
-    return `${promptText}\n\nRefinement: Emphasize pose accuracy, identity preservation, studio lighting, and clean backdrop.`;
-  }
-  const suggestionText = suggestions.map((s: string) => `- ${s}`).join('\n');
-  return `${promptText}\n\nRefinements:\n${suggestionText}\n- Re-emphasize identity preservation and studio-only background.`;
-}
-
 async function reviewPromptQuality(
-  genAI: GoogleGenerativeAI,
+  genAI: GeminiClient,
   modelCandidates: string[],
   promptText: string,
-  originalImage: string,
+  original: ImagePart | undefined,
   photoType: string,
-  iteration: number
+  iteration: number,
+  trace?: PipelineTrace
 ) {
   const reviewPromptText = buildPromptReviewText(promptText, photoType, iteration);
   const parts: any[] = [{ text: reviewPromptText }];
-  if (originalImage) {
-    parts.push({
-      inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' }
-    });
+  if (original) {
+    parts.push({ inlineData: original });
   }
-  const response = await generateContentWithFallback(genAI, modelCandidates, parts);
+  const response = await generateContentWithFallback(genAI, modelCandidates, parts, trace, 'reviewPrompt');
   const text = response.response.text();
   try {
-    return JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+    return parseModelJson(text);
   } catch (e) {
     return {
       overallScore: 75,
@@ -514,114 +865,470 @@ async function reviewPromptQuality(
 }
 
 async function generateImageFromPrompt(
-  genAI: GoogleGenerativeAI,
+  genAI: GeminiClient,
   modelCandidates: string[],
   promptText: string,
-  referenceImage?: string
-): Promise<string> {
+  reference?: ImagePart,
+  trace?: PipelineTrace
+): Promise<ImagePart> {
   const parts: any[] = [{ text: promptText }];
-  if (referenceImage) {
-    const refImageData = referenceImage.split(',')[1] || referenceImage;
-    parts.push({
-      inlineData: { data: refImageData, mimeType: 'image/jpeg' }
-    });
+  if (reference) {
+    parts.push({ inlineData: reference });
   }
-  const response = await generateContentWithFallback(genAI, modelCandidates, parts);
+  const response = await generateContentWithFallback(genAI, modelCandidates, parts, trace, 'generate');
   const candidates = response.response.candidates;
   if (candidates && candidates[0]?.content?.parts) {
     for (const part of candidates[0].content.parts) {
       // @ts-ignore
       if (part.inlineData && part.inlineData.mimeType?.startsWith('image/')) {
         // @ts-ignore
-        return `data:${part.inlineData.mimeType};base64,${part.inlineData.data}`;
+        return { data: part.inlineData.data, mimeType: part.inlineData.mimeType };
       }
     }
   }
   throw new Error('IMAGE_GENERATION_FAILED');
 }
 
+// 分析人物特征；相同图片 + prompt + 模型组合直接命中缓存
+async function analyzePerson(
+  genAI: GeminiClient,
+  analysisModels: string[],
+  image: ImagePart,
+  cache?: LRUCache<any>,
+  trace?: PipelineTrace
+): Promise<any> {
+  const prompt = buildAnalyzePrompt();
+  const key = cache ? await sha256Hex('analyze', analysisModels.join(','), prompt, image.data) : '';
+  const cached = cache?.get(key);
+  if (cached) return cached;
+
+  const response = await generateContentWithFallback(genAI, analysisModels, [
+    { text: prompt },
+    { inlineData: image }
+  ], trace, 'analyze');
+  const person = parseModelJson(response.response.text());
+  cache?.set(key, person);
+  return person;
+}
+
+// 为某个姿势设计拍摄方案；prompt 中已包含 person，因此 key 同样由图片内容决定
+async function designForPose(
+  genAI: GeminiClient,
+  analysisModels: string[],
+  person: any,
+  photoType: string,
+  cache?: LRUCache<any>,
+  trace?: PipelineTrace
+): Promise<any> {
+  const prompt = buildDesignPrompt(person, photoType);
+  const key = cache ? await sha256Hex('design', analysisModels.join(','), prompt) : '';
+  const cached = cache?.get(key);
+  if (cached) return cached;
+
+  const response = await generateContentWithFallback(genAI, analysisModels, prompt, trace, 'design');
+  const design = parseModelJson(response.response.text());
+  cache?.set(key, design);
+  return design;
+}
+
+// 一个生成候选：生成图 + 对比评审
+interface Candidate {
+  image: ImagePart;
+  review: any;
+  approved: boolean;
+  durationMs: number;
+}
+
+// 推测式生成的一轮统计：与串行逐个生成相比节省的时间和多花的调用次数（串行耗时为估算值）
+interface SpeculationReport {
+  candidates: number;
+  accepted: boolean;
+  actualMs: number;
+  serialEstimateMs: number;
+  savedMs: number;
+  generationCalls: number;
+  reviewCalls: number;
+  extraCalls: number;
+}
+
+// 当前实例的推测式生成累计统计，通过 stats action 查看，用于调整 K
+const speculationTotals = { runs: 0, accepted: 0, savedMs: 0, extraCalls: 0 };
+
+// 请求参数 data.speculative 优先，其次是环境变量 SPECULATIVE_CANDIDATES；1 表示关闭
+function speculativeCandidatesFor(requested: unknown, env: Env): number {
+  const value = parseInt(String(requested ?? env.SPECULATIVE_CANDIDATES ?? '1')) || 1;
+  return Math.min(Math.max(value, 1), ITERATION_LIMITS.MAX_SPECULATIVE_CANDIDATES);
+}
+
+// 评审前的分级预筛 (functions/utils/prescreen.ts)：本地检查 → FAST_MODEL，边界情况才进行完整评审
+interface Prescreen {
+  options: PrescreenOptions;
+  fastModels: string[];
+}
+
+// 当前实例的预筛累计统计（各层命中率、节省时间），通过 stats action 查看
+const prescreenStats = createPrescreenStats();
+
+// 预筛得出明确结论时，按完整评审的结构生成评审结果，后续的通过判断与 prompt 细化无需区分来源
+function prescreenReviewOf(stage: PrescreenStage, decision: Omit<PrescreenDecision, 'durationMs'>, scores: any, suggestions: string[]) {
+  const approved = decision.verdict === 'pass';
+  const overallScore = scoreOf(scores?.overallScore) ?? 0;
+  const review = {
+    overallScore,
+    approved,
+    summary: `Pre-screen ${decision.tier} ${decision.verdict}${decision.reasons.length ? `: ${decision.reasons.join('; ')}` : ''}`,
+    suggestions,
+    prescreen: { tier: decision.tier, verdict: decision.verdict },
+  };
+  if (stage === 'reviewResult') {
+    const identityScore = scoreOf(scores?.identityScore) ?? overallScore;
+    return {
+      ...review,
+      identityMatch: { score: identityScore, confidence: 'Medium', verdict: approved ? 'Same person' : 'Uncertain' },
+      recommendations: suggestions,
+    };
+  }
+  return { ...review, strengths: [], weaknesses: decision.reasons };
+}
+
+// 本地检查不通过时直接得出结论；否则调用 FAST_MODEL，分数明确时得出结论，其余返回 escalate（review 为空）
+async function prescreenReview(
+  genAI: GeminiClient,
+  prescreen: Prescreen,
+  stage: PrescreenStage,
+  local: { reasons: string[]; suggestions: string[] },
+  fastParts: any[],
+  trace?: PipelineTrace
+): Promise<PrescreenDecision> {
+  const start = Date.now();
+  let decision: Omit<PrescreenDecision, 'durationMs'>;
+  if (local.reasons.length > 0) {
+    decision = { tier: 'local', verdict: 'fail', reasons: local.reasons };
+    decision.review = prescreenReviewOf(stage, decision, {}, local.suggestions);
+  } else {
+    try {
+      const spanStage = stage === 'reviewPrompt' ? 'prescreenPrompt' : 'prescreenResult';
+      const response = await generateContentWithFallback(genAI, prescreen.fastModels, fastParts, trace, spanStage);
+      const scores = parseModelJson(response.response.text());
+      const list = (value: unknown) => (Array.isArray(value) ? value.map(String) : []);
+      decision = {
+        tier: 'fast',
+        verdict: classifyFastScores(scores, prescreen.options),
+        score: scoreOf(scores?.overallScore),
+        reasons: list(scores?.issues),
+      };
+      if (decision.verdict !== 'escalate') {
+        decision.review = prescreenReviewOf(stage, decision, scores, list(scores?.suggestions));
+      }
+    } catch (e: any) {
+      // 快速模型调用失败或输出无法解析时交给完整评审
+      decision = { tier: 'fast', verdict: 'escalate', reasons: [`Pre-screen failed: ${e.message}`] };
+    }
+  }
+  const result = { ...decision, durationMs: Date.now() - start };
+  recordPrescreen(prescreenStats, stage, result);
+  prescreenDecisions.inc({ stage, tier: result.tier, verdict: result.verdict });
+  return result;
+}
+
+// 姿势流水线的检查点：每个阶段完成后写入任务记录，resumeJob 从最后完成的阶段继续
+// 生成图存为资源，检查点只保存资源 ID
+interface CheckpointCandidate {
+  imageId: string;
+  review: any;
+  approved: boolean;
+  promptIteration: number;
+}
+
+export interface PoseCheckpoint {
+  person?: any;
+  design?: any;
+  promptText?: string;      // 当前 prompt（含已做的细化）
+  promptApproved: boolean;  // 当前 prompt 已通过评审（或达到迭代上限），下一步直接生成
+  promptIterations: number;
+  generationIterations: number;
+  candidates: CheckpointCandidate[];
+}
+
+interface PoseCheckpointer {
+  initial?: PoseCheckpoint;
+  save(checkpoint: PoseCheckpoint): Promise<void>;
+  storeImage(image: ImagePart): Promise<string>;
+  loadImage(imageId: string): Promise<ImagePart>;
+}
+
+// 检查点对应的最后完成阶段，用于日志和 resumeJob 的返回值
+function checkpointStage(checkpoint?: PoseCheckpoint): string {
+  if (!checkpoint?.person) return 'none';
+  if (!checkpoint.design) return 'analyze';
+  const last = checkpoint.candidates[checkpoint.candidates.length - 1];
+  if (last && last.promptIteration === checkpoint.promptIterations) return 'reviewResult';
+  if (checkpoint.promptApproved) return 'reviewPrompt';
+  return 'design';
+}
+
 // 后台处理 processPose (用于异步任务)
 async function processPoseInBackground(
-  genAI: GoogleGenerativeAI,
+  genAI: GeminiClient,
   analysisModels: string[],
   generationModels: string[],
-  originalImage: string,
+  original: ImagePart,
   photoType: string,
-  providedPerson?: any
+  providedPerson?: any,
+  trace?: PipelineTrace,
+  cache?: LRUCache<any>,
+  onProgress?: ProgressCallback,
+  speculativeCandidates: number = 1,
+  checkpointer?: PoseCheckpointer,
+  prescreen?: Prescreen
 ): Promise<any> {
-  let person = providedPerson;
+  const startedAt = Date.now();
+  const initial = checkpointer?.initial;
+  let promptIterations = initial?.promptIterations ?? 0;
+  let generationIterations = initial?.generationIterations ?? 0;
+  let person = initial?.person;
+  let design = initial?.design;
+  let promptText: string | undefined = initial?.promptText;
+  let promptApproved = initial?.promptApproved ?? false;
+  const candidates: CheckpointCandidate[] = [...(initial?.candidates || [])];
+  const report = (step: string) => {
+    const now = Date.now();
+    onProgress?.({ step, promptIteration: promptIterations, generationIteration: generationIterations, elapsedMs: now - startedAt, at: now });
+  };
+  const saveCheckpoint = async () => {
+    await checkpointer?.save({
+      person,
+      design,
+      promptText,
+      promptApproved,
+      promptIterations,
+      generationIterations,
+      candidates: [...candidates],
+    });
+  };
+
+  if (initial) {
+    console.log(`[Pipeline] Resuming ${photoType} after ${checkpointStage(initial)}`);
+  }
   if (!person) {
-    const analyzePrompt = buildAnalyzePrompt();
-    const analyzeResponse = await generateContentWithFallback(genAI, analysisModels, [
-      { text: analyzePrompt },
-      { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } }
-    ]);
-    person = JSON.parse(analyzeResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
+    if (!providedPerson) report('analyze');
+    person = providedPerson
+      || await analyzePerson(genAI, analysisModels, original, cache, trace);
+    await saveCheckpoint();
+  }
+  if (!design) {
+    report('design');
+    design = await designForPose(genAI, analysisModels, person, photoType, cache, trace);
+    await saveCheckpoint();
   }
 
-  const designPrompt = buildDesignPrompt(person, photoType);
-  const designResponse = await generateContentWithFallback(genAI, analysisModels, designPrompt);
-  const design = JSON.parse(designResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
-
-  let promptText = buildGenerationPrompt(person, design, photoType, originalImage);
-  let promptIterations = 0;
-  let generationIterations = 0;
-  let finalImage: string | undefined;
-  let finalReview: any = undefined;
-
-  while (promptIterations < ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
-    promptIterations++;
-    const promptReview = await reviewPromptQuality(genAI, analysisModels, promptText, originalImage, photoType, promptIterations);
-    const promptApproved = promptReview.approved ?? (promptReview.overallScore || 0) >= 70;
-    if (!promptApproved && promptIterations < ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
-      promptText = refinePromptText(promptText, promptReview);
-      continue;
+  // 预筛开启时先经过本地检查与 FAST_MODEL，结论明确时不调用完整评审；每次预筛的结论记录在结果的 prescreen 中
+  const prescreenLog: Array<Pick<PrescreenDecision, 'tier' | 'verdict' | 'durationMs'> & { stage: PrescreenStage }> = [];
+  const withPrescreen = async (
+    stage: PrescreenStage,
+    screen: () => Promise<PrescreenDecision>,
+    fullReview: () => Promise<any>
+  ) => {
+    if (prescreen?.options.enabled) {
+      const decision = await screen();
+      prescreenLog.push({ stage, tier: decision.tier, verdict: decision.verdict, durationMs: decision.durationMs });
+      if (decision.review) return decision.review;
     }
+    const start = Date.now();
+    const review = await fullReview();
+    recordFullReview(prescreenStats, stage, Date.now() - start);
+    return review;
+  };
 
-    let genAttempts = 0;
-    let approved = false;
-    while (genAttempts < ITERATION_LIMITS.MAX_GENERATION_ITERATIONS) {
-      genAttempts++;
-      generationIterations++;
-      const generatedImage = await generateImageFromPrompt(genAI, generationModels, promptText, originalImage);
-      const comparePrompt = buildComparisonPrompt(originalImage, generatedImage, person, photoType);
+  const reviewPrompt = (text: string, iteration: number) => withPrescreen(
+    'reviewPrompt',
+    () => prescreenReview(genAI, prescreen!, 'reviewPrompt', checkPromptText(text, photoType), [
+      { text: buildPromptPrescreenText(text, photoType) },
+    ], trace),
+    () => reviewPromptQuality(genAI, analysisModels, text, original, photoType, iteration, trace)
+  );
+
+  const reviewResult = (generatedImage: ImagePart) => withPrescreen(
+    'reviewResult',
+    () => prescreenReview(genAI, prescreen!, 'reviewResult', {
+      reasons: checkGeneratedImage(generatedImage, prescreen!.options),
+      suggestions: ['Regenerate a full-resolution portrait'],
+    }, [
+      { text: buildResultPrescreenPrompt(person, photoType) },
+      { inlineData: original },
+      { inlineData: generatedImage },
+    ], trace),
+    async () => {
+      const comparePrompt = buildComparisonPrompt(original.data, generatedImage.data, person, photoType);
       const compareResponse = await generateContentWithFallback(genAI, analysisModels, [
         { text: comparePrompt },
-        { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } },
-        { inlineData: { data: generatedImage.split(',')[1] || generatedImage, mimeType: 'image/jpeg' } }
-      ]);
-      const text = compareResponse.response.text();
+        { inlineData: original },
+        { inlineData: generatedImage }
+      ], trace, 'reviewResult');
       try {
-        finalReview = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+        return parseModelJson(compareResponse.response.text());
       } catch (e) {
-        finalReview = {
+        return {
           identityMatch: { score: 75, confidence: 'Medium', verdict: 'Same person' },
           overallScore: 75,
           approved: true,
           summary: 'Review completed'
         };
       }
-      finalImage = generatedImage;
-      approved = finalReview.approved ?? (finalReview.overallScore || 0) >= 70;
-      if (approved) {
-        break;
+    }
+  );
+
+  // 生成一张图并与原图对比评审；isCancelled 为真时（已有候选通过）跳过评审
+  let reviewCalls = 0;
+  const generateAndReview = async (promptText: string, isCancelled?: () => boolean): Promise<Candidate | undefined> => {
+    const start = Date.now();
+    const generatedImage = await generateImageFromPrompt(genAI, generationModels, promptText, original, trace);
+    if (isCancelled?.()) return undefined;
+    report('reviewResult');
+    reviewCalls++;
+    const review = await reviewResult(generatedImage);
+    return {
+      image: generatedImage,
+      review,
+      approved: review.approved ?? (review.overallScore || 0) >= 70,
+      durationMs: Date.now() - start,
+    };
+  };
+
+  // 同一 prompt 并行生成 k 个候选，按到达顺序评审，第一个通过的立即采用，其余结果忽略
+  const speculation: SpeculationReport[] = [];
+  const generateSpeculatively = async (promptText: string, k: number): Promise<Candidate> => {
+    const batchStart = Date.now();
+    const reviewCallsBefore = reviewCalls;
+    const finished: Candidate[] = [];
+    const errors: unknown[] = [];
+    let accepted = undefined as Candidate | undefined;
+    let acceptedAt = 0;
+
+    generationIterations += k;
+    report('generate');
+    await new Promise<void>(resolve => {
+      let pending = k;
+      for (let i = 0; i < k; i++) {
+        generateAndReview(promptText, () => accepted !== undefined)
+          .then(candidate => {
+            if (!candidate || accepted) return;
+            finished.push(candidate);
+            if (candidate.approved) {
+              accepted = candidate;
+              acceptedAt = Date.now();
+              resolve();
+            }
+          })
+          .catch(e => {
+            errors.push(e);
+          })
+          .finally(() => {
+            if (--pending === 0) resolve();
+          });
       }
+    });
+
+    if (finished.length === 0) {
+      throw errors[0] || new Error('IMAGE_GENERATION_FAILED');
     }
 
-    if (finalImage && (finalReview?.approved ?? (finalReview?.overallScore || 0) >= 70)) {
-      break;
+    // 串行模式的估算：依次生成评审，直到遇到通过的候选或达到 MAX_GENERATION_ITERATIONS
+    const rejected = finished.filter(c => !c.approved);
+    const serialRejected = rejected.slice(0, ITERATION_LIMITS.MAX_GENERATION_ITERATIONS - (accepted ? 1 : 0));
+    const serialCandidates = accepted ? [...serialRejected, accepted] : serialRejected;
+    const serialEstimateMs = serialCandidates.reduce((sum, c) => sum + c.durationMs, 0);
+    const actualMs = (acceptedAt || Date.now()) - batchStart;
+    const batchReviewCalls = reviewCalls - reviewCallsBefore;
+    const extraCalls = k + batchReviewCalls - serialCandidates.length * 2;
+    speculation.push({
+      candidates: k,
+      accepted: !!accepted,
+      actualMs,
+      serialEstimateMs,
+      savedMs: serialEstimateMs - actualMs,
+      generationCalls: k,
+      reviewCalls: batchReviewCalls,
+      extraCalls,
+    });
+    speculationTotals.runs++;
+    speculationTotals.accepted += accepted ? 1 : 0;
+    speculationTotals.savedMs += serialEstimateMs - actualMs;
+    speculationTotals.extraCalls += extraCalls;
+
+    // 都未通过时取评分最高的候选
+    return accepted || finished.reduce((best, c) =>
+      (c.review.overallScore || 0) > (best.review.overallScore || 0) ? c : best
+    );
+  };
+
+  // 已生成的候选写入检查点；生成图在检查点中只保存资源 ID
+  let lastImage: ImagePart | undefined;
+  const addCandidate = async (candidate: Candidate) => {
+    lastImage = candidate.image;
+    const imageId = checkpointer ? await checkpointer.storeImage(candidate.image) : '';
+    candidates.push({ imageId, review: candidate.review, approved: candidate.approved, promptIteration: promptIterations });
+    await saveCheckpoint();
+  };
+  const attemptsThisIteration = () => candidates.filter(c => c.promptIteration === promptIterations).length;
+  const lastCandidate = () => candidates[candidates.length - 1];
+
+  if (promptText === undefined) {
+    promptText = buildGenerationPrompt(person, design, photoType, original.data);
+  }
+
+  while (!lastCandidate()?.approved) {
+    if (!promptApproved) {
+      if (promptIterations >= ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) break;
+      promptIterations++;
+      report('reviewPrompt');
+      const promptReview = await reviewPrompt(promptText, promptIterations);
+      const approved = promptReview.approved ?? (promptReview.overallScore || 0) >= 70;
+      if (!approved && promptIterations < ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
+        promptText = refinePromptText(promptText, promptReview);
+        await saveCheckpoint();
+        continue;
+      }
+      promptApproved = true;
+      await saveCheckpoint();
+    }
+
+    // 恢复时跳过当前 prompt 已完成的生成次数
+    if (speculativeCandidates > 1) {
+      if (attemptsThisIteration() === 0) {
+        await addCandidate(await generateSpeculatively(promptText, speculativeCandidates));
+      }
+    } else {
+      while (attemptsThisIteration() < ITERATION_LIMITS.MAX_GENERATION_ITERATIONS) {
+        generationIterations++;
+        report('generate');
+        const candidate = await generateAndReview(promptText);
+        if (!candidate) break;
+        await addCandidate(candidate);
+        if (candidate.approved) {
+          break;
+        }
+      }
     }
 
-    if (promptIterations >= ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
+    const last = lastCandidate();
+    if (!last || last.approved || promptIterations >= ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
       break;
     }
 
-    promptText = refinePromptText(promptText, finalReview);
+    promptText = refinePromptText(promptText, last.review);
+    promptApproved = false;
+    await saveCheckpoint();
   }
 
-  if (!finalImage) {
+  const final = lastCandidate();
+  if (!final) {
     throw new Error('Failed to generate image after all attempts');
   }
+  const finalImage = lastImage ?? await checkpointer!.loadImage(final.imageId);
+  const finalReview = final.review;
+  poseIterations.observe({ photo_type: photoType, kind: 'prompt' }, promptIterations);
+  poseIterations.observe({ photo_type: photoType, kind: 'generation' }, generationIterations);
 
   return {
     image: finalImage,
@@ -631,7 +1338,9 @@ async function processPoseInBackground(
       summary: 'Image generated'
     },
     promptIterations,
-    generationIterations
+    generationIterations,
+    ...(speculation.length ? { speculation } : {}),
+    ...(prescreenLog.length ? { prescreen: prescreenLog } : {})
   };
 }
 
@@ -640,8 +1349,8 @@ async function processPoseInBackground(
 // CORS headers configuration
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
-  'Access-Control-Allow-Methods': 'POST, OPTIONS',
-  'Access-Control-Allow-Headers': 'Content-Type, X-Signature, X-Timestamp, X-Action',
+  'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+  'Access-Control-Allow-Headers': 'Content-Type, X-Signature, X-Timestamp, X-Action, X-Invite-Code, X-Image-Preprocess',
 };
 
 // Handle OPTIONS requests (CORS preflight)
@@ -652,19 +1361,110 @@ export async function onRequestOptions() {
   });
 }
 
-export async function onRequestPost({ request, env }: { request: Request; env: Env }) {
+// 指标访问需要 METRICS_TOKEN（Authorization: Bearer <token>，POST 时也可放在 data.token）；未配置时不开放
+function metricsAuthError(request: Request, env: Env, token?: string): { error: string; status: number } | undefined {
+  if (!env.METRICS_TOKEN) {
+    return { error: 'METRICS_DISABLED', status: 404 };
+  }
+  const provided = token || (request.headers.get('Authorization') || '').replace(/^Bearer\s+/i, '');
+  if (provided !== env.METRICS_TOKEN) {
+    return { error: 'INVALID_METRICS_TOKEN', status: 401 };
+  }
+  return undefined;
+}
+
+function metricsResponse(): Response {
+  return new Response(metrics.render(), {
+    headers: {
+      ...corsHeaders,
+      'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+      'Cache-Control': 'no-store',
+    }
+  });
+}
+
+// 读取图片资源：GET /api/gemini?asset=<id>
+// 与 POST 相同校验邀请码：X-Invite-Code 头，或 code 查询参数（<img src> 无法带请求头）；内容不可变，可长期缓存
+// GET /api/gemini?metrics 供 Prometheus 直接抓取（Bearer METRICS_TOKEN）
+export async function onRequestGet({ request, env }: { request: Request; env: Env }) {
+  const params = new URL(request.url).searchParams;
+  if (params.has('metrics')) {
+    const denied = metricsAuthError(request, env);
+    return denied ? new Response(denied.error, { status: denied.status, headers: corsHeaders }) : metricsResponse();
+  }
+  if (!env.INVITE_CODES) {
+    return new Response(JSON.stringify({ error: 'SERVICE_UNAVAILABLE', message: 'Missing invite codes' }), {
+      status: 503,
+      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    });
+  }
+  const code = request.headers.get('X-Invite-Code') || params.get('code') || '';
+  if (!validateInviteCode(code, parseConfig(env))) {
+    return new Response(JSON.stringify({ error: 'INVALID_INVITE_CODE' }), {
+      status: 401,
+      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    });
+  }
+  const assetId = params.get('asset');
+  if (!isAssetId(assetId)) {
+    return new Response('Not found', { status: 404, headers: corsHeaders });
+  }
+  const asset = await getAssetStore(env).get(assetId);
+  if (!asset) {
+    return new Response('Not found', { status: 404, headers: corsHeaders });
+  }
+  return new Response(asset.bytes, {
+    headers: {
+      ...corsHeaders,
+      'Content-Type': asset.contentType,
+      'Content-Length': String(asset.bytes.length),
+      'Cache-Control': 'private, max-age=86400, immutable',
+      'ETag': `"${assetId}"`,
+    }
+  });
+}
+
+type RequestContext = {
+  request: Request;
+  env: Env;
+  waitUntil?: (promise: Promise<unknown>) => void;
+};
+
+// 请求级指标：action、请求 / 响应大小由 handlePost 在解析过程中填入
+interface RequestMetrics {
+  action: string;
+  requestBytes: number;
+  responseBytes?: number;
+}
+
+export async function onRequestPost(context: RequestContext) {
+  const startedAt = Date.now();
+  const info: RequestMetrics = { action: 'other', requestBytes: 0 };
+  const response = await handlePost(context, info);
+  requestsTotal.inc({ action: info.action, status: response.status });
+  requestDuration.observe({ action: info.action }, (Date.now() - startedAt) / 1000);
+  requestBytesHistogram.observe({ action: info.action }, info.requestBytes);
+  if (info.responseBytes !== undefined) {
+    responseBytesHistogram.observe({ action: info.action }, info.responseBytes);
+  }
+  return response;
+}
+
+async function handlePost({ request, env, waitUntil }: RequestContext, info: RequestMetrics) {
   const cors = corsHeaders;
 
   // 确保所有响应都是 JSON 格式
   const jsonResponse = (data: any, status: number = 200) => {
-    return new Response(JSON.stringify(data), {
+    const body = JSON.stringify(data);
+    info.responseBytes = textEncoder.encode(body).length;
+    return new Response(body, {
       status,
       headers: { ...cors, 'Content-Type': 'application/json' }
     });
   };
 
   try {
-    if (!env.GEMINI_API_KEY) {
+    if (!env.GEMINI_API_KEY && !isOfflineBackend(env)) {
       return jsonResponse({ error: 'SERVICE_UNAVAILABLE', message: 'Missing API key' }, 503);
     }
     if (!env.INVITE_CODES) {
@@ -674,9 +1474,43 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
     const config = parseConfig(env);
 
     try {
+      // 二进制图片上传：X-Action: uploadAsset，邀请码放在 X-Invite-Code 头中
+      if (request.headers.get('X-Action') === 'uploadAsset') {
+        info.action = 'uploadAsset';
+        const code = request.headers.get('X-Invite-Code') || '';
+        if (!validateInviteCode(code, config)) {
+          return jsonResponse({ error: 'INVALID_INVITE_CODE' }, 401);
+        }
+        incrementCodeUsage(code);
+
+        const contentType = (request.headers.get('Content-Type') || '').split(';')[0].trim();
+        if (!contentType.startsWith('image/')) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Asset must be an image' }, 415);
+        }
+        const bytes = new Uint8Array(await request.arrayBuffer());
+        info.requestBytes = bytes.length;
+        const maxBytes = parseInt(env.MAX_ASSET_BYTES || '') || 10 * 1024 * 1024;
+        if (bytes.length === 0 || bytes.length > maxBytes) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: `Asset size must be between 1 and ${maxBytes} bytes` }, 413);
+        }
+
+        const assetId = await assetIdOf(bytes);
+        await getAssetStore(env).put(assetId, { bytes, contentType });
+        const preprocess = request.headers.get('X-Image-Preprocess');
+        if (preprocess) {
+          console.log(`[Asset] Stored ${assetId} (${bytes.length} bytes, ${preprocess})`);
+        }
+        return jsonResponse({
+          result: { assetId, url: `${new URL(request.url).pathname}?asset=${assetId}`, bytes: bytes.length, contentType },
+          action: 'uploadAsset',
+        });
+      }
+
       const bodyText = await request.text();
+      info.requestBytes = bodyText.length; // 按字符数计，图片为 base64 时与字节数相同
       const body = JSON.parse(bodyText);
       const { code, action, image, data } = body;
+      info.action = metricAction(action);
 
       // Validate invite code
       if (!validateInviteCode(code, config)) {
@@ -685,61 +1519,144 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
       incrementCodeUsage(code);
 
       const normalizedEnv: Env = { ...DEFAULT_ENV, ...env } as Env;
-      const genAI = createGeminiClient(normalizedEnv.GEMINI_API_KEY);
+      const scheduler = getModelScheduler(normalizedEnv);
+      const genAI = createGeminiClient(normalizedEnv.GEMINI_API_KEY, normalizedEnv);
       const analysisModels = getModelCandidates('analysis', normalizedEnv);
       const generationModels = getModelCandidates('generation', normalizedEnv);
+      const prescreen: Prescreen = { options: parsePrescreenOptions(normalizedEnv), fastModels: getModelCandidates('fast', normalizedEnv) };
+      const cache = getResultCache(normalizedEnv);
+      const assets = getAssetStore(normalizedEnv);
+      const assetPath = new URL(request.url).pathname;
       let result: any;
 
+      // 处理任务并写入任务记录，返回最终状态；图片只保留在闭包中，不写入任务记录
+      // 后台生成的模型调用排在交互请求之后
+      type JobRunOptions = {
+        photoType?: string;
+        person?: any;
+        speculative: number;
+        client: GeminiClient;
+        checkpoint?: PoseCheckpoint;
+      };
+      const runJob = (
+        jobStore: JobStore<Job>,
+        jobId: string,
+        jobAction: string,
+        jobImage: ImagePart,
+        options: JobRunOptions
+      ): Promise<Pick<Job, 'status' | 'result' | 'error'>> => {
+        const trace = createTrace(jobAction === 'analyze' ? 'interactive' : 'background');
+        // 进度合并后按存储的最小间隔写入；检查点与终态立即写入并在失败时重试
+        // 检查点写入失败只记日志，不中断处理（恢复时从上一个检查点开始）
+        const writer = new JobRecordWriter(jobStore, jobId);
+        const onProgress = (progress: JobProgress) => writer.update(progressUpdate(progress));
+        const checkpointer: PoseCheckpointer = {
+          initial: options.checkpoint,
+          save: checkpoint => writer.flush(() => ({ checkpoint }))
+            .catch(e => console.error(`[Job ${jobId}] Checkpoint write failed:`, e)),
+          storeImage: image => storeImageAsset(assets, image),
+          loadImage: async imageId => (await resolveImage(assets, undefined, imageId))!,
+        };
+        const processJob = async () => {
+          const startedAt = Date.now();
+          const finish = (status: 'completed' | 'failed') => {
+            jobsInFlight--;
+            jobsTotal.inc({ action: jobAction, status });
+            jobDuration.observe({ action: jobAction }, (Date.now() - startedAt) / 1000);
+          };
+          jobsInFlight++;
+          let outcome: Pick<Job, 'status' | 'result' | 'error'>;
+          try {
+            await writer.flush(() => ({ status: 'processing' }));
+
+            let jobResult: any;
+            switch (jobAction) {
+              case 'processPose': {
+                const poseResult = await processPoseInBackground(
+                  options.client, analysisModels, generationModels, jobImage, options.photoType || '', options.person,
+                  trace, cache, onProgress, options.speculative, checkpointer, prescreen
+                );
+                // 生成图存为资源，任务记录只保存地址
+                jobResult = { ...poseResult, ...await storeGeneratedImage(assets, poseResult.image, assetPath) };
+                break;
+              }
+              case 'analyze': {
+                jobResult = await analyzePerson(options.client, analysisModels, jobImage, cache, trace);
+                break;
+              }
+              default:
+                throw new Error(`Unsupported job action: ${jobAction}`);
+            }
+
+            outcome = { status: 'completed', result: jobResult };
+          } catch (e: any) {
+            console.error(`[Job ${jobId}] Error:`, e);
+            outcome = { status: 'failed', error: e.message };
+          }
+          // 终态与未写入的进度一起写入；重试用尽仍失败时记录并按失败返回，调用方（批量清单）据此标记失败
+          try {
+            await writer.flush(() => ({ ...outcome, spans: trace.spans }));
+          } catch (e: any) {
+            console.error(`[Job ${jobId}] Final status write failed:`, e);
+            jobStoreWriteFailures.inc({ action: jobAction });
+            outcome = { status: 'failed', error: `JOB_STORE_WRITE_FAILED: ${e.message}` };
+          }
+          finish(outcome.status as 'completed' | 'failed');
+          return outcome;
+        };
+        return processJob();
+      };
+
+      // 启动后台处理；waitUntil 让运行时在响应返回后继续执行
+      const runInBackground = (work: Promise<unknown>) => {
+        if (waitUntil) {
+          waitUntil(work);
+        } else {
+          work.catch(console.error);
+        }
+      };
+      const startJob = (jobStore: JobStore<Job>, jobId: string, jobAction: string, jobImage: ImagePart, options: JobRunOptions) => {
+        runInBackground(runJob(jobStore, jobId, jobAction, jobImage, options));
+      };
+
       switch (action) {
       case 'analyze': {
-        // 使用 gemini-3-pro-preview 分析原图
-        const prompt = buildAnalyzePrompt();
-        
-        const imageData = image?.split(',')[1] || image;
-        const parts = [
-          { text: prompt },
-          { inlineData: { data: imageData, mimeType: 'image/jpeg' } }
-        ];
-        
-        const response = await generateContentWithFallback(genAI, analysisModels, parts);
-        const text = response.response.text();
-        result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+        // 使用 gemini-3-pro-preview 分析原图；image 为 data URL，或通过 data.imageId 引用已上传的图片
+        const original = await resolveImage(assets, image, data?.imageId);
+        if (!original) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing image' }, 400);
+        }
+        result = await analyzePerson(genAI, analysisModels, original, cache);
         break;
       }
 
       case 'design': {
         // 使用 gemini-3-pro-preview 设计方案
         const photoType = data.photoType || '正面头像';
-        const prompt = buildDesignPrompt(data.person, photoType);
-        
-        const response = await generateContentWithFallback(genAI, analysisModels, prompt);
-        const text = response.response.text();
-        result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+        result = await designForPose(genAI, analysisModels, data.person, photoType, cache);
         break;
       }
 
       case 'generate': {
         // 使用 gemini-3-pro-image-preview 生成图像
         // 关键：同时传递原图和prompt，确保人物一致性
-        const { person, design, photoType, referenceImage } = data;
+        const { person, design, photoType, referenceImage, referenceImageId } = data;
+        const reference = await resolveImage(assets, referenceImage, referenceImageId);
         
-        const prompt = buildGenerationPrompt(person, design, photoType, referenceImage);
+        const prompt = buildGenerationPrompt(person, design, photoType, reference?.data);
         
         // 构建parts：包含prompt和参考原图
         const parts: any[] = [{ text: prompt }];
         
         // 如果有参考原图，添加它作为视觉参考
-        if (referenceImage) {
-          const refImageData = referenceImage.split(',')[1] || referenceImage;
-          parts.push({ 
-            inlineData: { data: refImageData, mimeType: 'image/jpeg' } 
-          });
+        if (reference) {
+          parts.push({ inlineData: reference });
         }
         
         const response = await generateContentWithFallback(genAI, generationModels, parts);
         
-        // 提取生成的图像
-        let generatedImage: string | undefined;
+        // 提取生成的图像，存为资源后返回地址与资源 ID（与 processPose 相同）
+        let generatedImage: { image: string; imageId: string } | undefined;
         let textResponse = '';
         
         try {
@@ -754,7 +1671,7 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
             // @ts-ignore
             if (part.inlineData && part.inlineData.mimeType?.startsWith('image/')) {
               // @ts-ignore
-              generatedImage = `data:${part.inlineData.mimeType};base64,${part.inlineData.data}`;
+              generatedImage = await storeGeneratedImage(assets, { data: part.inlineData.data, mimeType: part.inlineData.mimeType }, assetPath);
               break;
             }
           }
@@ -762,7 +1679,8 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
         
         result = { 
           text: textResponse,
-          image: generatedImage,
+          image: generatedImage?.image,
+          imageId: generatedImage?.imageId,
           photoType: photoType
         };
         break;
@@ -770,32 +1688,28 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
 
       case 'review': {
         // 使用 gemini-3-pro-preview 审核（对比原图和生成图）
-        const { person, photoType, originalImage, generatedImage } = data;
+        const { person, photoType, originalImage, originalImageId, generatedImage, generatedImageId } = data;
+        const original = await resolveImage(assets, originalImage, originalImageId);
+        const generated = await resolveImage(assets, generatedImage, generatedImageId);
         
-        const prompt = buildComparisonPrompt(originalImage, generatedImage, person, photoType);
+        const prompt = buildComparisonPrompt(original?.data || '', generated?.data || '', person, photoType);
         
         // 构建parts：同时包含原图和生成图
         const parts: any[] = [{ text: prompt }];
         
-        if (originalImage) {
-          const origData = originalImage.split(',')[1] || originalImage;
-          parts.push({ 
-            inlineData: { data: origData, mimeType: 'image/jpeg' } 
-          });
+        if (original) {
+          parts.push({ inlineData: original });
         }
         
-        if (generatedImage) {
-          const genData = generatedImage.split(',')[1] || generatedImage;
-          parts.push({ 
-            inlineData: { data: genData, mimeType: 'image/jpeg' } 
-          });
+        if (generated) {
+          parts.push({ inlineData: generated });
         }
         
         const response = await generateContentWithFallback(genAI, analysisModels, parts);
         const text = response.response.text();
         
         try {
-          result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+          result = parseModelJson(text);
         } catch (e) {
           // Fallback if JSON parsing fails
           result = {
@@ -813,16 +1727,14 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
 
       case 'reviewInput': {
         const parts: any[] = [{ text: buildInputReviewPrompt() }];
-        if (image) {
-          const origData = image.split(',')[1] || image;
-          parts.push({
-            inlineData: { data: origData, mimeType: 'image/jpeg' }
-          });
+        const original = await resolveImage(assets, image, data?.imageId);
+        if (original) {
+          parts.push({ inlineData: original });
         }
         const response = await generateContentWithFallback(genAI, analysisModels, parts);
         const text = response.response.text();
         try {
-          result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+          result = parseModelJson(text);
         } catch (e) {
           result = {
             overallScore: 75,
@@ -837,58 +1749,23 @@ export async function onRequestPost({ request, env }: { request: Request; env: E
 
       case 'reviewPrompt': {
         // 评审Prompt质量
-        const { originalImage, photoType, prompt, iteration } = data;
+        const { originalImage, originalImageId, photoType, prompt, iteration } = data;
+        const original = await resolveImage(assets, originalImage, originalImageId);
         
-        const reviewPromptText = `Review this prompt for generating a professional ${photoType} photo.
-
-Original Image Reference: (see attached)
-Target Pose: ${photoType}
-
-Final Target Use Cases (MANDATORY):
-- Personal resume
-- Personal homepage
-- News publication
-- Company publicity board
-
-Prompt to Review:
-${JSON.stringify(prompt, null, 2)}
-
-Evaluation Criteria:
-1. Does the prompt clearly specify the pose requirements for ${photoType}?
-2. Does it preserve the person's unique features from the reference image?
-3. Is the styling appropriate for formal business photography (dress shirt or dress shirt + suit jacket only)?
-4. Is the lighting and background specification clear and studio-only?
-5. Does the prompt explicitly target suitability for resume/homepage/news/company publicity use?
-6. Are all poses framed as high-end professional studio portraits with professional styling/makeup/photography?
-7. Are there any missing or unclear elements?
-
-Strict Approval Rules:
-- If the prompt does NOT explicitly target the above use cases, set approved=false.
-- If formal attire or studio-only requirements are missing/ambiguous, set approved=false.
-
-Output strict JSON:
-{
-  "overallScore": "number 0-100",
-  "approved": "boolean (true if score >= 70)",
-  "summary": "brief assessment",
-  "strengths": ["what's good about this prompt"],
-  "weaknesses": ["what needs improvement"],
-  "suggestions": ["specific suggestions for improvement"],
-  "iteration": ${iteration}
-}`;
+        // 与后台流水线使用同一份评审模板；旧客户端可能传入结构化的 prompt 对象
+        const promptText = typeof prompt === 'string' ? prompt : JSON.stringify(prompt, null, 2);
+        const reviewPromptText = buildPromptReviewText(promptText, photoType, iteration || 1);
 
         const parts: any[] = [{ text: reviewPromptText }];
-        if (originalImage) {
-          parts.push({ 
-            inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } 
-          });
+        if (original) {
+          parts.push({ inlineData: original });
         }
         
         const response = await generateContentWithFallback(genAI, analysisModels, parts);
         const text = response.response.text();
         
         try {
-          result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+          result = parseModelJson(text);
         } catch (e) {
           result = {
             overallScore: 75,
@@ -905,29 +1782,27 @@ Output strict JSON:
 
       case 'reviewResult': {
         // 评审生成结果质量
-        const { originalImage, photoType, generatedImage, iteration } = data;
+        const { originalImage, originalImageId, photoType, generatedImage, generatedImageId, iteration } = data;
+        const original = await resolveImage(assets, originalImage, originalImageId);
+        const generated = await resolveImage(assets, generatedImage, generatedImageId);
         
-        const reviewPrompt = buildComparisonPrompt(originalImage, generatedImage, {}, photoType);
+        const reviewPrompt = buildComparisonPrompt(original?.data || '', generated?.data || '', {}, photoType);
         
         const parts: any[] = [{ text: reviewPrompt }];
         
-        if (originalImage) {
-          parts.push({ 
-            inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } 
-          });
+        if (original) {
+          parts.push({ inlineData: original });
         }
         
-        if (generatedImage) {
-          parts.push({ 
-            inlineData: { data: generatedImage.split(',')[1] || generatedImage, mimeType: 'image/jpeg' } 
-          });
+        if (generated) {
+          parts.push({ inlineData: generated });
         }
         
         const response = await generateContentWithFallback(genAI, analysisModels, parts);
         const text = response.response.text();
         
         try {
-          result = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
+          result = parseModelJson(text);
           result.iteration = iteration || 1;
         } catch (e) {
           result = {
@@ -946,224 +1821,361 @@ Output strict JSON:
 
       case 'processAll': {
         // 完整的处理流程
-        const { originalImage } = data;
+        const original = await resolveImage(assets, data.originalImage, data.originalImageId);
+        if (!original) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing originalImage' }, 400);
+        }
         
-        // Step 1: Analyze
-        const analyzePrompt = buildAnalyzePrompt();
-        const analyzeResponse = await generateContentWithFallback(genAI, analysisModels, [
-          { text: analyzePrompt },
-          { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } }
-        ]);
-        const person = JSON.parse(analyzeResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
+        // Step 1: Analyze（所有姿势共享同一份人物分析）
+        const person = await analyzePerson(genAI, analysisModels, original, cache);
         
-        // Step 2: Generate all poses
-        const photoTypes = ['正面头像', '侧面头像', '肖像照', '半身照', '全身照'];
-        const photos = [];
+        // Step 2: 并行生成所有姿势（固定 5 个）；模型调用经过调度器按模型限速，配置了 MAX_CONCURRENT_MODEL_CALLS 时另受在途上限约束
+        const photoTypes = ALL_PHOTO_TYPES;
         
-        for (const photoType of photoTypes) {
+        const processOne = async (photoType: string) => {
           // Design
-          const designPrompt = buildDesignPrompt(person, photoType);
-          const designResponse = await generateContentWithFallback(genAI, analysisModels, designPrompt);
-          const design = JSON.parse(designResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
+          const design = await designForPose(genAI, analysisModels, person, photoType, cache);
           
           // Generate
-          const genPrompt = buildGenerationPrompt(person, design, photoType, originalImage);
-          const genResponse = await generateContentWithFallback(genAI, generationModels, [
-            { text: genPrompt },
-            { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } }
+          const genPrompt = buildGenerationPrompt(person, design, photoType, original.data);
+          let generatedImage: ImagePart;
+          try {
+            generatedImage = await generateImageFromPrompt(genAI, generationModels, genPrompt, original);
+          } catch (e: any) {
+            if (e.message === 'IMAGE_GENERATION_FAILED') return undefined;
+            throw e;
+          }
+          
+          // Review
+          const comparePrompt = buildComparisonPrompt(original.data, generatedImage.data, person, photoType);
+          const reviewResponse = await generateContentWithFallback(genAI, analysisModels, [
+            { text: comparePrompt },
+            { inlineData: original },
+            { inlineData: generatedImage }
           ]);
           
-          // Extract image
-          let generatedImage: string | undefined;
-          const candidates = genResponse.response.candidates;
-          if (candidates && candidates[0]?.content?.parts) {
-            for (const part of candidates[0].content.parts) {
-              // @ts-ignore
-              if (part.inlineData && part.inlineData.mimeType?.startsWith('image/')) {
-                // @ts-ignore
-                generatedImage = `data:${part.inlineData.mimeType};base64,${part.inlineData.data}`;
-                break;
-              }
-            }
+          let review;
+          try {
+            review = parseModelJson(reviewResponse.response.text());
+          } catch (e) {
+            review = {
+              identityMatch: { score: 75, confidence: 'Medium', verdict: 'Same person' },
+              overallScore: 75,
+              approved: true,
+              summary: 'Review completed'
+            };
           }
           
-          if (generatedImage) {
-            // Review
-            const comparePrompt = buildComparisonPrompt(originalImage, generatedImage, person, photoType);
-            const reviewResponse = await generateContentWithFallback(genAI, analysisModels, [
-              { text: comparePrompt },
-              { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } },
-              { inlineData: { data: generatedImage.split(',')[1] || generatedImage, mimeType: 'image/jpeg' } }
-            ]);
-            
-            let review;
-            try {
-              review = JSON.parse(reviewResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
-            } catch (e) {
-              review = {
-                identityMatch: { score: 75, confidence: 'Medium', verdict: 'Same person' },
-                overallScore: 75,
-                approved: true,
-                summary: 'Review completed'
-              };
+          const stored = await storeGeneratedImage(assets, generatedImage, assetPath);
+          return {
+            type: photoType,
+            url: stored.image,
+            imageId: stored.imageId,
+            review: review
+          };
+        };
+        
+        if (data.stream) {
+          // NDJSON 流式返回：每个姿势完成即推送一行，不等待全部完成
+          const encoder = new TextEncoder();
+          const stream = new ReadableStream({
+            async start(controller) {
+              const send = (event: any) => controller.enqueue(encoder.encode(JSON.stringify(event) + '\n'));
+              send({ type: 'person', person });
+              let count = 0;
+              await Promise.all(photoTypes.map(async (photoType) => {
+                try {
+                  const photo = await processOne(photoType);
+                  if (photo) {
+                    count++;
+                    send({ type: 'photo', photo });
+                  } else {
+                    send({ type: 'error', photoType, error: 'No image generated' });
+                  }
+                } catch (e: any) {
+                  console.error(`[processAll] ${photoType} failed:`, e);
+                  send({ type: 'error', photoType, error: e.message || 'Unknown error' });
+                }
+              }));
+              send({ type: 'done', count });
+              controller.close();
             }
-            
-            photos.push({
-              type: photoType,
-              url: generatedImage,
-              review: review
-            });
-          }
+          });
+          return new Response(stream, {
+            headers: { ...cors, 'Content-Type': 'application/x-ndjson', 'Cache-Control': 'no-store' }
+          });
         }
         
+        const settled = await Promise.all(photoTypes.map(processOne));
+        const photos = settled.filter(photo => photo !== undefined);
+        
         result = { person, photos };
         break;
       }
 
       case 'processPose': {
-        const { originalImage, photoType, person: providedPerson } = data || {};
-        if (!originalImage || !photoType) {
+        const { originalImage, originalImageId, photoType, person: providedPerson } = data || {};
+        const original = await resolveImage(assets, originalImage, originalImageId);
+        if (!original || !photoType) {
           return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing originalImage or photoType' }, 400);
         }
 
-        let person = providedPerson;
-        if (!person) {
-          const analyzePrompt = buildAnalyzePrompt();
-          const analyzeResponse = await generateContentWithFallback(genAI, analysisModels, [
-            { text: analyzePrompt },
-            { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } }
-          ]);
-          person = JSON.parse(analyzeResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
+        const trace = createTrace();
+        const speculative = speculativeCandidatesFor(data?.speculative, normalizedEnv);
+        const poseResult = await processPoseInBackground(genAI, analysisModels, generationModels, original, photoType, providedPerson, trace, cache, undefined, speculative, undefined, prescreen);
+        const stored = await storeGeneratedImage(assets, poseResult.image, assetPath);
+        result = { ...poseResult, ...stored, spans: trace.spans };
+        break;
+      }
+
+      case 'submitJob': {
+        // 提交异步任务
+        const { action: jobAction, image, data: jobData } = data || {};
+        if (!jobAction) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing job action' }, 400);
         }
 
-        const designPrompt = buildDesignPrompt(person, photoType);
-        const designResponse = await generateContentWithFallback(genAI, analysisModels, designPrompt);
-        const design = JSON.parse(designResponse.response.text().replace(/```json/g, '').replace(/```/g, '').trim());
-
-        let promptText = buildGenerationPrompt(person, design, photoType, originalImage);
-        let promptIterations = 0;
-        let generationIterations = 0;
-        let finalImage: string | undefined;
-        let finalReview: any = undefined;
-
-        while (promptIterations < ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
-          promptIterations++;
-          const promptReview = await reviewPromptQuality(genAI, analysisModels, promptText, originalImage, photoType, promptIterations);
-          const promptApproved = promptReview.approved ?? (promptReview.overallScore || 0) >= 70;
-          if (!promptApproved && promptIterations < ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
-            promptText = refinePromptText(promptText, promptReview);
-            continue;
-          }
+        // 先解析图片，引用了不存在的资源时直接返回 404
+        const jobImage = jobAction === 'processPose'
+          ? await resolveImage(assets, jobData?.originalImage, jobData?.originalImageId)
+          : await resolveImage(assets, image, jobData?.imageId);
+        if (!jobImage) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing image' }, 400);
+        }
 
-          let genAttempts = 0;
-          let approved = false;
-          while (genAttempts < ITERATION_LIMITS.MAX_GENERATION_ITERATIONS) {
-            genAttempts++;
-            generationIterations++;
-            const generatedImage = await generateImageFromPrompt(genAI, generationModels, promptText, originalImage);
-            const comparePrompt = buildComparisonPrompt(originalImage, generatedImage, person, photoType);
-            const compareResponse = await generateContentWithFallback(genAI, analysisModels, [
-              { text: comparePrompt },
-              { inlineData: { data: originalImage.split(',')[1] || originalImage, mimeType: 'image/jpeg' } },
-              { inlineData: { data: generatedImage.split(',')[1] || generatedImage, mimeType: 'image/jpeg' } }
-            ]);
-            const text = compareResponse.response.text();
-            try {
-              finalReview = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
-            } catch (e) {
-              finalReview = {
-                identityMatch: { score: 75, confidence: 'Medium', verdict: 'Same person' },
-                overallScore: 75,
-                approved: true,
-                summary: 'Review completed'
-              };
-            }
-            finalImage = generatedImage;
-            approved = finalReview.approved ?? (finalReview.overallScore || 0) >= 70;
-            if (approved) {
-              break;
-            }
-          }
+        const jobStore = getJobStore(normalizedEnv);
+        if (!jobStore.hasCapacity(1)) {
+          return jsonResponse({ error: 'JOB_STORE_FULL', message: 'Too many jobs in progress, retry later' }, 503);
+        }
+        const speculative = speculativeCandidatesFor(jobData?.speculative, normalizedEnv);
+        const contentKey = await jobContentKey(jobAction, jobImage, jobData, jobAction === 'processPose' ? speculative : 1);
+        const dedupTtlMs = (parseInt(normalizedEnv.JOB_DEDUP_TTL_SECONDS || '') || 600) * 1000;
+        // processPose 的原图存为资源并随任务一起记录（连同调用方给出的 person），失败后 resumeJob 可以重新取得
+        const jobRecordData = jobAction === 'processPose'
+          ? { photoType: jobData?.photoType, person: jobData?.person, imageId: jobData?.originalImageId || await storeImageAsset(assets, jobImage), speculative }
+          : { photoType: jobData?.photoType };
+        const { job, created } = await findOrCreateJob(jobStore, contentKey, jobAction, jobRecordData, dedupTtlMs);
+        if (!created) {
+          // 相同内容的任务已存在：返回已有 jobId，已完成的直接带上结果
+          console.log(`[Job ${job.id}] Deduplicated ${jobAction} submission (${job.status})`);
+          result = {
+            jobId: job.id,
+            status: job.status,
+            deduplicated: true,
+            ...(job.status === 'completed' ? { result: job.result } : {}),
+          };
+          break;
+        }
 
-          if (finalImage && (finalReview?.approved ?? (finalReview?.overallScore || 0) >= 70)) {
-            break;
-          }
+        // 替身模式下可按请求注入故障（data.fault = { stage, times }），用于验证 resumeJob
+        const fault = isStubBackend(normalizedEnv) ? parseStubFault(jobData?.fault) : undefined;
+        startJob(jobStore, job.id, jobAction, jobImage, {
+          photoType: jobData?.photoType,
+          person: jobData?.person,
+          speculative,
+          client: fault ? withStubFault(genAI, fault) : genAI,
+        });
 
-          if (promptIterations >= ITERATION_LIMITS.MAX_PROMPT_ITERATIONS) {
-            break;
-          }
+        // 立即返回 jobId
+        result = { jobId: job.id, status: job.status };
+        break;
+      }
 
-          promptText = refinePromptText(promptText, finalReview);
+      case 'resumeJob': {
+        // 从检查点继续失败的 processPose 任务，已完成的阶段不再调用模型
+        const { jobId } = data || {};
+        if (!jobId) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing jobId' }, 400);
         }
-
-        if (!finalImage) {
-          return jsonResponse({ error: 'IMAGE_GENERATION_FAILED', message: 'Failed to generate image after all attempts' }, 500);
+        // 检查与登记之间没有 await：同一实例内并发的 resumeJob 只有第一个能继续
+        if (resumingJobs.has(jobId)) {
+          return jsonResponse({ error: 'JOB_NOT_RESUMABLE', message: 'Job is already being resumed' }, 409);
         }
+        resumingJobs.add(jobId);
+        let started = false;
+        try {
+          const jobStore = getJobStore(normalizedEnv);
+          const job = await jobStore.get(jobId);
+          if (!job) {
+            return jsonResponse({ error: 'JOB_NOT_FOUND', message: 'Job not found or expired' }, 404);
+          }
+          if (job.action !== 'processPose' || job.status !== 'failed' || !job.data?.imageId) {
+            return jsonResponse({ error: 'JOB_NOT_RESUMABLE', message: `Job is ${job.status}` }, 409);
+          }
+          const jobImage = await resolveImage(assets, undefined, job.data.imageId);
+
+          // 只在记录仍为 failed 时写入本次的 resumeToken，再读回确认；读回的标记不是自己的，说明其它实例的 resumeJob 后写入，由它继续。
+          // KV 最终一致且没有条件写入，两个实例仍可能都读回自己的标记，跨实例只是尽力而为
+          const resumeToken = crypto.randomUUID();
+          await new JobRecordWriter(jobStore, jobId).flush(current => current.status === 'failed' ? {
+            status: 'pending',
+            error: undefined,
+            resumeToken,
+            attempts: [...(current.attempts || []), { error: current.error, spans: current.spans }],
+          } : {});
+          const claimed = await jobStore.get(jobId);
+          if (claimed?.resumeToken !== resumeToken) {
+            return jsonResponse({ error: 'JOB_NOT_RESUMABLE', message: 'Job is already being resumed' }, 409);
+          }
 
-        result = {
-          image: finalImage,
-          review: finalReview || {
-            overallScore: 75,
-            approved: true,
-            summary: 'Image generated'
-          },
-          promptIterations,
-          generationIterations
-        };
+          console.log(`[Job ${jobId}] Resuming from ${checkpointStage(job.checkpoint)}`);
+          // 恢复后的运行结束（状态不再是 pending / processing）后才释放登记
+          started = true;
+          runInBackground(runJob(jobStore, jobId, job.action, jobImage!, {
+            photoType: job.data.photoType,
+            person: job.data.person,
+            speculative: job.data.speculative || 1,
+            client: genAI,
+            checkpoint: job.checkpoint,
+          }).finally(() => resumingJobs.delete(jobId)));
+          result = { jobId, status: 'pending', resumedFrom: checkpointStage(job.checkpoint) };
+        } finally {
+          if (!started) resumingJobs.delete(jobId);
+        }
         break;
       }
 
-      case 'submitJob': {
-        // 提交异步任务
-        const { action: jobAction, image, data: jobData } = data || {};
-        if (!jobAction) {
-          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing job action' }, 400);
+      case 'submitBatch': {
+        // 批量任务：data.items = [{ name, imageId | image, photoTypes }]，photoTypes 缺省为全部姿势
+        // 每张图片分析一次，各姿势作为子任务经工作池执行，当前实例同时进行的流水线不超过 BATCH_CONCURRENCY
+        const rawItems: any[] = Array.isArray(data?.items) ? data.items : [];
+        const maxItems = parseInt(normalizedEnv.BATCH_MAX_ITEMS || '') || 20;
+        if (rawItems.length === 0 || rawItems.length > maxItems) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: `items must contain 1 to ${maxItems} images` }, 400);
         }
 
-        const job = createJob(jobAction, { image, data: jobData });
-
-        // 在后台处理任务 (使用 ctx.waitUntil 如果可用)
-        const processJob = async () => {
-          try {
-            updateJob(job.id, { status: 'processing' });
+        // 先校验全部条目并把图片存为资源，处理时按 ID 逐个读取，不在内存中同时持有所有图片
+        const accepted: Array<{ name: string; imageId: string; photoTypes: string[] }> = [];
+        for (const [index, raw] of rawItems.entries()) {
+          const requested: string[] = Array.isArray(raw?.photoTypes) && raw.photoTypes.length > 0 ? raw.photoTypes : ALL_PHOTO_TYPES;
+          const photoTypes = [...new Set(requested)];
+          const invalid = photoTypes.filter(type => !ALL_PHOTO_TYPES.includes(type));
+          if (invalid.length > 0) {
+            return jsonResponse({ error: 'INVALID_REQUEST', message: `items[${index}]: unknown photoTypes ${invalid.join(', ')}` }, 400);
+          }
+          const image = await resolveImage(assets, raw?.image, raw?.imageId);
+          if (!image) {
+            return jsonResponse({ error: 'INVALID_REQUEST', message: `items[${index}]: missing image` }, 400);
+          }
+          const imageId = raw.imageId || await storeImageAsset(assets, image);
+          accepted.push({ name: String(raw.name || `item-${index + 1}`), imageId, photoTypes });
+        }
 
-            let jobResult: any;
-            switch (jobAction) {
-              case 'processPose': {
-                const { originalImage, photoType, person: providedPerson } = jobData || {};
-                jobResult = await processPoseInBackground(genAI, analysisModels, generationModels, originalImage, photoType, providedPerson);
-                break;
-              }
-              case 'analyze': {
-                const imageData = image?.split(',')[1] || image;
-                const parts = [
-                  { text: buildAnalyzePrompt() },
-                  { inlineData: { data: imageData, mimeType: 'image/jpeg' } }
-                ];
-                const response = await generateContentWithFallback(genAI, analysisModels, parts);
-                const text = response.response.text();
-                jobResult = JSON.parse(text.replace(/```json/g, '').replace(/```/g, '').trim());
-                break;
-              }
-              default:
-                throw new Error(`Unsupported job action: ${jobAction}`);
-            }
+        // 批量任务记录 + 每个姿势一个子任务；内存任务存储中未结束的任务不会被淘汰，放不下时整批拒绝
+        const jobStore = getJobStore(normalizedEnv);
+        const jobCount = 1 + accepted.reduce((sum, item) => sum + item.photoTypes.length, 0);
+        if (!jobStore.hasCapacity(jobCount)) {
+          return jsonResponse({ error: 'JOB_STORE_FULL', message: `Too many jobs in progress for ${jobCount} more, retry later` }, 503);
+        }
+        const speculative = speculativeCandidatesFor(data?.speculative, normalizedEnv);
+        const batchJob = await createJob(jobStore, 'batch', { items: accepted.length });
+        const items: BatchItem[] = [];
+        for (const item of accepted) {
+          const poses: BatchPose[] = [];
+          for (const photoType of item.photoTypes) {
+            const child = await createJob(jobStore, 'processPose', { photoType, imageId: item.imageId, speculative, batchId: batchJob.id });
+            poses.push({ photoType, jobId: child.id, status: 'pending' });
+          }
+          items.push({ name: item.name, imageId: item.imageId, poses });
+        }
+        const batchRecord: Job = { ...batchJob, batch: { items } };
+        await jobStore.put(batchRecord);
+
+        // 各姿势的状态变化在内存中合并，按存储的最小间隔写入清单；批量任务的终态立即写入并重试
+        const manifest = new JobRecordWriter(jobStore, batchJob.id);
+        const updatePose = (jobId: string, updates: Partial<BatchPose>) => manifest.update(current => ({
+          batch: {
+            items: (current.batch?.items || []).map(item => ({
+              ...item,
+              poses: item.poses.map(pose => (pose.jobId === jobId ? { ...pose, ...updates, updatedAt: Date.now() } : pose)),
+            })),
+          },
+        }));
+        const failPose = async (pose: BatchPose, error: string) => {
+          updatePose(pose.jobId, { status: 'failed', error });
+          await updateJob(jobStore, pose.jobId, { status: 'failed', error })
+            .catch(e => console.error(`[Batch ${batchJob.id}] Failed to mark ${pose.jobId} as failed:`, e));
+        };
 
-            updateJob(job.id, { status: 'completed', result: jobResult });
+        const pool = getBatchPool(normalizedEnv);
+        const runPose = (item: BatchItem, pose: BatchPose, person: any) => pool.run(async () => {
+          try {
+            const image = (await resolveImage(assets, undefined, item.imageId))!;
+            updatePose(pose.jobId, { status: 'processing' });
+            const outcome = await runJob(jobStore, pose.jobId, 'processPose', image, {
+              photoType: pose.photoType,
+              person,
+              speculative,
+              client: genAI,
+            });
+            updatePose(pose.jobId, outcome.status === 'completed'
+              ? { status: 'completed', image: outcome.result.image, imageId: outcome.result.imageId, review: outcome.result.review }
+              : { status: 'failed', error: outcome.error });
           } catch (e: any) {
-            console.error(`[Job ${job.id}] Error:`, e);
-            updateJob(job.id, { status: 'failed', error: e.message });
+            await failPose(pose, e.message);
           }
+        });
+        const runItem = async (item: BatchItem) => {
+          // 每张图片只分析一次，所有姿势共享；分析失败时该图片的所有姿势都记为失败
+          let person: any;
+          try {
+            person = await pool.run(async () => {
+              const image = (await resolveImage(assets, undefined, item.imageId))!;
+              return analyzePerson(genAI, analysisModels, image, cache, createTrace('background'));
+            });
+          } catch (e: any) {
+            console.error(`[Batch ${batchJob.id}] Analyze failed for ${item.name}:`, e);
+            await Promise.all(item.poses.map(pose => failPose(pose, e.message)));
+            return;
+          }
+          await Promise.all(item.poses.map(pose => runPose(item, pose, person)));
         };
 
-        // 启动后台处理
-        processJob().catch(console.error);
+        console.log(`[Batch ${batchJob.id}] ${items.length} images, ${batchCounts(items).poses} poses`);
+        runInBackground((async () => {
+          manifest.update(() => ({ status: 'processing' }));
+          await Promise.all(items.map(runItem));
+          try {
+            await manifest.flush(current => {
+              const counts = batchCounts(current.batch?.items || []);
+              return { status: counts.completed > 0 ? 'completed' : 'failed' };
+            });
+            console.log(`[Batch ${batchJob.id}] Finished`);
+          } catch (e) {
+            console.error(`[Batch ${batchJob.id}] Final manifest write failed:`, e);
+            jobStoreWriteFailures.inc({ action: 'batch' });
+          }
+        })());
 
-        // 立即返回 jobId
-        result = { jobId: job.id, status: job.status };
+        result = toBatchManifest(batchRecord);
         break;
       }
 
+      case 'getBatchStatus':
+      case 'streamBatch': {
+        // 批量任务清单；streamBatch 以 SSE 推送每个姿势的结果
+        const { batchId } = data || {};
+        if (!batchId) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing batchId' }, 400);
+        }
+        const jobStore = getJobStore(normalizedEnv);
+        const batchJob = await jobStore.get(batchId);
+        if (!batchJob || batchJob.action !== 'batch') {
+          return jsonResponse({ error: 'JOB_NOT_FOUND', message: 'Batch not found or expired' }, 404);
+        }
+        if (action === 'getBatchStatus') {
+          result = toBatchManifest(batchJob);
+          break;
+        }
+        return new Response(streamBatchEvents(jobStore, batchJob), {
+          headers: {
+            ...cors,
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-store',
+          }
+        });
+      }
+
       case 'getJobStatus': {
         // 查询任务状态
         const { jobId } = data || {};
@@ -1171,23 +2183,90 @@ Output strict JSON:
           return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing jobId' }, 400);
         }
 
-        const job = getJob(jobId);
+        const job = await getJobStore(normalizedEnv).get(jobId);
         if (!job) {
           return jsonResponse({ error: 'JOB_NOT_FOUND', message: 'Job not found or expired' }, 404);
         }
 
+        result = toJobStatus(job);
+        break;
+      }
+
+      case 'streamJobStatus': {
+        // 以 SSE 推送任务状态变化，替代客户端反复调用 getJobStatus
+        const { jobId } = data || {};
+        if (!jobId) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'Missing jobId' }, 400);
+        }
+
+        const jobStore = getJobStore(normalizedEnv);
+        const job = await jobStore.get(jobId);
+        if (!job) {
+          return jsonResponse({ error: 'JOB_NOT_FOUND', message: 'Job not found or expired' }, 404);
+        }
+
+        return new Response(streamJobEvents(jobStore, job), {
+          headers: {
+            ...cors,
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-store',
+          }
+        });
+      }
+
+      case 'stats': {
+        // 当前实例的缓存命中、并发、资源存储与内存中各表的大小
         result = {
-          jobId: job.id,
-          status: job.status,
-          action: job.action,
-          result: job.result,
-          error: job.error,
-          createdAt: job.createdAt,
-          updatedAt: job.updatedAt,
+          cache: cache.stats(),
+          assets: memoryAssetStore && !normalizedEnv.ASSETS_BUCKET
+            ? { count: memoryAssetStore.size, bytes: memoryAssetStore.bytes }
+            : { backend: 'r2' },
+          scheduler: scheduler.stats(),
+          ...(batchPool ? { batchPool: batchPool.stats() } : {}),
+          speculation: speculationTotals,
+          prescreen: { enabled: prescreen.options.enabled, ...summarizePrescreen(prescreenStats) },
+          memory: {
+            codeUsage: codeUsage.stats(),
+            ...(memoryJobStore && !normalizedEnv.JOBS_KV ? memoryJobStore.stats() : {}),
+          },
+          ...(cassetteStats ? { cassette: cassetteStats } : {}),
         };
         break;
       }
 
+      case 'metrics': {
+        // Prometheus 文本格式的实例指标（metrics_scrape.py 在 E2E 前后各抓取一次）
+        const denied = metricsAuthError(request, normalizedEnv, data?.token);
+        if (denied) {
+          return jsonResponse({ error: denied.error, message: 'Metrics require METRICS_TOKEN' }, denied.status);
+        }
+        return metricsResponse();
+      }
+
+      case 'cassette': {
+        // 录制 / 回放模式下导出、导入或清空 cassette（cassette.py 用它把录制保存到磁盘）
+        if (!isCassetteBackend(normalizedEnv)) {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: 'GEMINI_BACKEND must be record or replay' }, 400);
+        }
+        const store = getCassetteStore(normalizedEnv);
+        const op = data?.op || 'export';
+        if (op === 'export') {
+          result = { entries: await store.list() };
+        } else if (op === 'import') {
+          const entries: CassetteEntry[] = Array.isArray(data?.entries) ? data.entries : [];
+          for (const entry of entries) {
+            await store.append(entry);
+          }
+          result = { imported: entries.length };
+        } else if (op === 'clear') {
+          await store.clear();
+          result = { cleared: true };
+        } else {
+          return jsonResponse({ error: 'INVALID_REQUEST', message: `Unknown cassette op: ${op}` }, 400);
+        }
+        break;
+      }
+
       default:
         return jsonResponse({ error: 'INVALID_ACTION', message: `Unknown action: ${action}` }, 400);
     }
@@ -1195,6 +2274,12 @@ Output strict JSON:
     return jsonResponse({ result, action });
 
     } catch (e: any) {
+      if (e instanceof AssetNotFoundError) {
+        return jsonResponse({ error: 'ASSET_NOT_FOUND', message: e.message }, 404);
+      }
+      if (e instanceof CassetteMissError) {
+        return jsonResponse({ error: 'CASSETTE_MISS', message: e.message }, 404);
+      }
       console.error('[ERROR]', e);
       return jsonResponse({
         error: 'PROCESSING_ERROR',
@@ -0,0 +1,130 @@
+import { BoundedMap } from './boundedMap';
+
+// 图片资源存储：上传一次，之后按 ID 引用
+// - R2AssetStore：Cloudflare R2，跨实例共享
+// - MemoryAssetStore：当前实例内存（BoundedMap），按总字节数 + TTL 淘汰，用于未绑定 R2 的环境（本地开发 / 离线测试）
+// 资源 ID 为内容的 SHA-256，相同图片只存一份，ID 本身不可猜测
+// shared 表示资源能否从其它实例取到；内存存储的资源地址只在当前实例有效
+
+export interface Asset {
+  bytes: Uint8Array;
+  contentType: string;
+}
+
+export interface AssetStore {
+  readonly shared: boolean;
+  get(id: string): Promise<Asset | undefined>;
+  put(id: string, asset: Asset): Promise<void>;
+}
+
+// 模型调用使用的图片片段：base64 数据只解码/编码一次，在整个流水线中复用
+export interface ImagePart {
+  data: string;
+  mimeType: string;
+}
+
+const ASSET_ID_PATTERN = /^[0-9a-f]{64}$/;
+
+export function isAssetId(id: unknown): id is string {
+  return typeof id === 'string' && ASSET_ID_PATTERN.test(id);
+}
+
+export async function assetIdOf(bytes: Uint8Array): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', bytes);
+  return Array.from(new Uint8Array(digest))
+    .map(b => b.toString(16).padStart(2, '0'))
+    .join('');
+}
+
+export function bytesToBase64(bytes: Uint8Array): string {
+  let binary = '';
+  const chunk = 0x8000;
+  for (let i = 0; i < bytes.length; i += chunk) {
+    binary += String.fromCharCode(...bytes.subarray(i, i + chunk));
+  }
+  return btoa(binary);
+}
+
+export function base64ToBytes(base64: string): Uint8Array {
+  const binary = atob(base64);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+}
+
+// data URL 或裸 base64 → ImagePart（兼容旧客户端直接传 base64 的请求）
+export function imagePartFromDataUrl(image: string): ImagePart {
+  const match = /^data:([^;,]+);base64,/.exec(image);
+  if (!match) {
+    return { data: image, mimeType: 'image/jpeg' };
+  }
+  return { data: image.slice(match[0].length), mimeType: match[1] };
+}
+
+export function imagePartFromAsset(asset: Asset): ImagePart {
+  return { data: bytesToBase64(asset.bytes), mimeType: asset.contentType };
+}
+
+export class MemoryAssetStore implements AssetStore {
+  private assets: BoundedMap<string, Asset>;
+  private latest?: string;
+  readonly shared = false;
+
+  constructor(options: { maxBytes: number; ttlMs: number }) {
+    // 只按总字节数淘汰；刚写入的资源即使单独超出上限也保留，保证 put 之后立即可以 get
+    this.assets = new BoundedMap<string, Asset>({
+      maxEntries: Infinity,
+      ttlMs: options.ttlMs,
+      maxBytes: options.maxBytes,
+      sizeOf: asset => asset.bytes.length,
+      lru: true,
+      canEvict: (_, id) => id !== this.latest,
+    });
+  }
+
+  async get(id: string): Promise<Asset | undefined> {
+    return this.assets.get(id);
+  }
+
+  async put(id: string, asset: Asset): Promise<void> {
+    this.latest = id;
+    this.assets.set(id, { bytes: asset.bytes, contentType: asset.contentType });
+  }
+
+  get size(): number {
+    return this.assets.size;
+  }
+
+  get bytes(): number {
+    return this.assets.bytes;
+  }
+}
+
+export class R2AssetStore implements AssetStore {
+  readonly shared = true;
+
+  constructor(private bucket: R2Bucket) {}
+
+  async get(id: string): Promise<Asset | undefined> {
+    const object = await this.bucket.get(`assets/${id}`);
+    if (!object) return undefined;
+    return {
+      bytes: new Uint8Array(await object.arrayBuffer()),
+      contentType: object.httpMetadata?.contentType || 'application/octet-stream',
+    };
+  }
+
+  async put(id: string, asset: Asset): Promise<void> {
+    await this.bucket.put(`assets/${id}`, asset.bytes, {
+      httpMetadata: { contentType: asset.contentType },
+    });
+  }
+}
+
+export class AssetNotFoundError extends Error {
+  constructor(public assetId: string) {
+    super(`Asset not found or expired: ${assetId}`);
+  }
+}
@@ -0,0 +1,143 @@
+// 有界 Map：实例内长期存在的表（邀请码计数、签名防重放、内存任务存储）共用
+// - maxEntries：条数上限，超出时淘汰最早写入的条目
+// - ttlMs：写入后多久过期（0 表示不过期），读取时惰性删除，写入时顺带清理队首的过期条目
+// - maxBytes + sizeOf：按调用方给出的大小估算做内存记账，总量超出时同样从最早的条目开始淘汰
+// - canEvict：返回 false 的条目不会因条数或内存上限被淘汰（仍会按 TTL 过期），此时表可能暂时超出上限
+// 迭代顺序即写入顺序（重复 set 会移到末尾）；lru 为真时 get 也会移到末尾
+
+export interface BoundedMapOptions<K, V> {
+  maxEntries: number;
+  ttlMs?: number;
+  maxBytes?: number;
+  sizeOf?: (value: V, key: K) => number;
+  lru?: boolean;
+  canEvict?: (value: V, key: K) => boolean;
+}
+
+export interface BoundedMapStats {
+  size: number;
+  bytes: number;
+  maxEntries: number;
+  maxBytes?: number;
+  evictions: number;   // 因条数或内存上限被淘汰
+  expirations: number; // 因 TTL 过期被删除
+}
+
+interface Entry<V> {
+  value: V;
+  bytes: number;
+  expiresAt: number;
+}
+
+export class BoundedMap<K, V> {
+  private entries = new Map<K, Entry<V>>();
+  private totalBytes = 0;
+  private evictions = 0;
+  private expirations = 0;
+
+  constructor(private options: BoundedMapOptions<K, V>) {}
+
+  get(key: K): V | undefined {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+    if (this.isExpired(entry, Date.now())) {
+      this.remove(key, entry);
+      this.expirations++;
+      return undefined;
+    }
+    if (this.options.lru) {
+      this.entries.delete(key);
+      this.entries.set(key, entry);
+    }
+    return entry.value;
+  }
+
+  has(key: K): boolean {
+    return this.get(key) !== undefined;
+  }
+
+  // bytes 由调用方给出时不再调用 sizeOf（调用方已经序列化过时避免重复计算）
+  set(key: K, value: V, bytes?: number): this {
+    const existing = this.entries.get(key);
+    if (existing) {
+      this.remove(key, existing);
+    }
+    const size = bytes ?? (this.options.sizeOf ? this.options.sizeOf(value, key) : 0);
+    const ttlMs = this.options.ttlMs || 0;
+    this.entries.set(key, { value, bytes: size, expiresAt: ttlMs > 0 ? Date.now() + ttlMs : Infinity });
+    this.totalBytes += size;
+    this.prune();
+    return this;
+  }
+
+  delete(key: K): boolean {
+    const entry = this.entries.get(key);
+    if (!entry) return false;
+    this.remove(key, entry);
+    return true;
+  }
+
+  clear() {
+    this.entries.clear();
+    this.totalBytes = 0;
+  }
+
+  get size(): number {
+    return this.entries.size;
+  }
+
+  get bytes(): number {
+    return this.totalBytes;
+  }
+
+  *values(): IterableIterator<V> {
+    const now = Date.now();
+    for (const entry of this.entries.values()) {
+      if (!this.isExpired(entry, now)) yield entry.value;
+    }
+  }
+
+  *keys(): IterableIterator<K> {
+    const now = Date.now();
+    for (const [key, entry] of this.entries) {
+      if (!this.isExpired(entry, now)) yield key;
+    }
+  }
+
+  stats(): BoundedMapStats {
+    return {
+      size: this.entries.size,
+      bytes: this.totalBytes,
+      maxEntries: this.options.maxEntries,
+      ...(this.options.maxBytes ? { maxBytes: this.options.maxBytes } : {}),
+      evictions: this.evictions,
+      expirations: this.expirations,
+    };
+  }
+
+  private isExpired(entry: Entry<V>, now: number): boolean {
+    return entry.expiresAt <= now;
+  }
+
+  private remove(key: K, entry: Entry<V>) {
+    this.entries.delete(key);
+    this.totalBytes -= entry.bytes;
+  }
+
+  private prune() {
+    const now = Date.now();
+    const maxBytes = this.options.maxBytes ?? Infinity;
+    for (const [key, entry] of this.entries) {
+      // 从最早的条目开始，遇到未过期且未超量的即可停止；不可淘汰的条目跳过
+      if (this.isExpired(entry, now)) {
+        this.expirations++;
+      } else if (this.entries.size > this.options.maxEntries || this.totalBytes > maxBytes) {
+        if (this.options.canEvict && !this.options.canEvict(entry.value, key)) continue;
+        this.evictions++;
+      } else {
+        break;
+      }
+      this.remove(key, entry);
+    }
+  }
+}
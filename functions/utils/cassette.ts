@@ -0,0 +1,269 @@
+import type { GenerateContentResult } from '@google/generative-ai';
+import { firstTextOf, type GeminiClient } from './geminiClient';
+import { BoundedMap } from './boundedMap';
+import { sha256Hex, stableStringify } from './resultCache';
+
+// Gemini 调用的录制 / 回放 (GEMINI_BACKEND=record | replay)
+// - record：包装真实客户端，每次 generateContent 的请求哈希、模型、耗时与响应（含失败）写入 cassette
+// - replay：不访问网络，按请求内容哈希返回录制的响应；可按 REPLAY_LATENCY_FACTOR 重现或压缩录制时的耗时
+// 同一请求被调用多次（如重复生成）时按出现顺序依次回放，超出后沿用最后一条
+// 图片重新编码导致完整哈希不同时，退回按 模型 + prompt 文本 匹配
+
+export interface CassetteEntry {
+  key: string;          // 模型 + 完整请求（含图片）的 SHA-256
+  promptKey: string;    // 模型 + 请求中文本部分的 SHA-256
+  model: string;
+  prompt: string;       // 第一段文本的前 80 个字符，便于人工查看
+  latencyMs: number;
+  requestBytes: number;
+  responseBytes: number;
+  candidates?: any[];   // response.candidates
+  error?: string;       // 录制时调用失败（如 429），回放时抛出同样的错误
+  recordedAt: number;
+}
+
+export interface CassetteStore {
+  get(key: string): Promise<CassetteEntry[] | undefined>;
+  append(entry: CassetteEntry): Promise<void>;
+  list(): Promise<CassetteEntry[]>;
+  clear(): Promise<void>;
+}
+
+export interface CassetteStats {
+  mode: 'record' | 'replay';
+  recorded: number;
+  exactHits: number;
+  promptHits: number;
+  misses: number;
+  recordedLatencyMs: number; // 回放的调用在录制时的总耗时
+  replayedLatencyMs: number; // 回放时实际等待的总时间
+}
+
+export class CassetteMissError extends Error {
+  constructor(public model: string, public prompt: string) {
+    super(`CASSETTE_MISS: no recorded response for ${model} "${prompt}"`);
+  }
+}
+
+// 同一请求最多保留的录制条数，避免反复录制时无限增长
+const MAX_ENTRIES_PER_KEY = 8;
+const PROMPT_PREVIEW_CHARS = 80;
+const textEncoder = new TextEncoder();
+
+function promptIndexKey(promptKey: string) {
+  return `prompt:${promptKey}`;
+}
+
+// 当前实例内存：按条数与序列化后的字节数限制（BoundedMap），超出时从最早录制的请求开始淘汰
+export class MemoryCassetteStore implements CassetteStore {
+  private entries: BoundedMap<string, CassetteEntry[]>;
+
+  constructor(options: { maxEntries: number; maxBytes: number }) {
+    this.entries = new BoundedMap<string, CassetteEntry[]>({
+      ...options,
+      sizeOf: list => textEncoder.encode(JSON.stringify(list)).length,
+    });
+  }
+
+  async get(key: string) {
+    return this.entries.get(key);
+  }
+
+  async append(entry: CassetteEntry) {
+    for (const key of [entry.key, promptIndexKey(entry.promptKey)]) {
+      const list = this.entries.get(key) || [];
+      this.entries.set(key, [...list, entry].slice(-MAX_ENTRIES_PER_KEY));
+    }
+  }
+
+  async list() {
+    return [...this.entries.keys()]
+      .filter(key => !key.startsWith('prompt:'))
+      .flatMap(key => this.entries.get(key) || []);
+  }
+
+  async clear() {
+    this.entries.clear();
+  }
+
+  get size() {
+    return this.entries.size;
+  }
+}
+
+// KV 存储：wrangler dev 的本地 KV 持久化在 .wrangler/state，可跨多次运行复用
+export class KVCassetteStore implements CassetteStore {
+  constructor(private kv: KVNamespace) {}
+
+  private kvKey(key: string) {
+    return `cassette:${key}`;
+  }
+
+  async get(key: string) {
+    return (await this.kv.get<CassetteEntry[]>(this.kvKey(key), 'json')) || undefined;
+  }
+
+  async append(entry: CassetteEntry) {
+    for (const key of [entry.key, promptIndexKey(entry.promptKey)]) {
+      const list = (await this.get(key)) || [];
+      list.push(entry);
+      await this.kv.put(this.kvKey(key), JSON.stringify(list.slice(-MAX_ENTRIES_PER_KEY)));
+    }
+  }
+
+  private async keys(): Promise<string[]> {
+    const names: string[] = [];
+    let cursor: string | undefined;
+    do {
+      const page = await this.kv.list({ prefix: 'cassette:', cursor });
+      names.push(...page.keys.map(k => k.name));
+      cursor = page.list_complete ? undefined : page.cursor;
+    } while (cursor);
+    return names;
+  }
+
+  async list() {
+    const entries: CassetteEntry[] = [];
+    for (const name of await this.keys()) {
+      if (name.startsWith('cassette:prompt:')) continue;
+      entries.push(...((await this.kv.get<CassetteEntry[]>(name, 'json')) || []));
+    }
+    return entries;
+  }
+
+  async clear() {
+    for (const name of await this.keys()) {
+      await this.kv.delete(name);
+    }
+  }
+}
+
+export function createCassetteStats(mode: CassetteStats['mode']): CassetteStats {
+  return { mode, recorded: 0, exactHits: 0, promptHits: 0, misses: 0, recordedLatencyMs: 0, replayedLatencyMs: 0 };
+}
+
+function textParts(input: any): string[] {
+  if (typeof input === 'string') return [input];
+  const parts = Array.isArray(input) ? input : input?.contents?.[0]?.parts || [];
+  return parts
+    .map((part: any) => (typeof part === 'string' ? part : part?.text))
+    .filter((text: unknown): text is string => typeof text === 'string');
+}
+
+export async function cassetteKeys(model: string, input: any) {
+  const [key, promptKey] = await Promise.all([
+    sha256Hex(model, stableStringify(input)),
+    sha256Hex(model, ...textParts(input)),
+  ]);
+  return { key, promptKey };
+}
+
+function candidatesBytes(candidates: any[] | undefined): number {
+  let bytes = 0;
+  for (const part of candidates?.[0]?.content?.parts || []) {
+    if (part?.text) bytes += part.text.length;
+    else if (part?.inlineData?.data) bytes += part.inlineData.data.length;
+  }
+  return bytes;
+}
+
+function resultFromCandidates(candidates: any[]): GenerateContentResult {
+  return {
+    response: {
+      text: () => (candidates[0]?.content?.parts || [])
+        .map((part: any) => part?.text || '')
+        .join(''),
+      candidates,
+    },
+  } as unknown as GenerateContentResult;
+}
+
+function sleep(ms: number) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+export function createRecordingClient(upstream: GeminiClient, store: CassetteStore, stats: CassetteStats): GeminiClient {
+  return {
+    getGenerativeModel({ model }: { model: string }) {
+      const upstreamModel = upstream.getGenerativeModel({ model });
+      return {
+        async generateContent(input: any): Promise<GenerateContentResult> {
+          const keys = cassetteKeys(model, input);
+          const start = Date.now();
+          let result: GenerateContentResult | undefined;
+          let error: unknown;
+          try {
+            result = await upstreamModel.generateContent(input);
+          } catch (err) {
+            error = err;
+          }
+          const candidates = result?.response?.candidates as any[] | undefined;
+          const entry: CassetteEntry = {
+            ...await keys,
+            model,
+            prompt: firstTextOf(input).slice(0, PROMPT_PREVIEW_CHARS),
+            latencyMs: Date.now() - start,
+            requestBytes: JSON.stringify(input).length,
+            responseBytes: candidatesBytes(candidates),
+            candidates,
+            error: error ? String((error as any)?.message || error) : undefined,
+            recordedAt: Date.now(),
+          };
+          try {
+            await store.append(entry);
+            stats.recorded++;
+          } catch (e) {
+            console.warn('[Cassette] Failed to record entry:', e);
+          }
+          if (error) throw error;
+          return result!;
+        },
+      };
+    },
+  };
+}
+
+export function createReplayClient(store: CassetteStore, options: { latencyFactor: number }, stats: CassetteStats): GeminiClient {
+  // 每个 key 已回放的次数，同一请求多次调用时依次取后面的录制
+  const played = new Map<string, number>();
+
+  const pick = async (key: string) => {
+    const entries = await store.get(key);
+    if (!entries || entries.length === 0) return undefined;
+    const index = played.get(key) || 0;
+    played.set(key, index + 1);
+    return entries[Math.min(index, entries.length - 1)];
+  };
+
+  return {
+    getGenerativeModel({ model }: { model: string }) {
+      return {
+        async generateContent(input: any): Promise<GenerateContentResult> {
+          const { key, promptKey } = await cassetteKeys(model, input);
+          let entry = await pick(key);
+          if (entry) {
+            stats.exactHits++;
+          } else {
+            entry = await pick(promptIndexKey(promptKey));
+            if (entry) stats.promptHits++;
+          }
+          if (!entry) {
+            stats.misses++;
+            throw new CassetteMissError(model, firstTextOf(input).slice(0, PROMPT_PREVIEW_CHARS));
+          }
+
+          const delayMs = Math.round(entry.latencyMs * options.latencyFactor);
+          stats.recordedLatencyMs += entry.latencyMs;
+          stats.replayedLatencyMs += delayMs;
+          if (delayMs > 0) {
+            await sleep(delayMs);
+          }
+          if (entry.error) {
+            throw new Error(entry.error);
+          }
+          return resultFromCandidates(entry.candidates || []);
+        },
+      };
+    },
+  };
+}
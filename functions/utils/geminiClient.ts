@@ -0,0 +1,21 @@
+import type { GenerateContentResult } from '@google/generative-ai';
+
+// 模型调用的最小接口：真实的 GoogleGenerativeAI 与离线替身都实现它
+export interface GeminiModel {
+  generateContent(input: any): Promise<GenerateContentResult>;
+}
+
+export interface GeminiClient {
+  getGenerativeModel(params: { model: string }): GeminiModel;
+}
+
+// 从 generateContent 的输入中取出第一段文本（字符串 prompt 或 parts 数组）
+export function firstTextOf(input: any): string {
+  if (typeof input === 'string') return input;
+  const parts = Array.isArray(input) ? input : input?.contents?.[0]?.parts || [];
+  for (const part of parts) {
+    if (typeof part === 'string') return part;
+    if (part?.text) return part.text;
+  }
+  return '';
+}
@@ -0,0 +1,232 @@
+import { BoundedMap } from './boundedMap';
+
+// 任务存储接口
+// - KVJobStore：Cloudflare KV，跨实例共享，按 TTL 自动过期（本地 wrangler dev 下由本地持久化 KV 模拟）
+// - MemoryJobStore：当前实例内存，带 TTL、数量与内存上限（BoundedMap），用于未绑定 KV 的环境；
+//   未结束（pending / processing）的任务不会被淘汰，只剩未结束的任务时 hasCapacity 为假，调用方拒绝新任务
+// 除任务记录外，还保存 内容 key → 任务 ID 的索引，用于合并相同内容的重复提交
+// 同一任务记录的写入经由 JobRecordWriter 合并，writeIntervalMs 为同一记录两次写入的最小间隔（KV 同一 key 约每秒一次）
+
+export interface StoredJob {
+  id: string;
+  status: string;
+  result?: unknown;
+  error?: string;
+  createdAt: number;
+  updatedAt: number;
+}
+
+export interface JobStore<J extends StoredJob> {
+  readonly writeIntervalMs: number;
+  get(id: string): Promise<J | undefined>;
+  put(job: J): Promise<void>;
+  delete(id: string): Promise<void>;
+  getIdByKey(key: string): Promise<string | undefined>;
+  putKey(key: string, id: string): Promise<void>;
+  hasCapacity(count: number): boolean;
+}
+
+function isFinished(job: StoredJob): boolean {
+  return job.status === 'completed' || job.status === 'failed';
+}
+
+export interface JobStoreOptions {
+  ttlMs: number;
+  maxResultBytes: number;
+}
+
+const textEncoder = new TextEncoder();
+
+// 单个任务记录超过上限时丢弃结果并标记失败，避免单个任务撑爆存储
+function serializeBounded<J extends StoredJob>(job: J, maxResultBytes: number): { job: J; json: string; bytes: number } {
+  const json = JSON.stringify(job);
+  const bytes = textEncoder.encode(json).length;
+  if (bytes <= maxResultBytes) {
+    return { job, json, bytes };
+  }
+  const bounded = {
+    ...job,
+    status: 'failed',
+    result: undefined,
+    error: `RESULT_TOO_LARGE: job record is ${bytes} bytes (limit ${maxResultBytes})`,
+  };
+  const boundedJson = JSON.stringify(bounded);
+  return { job: bounded, json: boundedJson, bytes: textEncoder.encode(boundedJson).length };
+}
+
+export class MemoryJobStore<J extends StoredJob> implements JobStore<J> {
+  private jobs: BoundedMap<string, J>;
+  private keys: BoundedMap<string, string>;
+  readonly writeIntervalMs = 0;
+
+  constructor(private options: JobStoreOptions & { maxJobs: number; maxBytes: number }) {
+    // 按序列化后的字节数记账；写入即刷新过期时间，迭代顺序即最近更新顺序
+    this.jobs = new BoundedMap<string, J>({
+      maxEntries: options.maxJobs,
+      ttlMs: options.ttlMs,
+      maxBytes: options.maxBytes,
+      sizeOf: job => textEncoder.encode(JSON.stringify(job)).length,
+      canEvict: isFinished,
+    });
+    this.keys = new BoundedMap<string, string>({ maxEntries: options.maxJobs, ttlMs: options.ttlMs });
+  }
+
+  async get(id: string): Promise<J | undefined> {
+    return this.jobs.get(id);
+  }
+
+  async put(job: J): Promise<void> {
+    const { job: bounded, bytes } = serializeBounded(job, this.options.maxResultBytes);
+    this.jobs.set(bounded.id, bounded, bytes);
+  }
+
+  async delete(id: string): Promise<void> {
+    this.jobs.delete(id);
+  }
+
+  async getIdByKey(key: string): Promise<string | undefined> {
+    const id = this.keys.get(key);
+    // 任务已过期或被淘汰时索引随之失效
+    if (id && !this.jobs.has(id)) {
+      this.keys.delete(key);
+      return undefined;
+    }
+    return id;
+  }
+
+  async putKey(key: string, id: string): Promise<void> {
+    this.keys.set(key, id);
+  }
+
+  // 再创建 count 个任务后未结束的任务数不超过 maxJobs（已结束的任务可以被淘汰腾出位置）
+  hasCapacity(count: number): boolean {
+    let live = 0;
+    for (const job of this.jobs.values()) {
+      if (!isFinished(job)) live++;
+    }
+    return live + count <= this.options.maxJobs;
+  }
+
+  get size(): number {
+    return this.jobs.size;
+  }
+
+  stats() {
+    return { jobs: this.jobs.stats(), keys: this.keys.stats() };
+  }
+}
+
+export class KVJobStore<J extends StoredJob> implements JobStore<J> {
+  readonly writeIntervalMs = 1000;
+
+  constructor(private kv: KVNamespace, private options: JobStoreOptions) {}
+
+  async get(id: string): Promise<J | undefined> {
+    const job = await this.kv.get<J>(`job:${id}`, 'json');
+    return job ?? undefined;
+  }
+
+  async put(job: J): Promise<void> {
+    const { json } = serializeBounded(job, this.options.maxResultBytes);
+    await this.kv.put(`job:${job.id}`, json, { expirationTtl: this.expirationTtl() });
+  }
+
+  async delete(id: string): Promise<void> {
+    await this.kv.delete(`job:${id}`);
+  }
+
+  async getIdByKey(key: string): Promise<string | undefined> {
+    return (await this.kv.get(`jobkey:${key}`)) ?? undefined;
+  }
+
+  async putKey(key: string, id: string): Promise<void> {
+    await this.kv.put(`jobkey:${key}`, id, { expirationTtl: this.expirationTtl() });
+  }
+
+  hasCapacity(): boolean {
+    return true;
+  }
+
+  // KV 的 expirationTtl 最小为 60 秒
+  private expirationTtl(): number {
+    return Math.max(60, Math.ceil(this.options.ttlMs / 1000));
+  }
+}
+
+function sleep(ms: number) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+export type JobUpdate<J> = (job: J) => Partial<J>;
+
+// 单个任务记录的合并写入器
+// - update()：进度、清单等中间更新先在内存中排队，距上次写入至少 writeIntervalMs 后合并为一次读-改-写；
+//   失败时更新保留在队列中，由下一次写入带上
+// - flush()：立即写入（仍遵守最小间隔），失败时按退避重试，重试用尽后抛出。用于检查点与终态
+// 所有写入串行进行，后写入的终态不会被之前的中间更新覆盖
+export class JobRecordWriter<J extends StoredJob> {
+  private pending: JobUpdate<J>[] = [];
+  private lastWriteAt = 0;
+  private timer?: ReturnType<typeof setTimeout>;
+  private writes: Promise<void> = Promise.resolve();
+
+  constructor(
+    private store: JobStore<J>,
+    private id: string,
+    private options: { retries: number; retryDelayMs: number } = { retries: 3, retryDelayMs: 1000 }
+  ) {}
+
+  update(update: JobUpdate<J>) {
+    this.pending.push(update);
+    if (!this.timer) {
+      const delay = Math.max(0, this.lastWriteAt + this.store.writeIntervalMs - Date.now());
+      this.timer = setTimeout(() => {
+        this.timer = undefined;
+        this.enqueue(0).catch(e => console.error(`[JobStore] Deferred write for ${this.id} failed:`, e));
+      }, delay);
+    }
+  }
+
+  flush(update?: JobUpdate<J>): Promise<void> {
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = undefined;
+    }
+    if (update) this.pending.push(update);
+    return this.enqueue(this.options.retries);
+  }
+
+  private enqueue(retries: number): Promise<void> {
+    const write = this.writes.then(() => this.write(retries));
+    this.writes = write.catch(() => {});
+    return write;
+  }
+
+  private async write(retries: number) {
+    if (this.pending.length === 0) return;
+    const updates = this.pending;
+    this.pending = [];
+    for (let attempt = 0; ; attempt++) {
+      try {
+        // 记录上的 updatedAt 也算作上次写入时间，覆盖其它写入器（如创建任务）刚写过的情况
+        let current = await this.store.get(this.id);
+        const wait = Math.max(this.lastWriteAt, current?.updatedAt || 0) + this.store.writeIntervalMs - Date.now();
+        if (wait > 0) {
+          await sleep(wait);
+          current = await this.store.get(this.id);
+        }
+        if (!current) return;
+        const next = updates.reduce((job, update) => ({ ...job, ...update(job) }), current);
+        this.lastWriteAt = Date.now();
+        await this.store.put({ ...next, updatedAt: Date.now() });
+        return;
+      } catch (e) {
+        if (attempt >= retries) {
+          this.pending = [...updates, ...this.pending];
+          throw e;
+        }
+        await sleep(this.options.retryDelayMs * 2 ** attempt);
+      }
+    }
+  }
+}
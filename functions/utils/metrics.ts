@@ -0,0 +1,204 @@
+// 实例内指标：计数器、直方图与采集时计算的 gauge，按 Prometheus 文本格式（0.0.4）输出
+// 指标只保存在当前实例内存中，实例回收后清零；Prometheus 的 rate()/increase() 能处理计数器重置
+// 每个指标的标签组合数有上限（MAX_SERIES_PER_METRIC），超出的新组合被丢弃并计入 metrics_dropped_series_total，
+// 避免用户可控的值（如未知 action）让内存无限增长
+
+export type Labels = Record<string, string | number>;
+
+const MAX_SERIES_PER_METRIC = 500;
+
+// 常用桶：耗时（秒）、字节数、迭代次数
+export const DURATION_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160];
+export const BYTES_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216];
+export const COUNT_BUCKETS = [0, 1, 2, 3, 4, 5, 6, 8, 10];
+
+function escapeLabelValue(value: string): string {
+  return value.replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+}
+
+function formatLabels(labels: Labels, extra?: [string, string]): string {
+  const pairs = Object.keys(labels).sort().map(key => `${key}="${escapeLabelValue(String(labels[key]))}"`);
+  if (extra) pairs.push(`${extra[0]}="${escapeLabelValue(extra[1])}"`);
+  return pairs.length ? `{${pairs.join(',')}}` : '';
+}
+
+function formatValue(value: number): string {
+  if (value === Infinity) return '+Inf';
+  if (value === -Infinity) return '-Inf';
+  return Number.isFinite(value) ? String(value) : 'NaN';
+}
+
+interface Series<T> {
+  labels: Labels;
+  value: T;
+}
+
+abstract class Metric<T> {
+  protected series = new Map<string, Series<T>>();
+
+  constructor(
+    readonly name: string,
+    readonly help: string,
+    protected registry: MetricsRegistry
+  ) {}
+
+  abstract readonly type: 'counter' | 'histogram' | 'gauge';
+
+  protected abstract initial(): T;
+
+  protected seriesFor(labels: Labels): Series<T> | undefined {
+    const key = formatLabels(labels);
+    let entry = this.series.get(key);
+    if (!entry) {
+      if (this.series.size >= MAX_SERIES_PER_METRIC) {
+        this.registry.droppedSeries++;
+        return undefined;
+      }
+      entry = { labels: { ...labels }, value: this.initial() };
+      this.series.set(key, entry);
+    }
+    return entry;
+  }
+
+  abstract render(): string[];
+
+  protected header(): string[] {
+    return [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} ${this.type}`];
+  }
+}
+
+export class Counter extends Metric<number> {
+  readonly type = 'counter';
+
+  protected initial() {
+    return 0;
+  }
+
+  inc(labels: Labels = {}, value: number = 1) {
+    const entry = this.seriesFor(labels);
+    if (entry) entry.value += value;
+  }
+
+  render(): string[] {
+    const lines = this.header();
+    for (const { labels, value } of this.series.values()) {
+      lines.push(`${this.name}${formatLabels(labels)} ${formatValue(value)}`);
+    }
+    return lines;
+  }
+}
+
+interface HistogramValue {
+  buckets: number[]; // 非累计的每桶计数，最后一个为 +Inf
+  sum: number;
+  count: number;
+}
+
+export class Histogram extends Metric<HistogramValue> {
+  readonly type = 'histogram';
+
+  constructor(name: string, help: string, registry: MetricsRegistry, private bounds: number[]) {
+    super(name, help, registry);
+  }
+
+  protected initial(): HistogramValue {
+    return { buckets: new Array(this.bounds.length + 1).fill(0), sum: 0, count: 0 };
+  }
+
+  observe(labels: Labels, value: number) {
+    const entry = this.seriesFor(labels);
+    if (!entry) return;
+    let index = this.bounds.findIndex(bound => value <= bound);
+    if (index === -1) index = this.bounds.length;
+    entry.value.buckets[index]++;
+    entry.value.sum += value;
+    entry.value.count++;
+  }
+
+  render(): string[] {
+    const lines = this.header();
+    for (const { labels, value } of this.series.values()) {
+      let cumulative = 0;
+      this.bounds.forEach((bound, i) => {
+        cumulative += value.buckets[i];
+        lines.push(`${this.name}_bucket${formatLabels(labels, ['le', formatValue(bound)])} ${cumulative}`);
+      });
+      lines.push(`${this.name}_bucket${formatLabels(labels, ['le', '+Inf'])} ${value.count}`);
+      lines.push(`${this.name}_sum${formatLabels(labels)} ${formatValue(value.sum)}`);
+      lines.push(`${this.name}_count${formatLabels(labels)} ${value.count}`);
+    }
+    return lines;
+  }
+}
+
+// gauge 在采集时调用 collect 读取当前值（队列深度、表大小等），不需要在各处同步更新
+export type GaugeCollector = () => number | Array<[Labels, number]>;
+
+export class Gauge extends Metric<number> {
+  readonly type = 'gauge';
+
+  constructor(name: string, help: string, registry: MetricsRegistry, private collect: GaugeCollector) {
+    super(name, help, registry);
+  }
+
+  protected initial() {
+    return 0;
+  }
+
+  render(): string[] {
+    let values: Array<[Labels, number]>;
+    try {
+      const collected = this.collect();
+      values = typeof collected === 'number' ? [[{}, collected]] : collected;
+    } catch (e) {
+      console.error(`[Metrics] Gauge ${this.name} failed:`, e);
+      return [];
+    }
+    return [
+      ...this.header(),
+      ...values.map(([labels, value]) => `${this.name}${formatLabels(labels)} ${formatValue(value)}`),
+    ];
+  }
+}
+
+export class MetricsRegistry {
+  private metrics = new Map<string, Metric<any>>();
+  droppedSeries = 0;
+  private readonly startedAt = Date.now();
+
+  counter(name: string, help: string): Counter {
+    return this.register(new Counter(name, help, this));
+  }
+
+  histogram(name: string, help: string, buckets: number[] = DURATION_BUCKETS): Histogram {
+    return this.register(new Histogram(name, help, this, buckets));
+  }
+
+  gauge(name: string, help: string, collect: GaugeCollector): Gauge {
+    return this.register(new Gauge(name, help, this, collect));
+  }
+
+  render(): string {
+    const lines: string[] = [];
+    for (const metric of this.metrics.values()) {
+      lines.push(...metric.render());
+    }
+    lines.push(
+      '# HELP metrics_dropped_series_total Label combinations dropped because a metric reached its series limit',
+      '# TYPE metrics_dropped_series_total counter',
+      `metrics_dropped_series_total ${this.droppedSeries}`,
+      '# HELP process_uptime_seconds Seconds since this instance created its metrics registry',
+      '# TYPE process_uptime_seconds gauge',
+      `process_uptime_seconds ${(Date.now() - this.startedAt) / 1000}`,
+    );
+    return lines.join('\n') + '\n';
+  }
+
+  private register<M extends Metric<any>>(metric: M): M {
+    if (this.metrics.has(metric.name)) {
+      throw new Error(`Metric already registered: ${metric.name}`);
+    }
+    this.metrics.set(metric.name, metric);
+    return metric;
+  }
+}
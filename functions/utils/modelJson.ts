@@ -0,0 +1,44 @@
+// 模型 JSON 输出解析：所有 "Output strict JSON" 类响应共用
+// 模型常把 JSON 包在 ```json 代码块里，或在前后附带说明文字：
+// - 只用 indexOf 定位代码块边界，不做整串正则替换
+// - 直接解析失败时，退回截取第一个 { / [ 到最后一个 } / ] 之间的内容再解析
+// 仍然无法解析时抛出 SyntaxError，由调用方决定兜底结果
+
+const FENCE = '```';
+
+// 去掉代码块标记，返回其中的内容；没有代码块时返回去掉首尾空白的原文
+export function extractJsonText(text: string): string {
+  const open = text.indexOf(FENCE);
+  if (open === -1) {
+    return text.trim();
+  }
+  // 跳过语言标记（```json / ```JSON）
+  let start = open + FENCE.length;
+  while (start < text.length && /[A-Za-z]/.test(text[start])) {
+    start++;
+  }
+  const close = text.indexOf(FENCE, start);
+  return text.slice(start, close === -1 ? text.length : close).trim();
+}
+
+function firstJsonStart(text: string): number {
+  const brace = text.indexOf('{');
+  const bracket = text.indexOf('[');
+  if (brace === -1) return bracket;
+  if (bracket === -1) return brace;
+  return Math.min(brace, bracket);
+}
+
+export function parseModelJson<T = any>(text: string): T {
+  const body = extractJsonText(text);
+  try {
+    return JSON.parse(body);
+  } catch (e) {
+    const start = firstJsonStart(body);
+    const end = Math.max(body.lastIndexOf('}'), body.lastIndexOf(']'));
+    if (start === -1 || end <= start || (start === 0 && end === body.length - 1)) {
+      throw e;
+    }
+    return JSON.parse(body.slice(start, end + 1));
+  }
+}
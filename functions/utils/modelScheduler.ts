@@ -0,0 +1,239 @@
+// 模型调用调度器：所有 Gemini 调用共享（当前实例）
+// - 每个模型一个令牌桶，限制调用速率
+// - 429 后熔断该模型一段时间（连续限流时指数退避），期间直接路由到候选列表中的下一个模型
+// - 可选的全局在途调用上限（maxInFlight 为 Infinity 时不限制）；超出时排队，interactive 优先于 background
+// - 统计队列深度、等待时间和各模型状态
+// 排队的请求在 pump 中分到模型后，由等待者在自己的请求中轮询取走（每次轮询也推进一次调度），
+// 不由释放调用的其它请求 resolve 它的 Promise：Workers 中跨请求完成 Promise 会告警，等待的请求也可能因此挂起
+// 分到的模型超过 LEASE_CLAIM_TIMEOUT_MS 未被取走（等待的请求已被取消，不再轮询）时收回，避免在途数泄漏
+
+export type Priority = 'interactive' | 'background';
+
+export interface SchedulerOptions {
+  maxInFlight: number;
+  ratePerMinute: number;
+  modelRates: Record<string, number>; // 单个模型的每分钟速率覆盖
+  burst: number;
+  cooldownMs: number;
+  maxCooldownMs: number;
+  queueTimeoutMs: number;
+}
+
+export interface Lease {
+  model: string;
+  waitedMs: number;
+  release(outcome: 'ok' | 'rate_limited' | 'error', retryAfterMs?: number): void;
+}
+
+interface ModelState {
+  tokens: number;
+  lastRefill: number;
+  openUntil: number;
+  consecutiveThrottles: number;
+  calls: number;
+  throttled: number;
+}
+
+interface Waiter {
+  candidates: string[];
+  priority: Priority;
+  enqueuedAt: number;
+  lease?: Lease;
+  grantedAt?: number;
+  reclaimed?: boolean;
+}
+
+const WAIT_POLL_MS = 25;
+const LEASE_CLAIM_TIMEOUT_MS = 5000;
+
+function sleep(ms: number) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+interface WaitStats {
+  count: number;
+  totalMs: number;
+  maxMs: number;
+}
+
+// MODEL_RATE_LIMITS="gemini-3-pro-image-preview=10,gemini-2.5-flash=60"
+export function parseModelRates(value?: string): Record<string, number> {
+  const rates: Record<string, number> = {};
+  for (const entry of (value || '').split(',')) {
+    const [model, rate] = entry.split('=').map(s => s.trim());
+    const perMinute = parseFloat(rate);
+    if (model && perMinute > 0) rates[model] = perMinute;
+  }
+  return rates;
+}
+
+// 从 Gemini 的 429 错误中读取建议的重试间隔（"retryDelay":"27s" 或 "retry in 27.5s"）
+export function retryAfterMsOf(err: unknown): number | undefined {
+  const message = String((err as any)?.message || err || '');
+  const match = /retryDelay"?\s*:\s*"?(\d+(?:\.\d+)?)s/i.exec(message) || /retry in (\d+(?:\.\d+)?)\s*s/i.exec(message);
+  return match ? Math.ceil(parseFloat(match[1]) * 1000) : undefined;
+}
+
+export class ModelScheduler {
+  private models = new Map<string, ModelState>();
+  private queues: Record<Priority, Waiter[]> = { interactive: [], background: [] };
+  private waits: Record<Priority, WaitStats> = {
+    interactive: { count: 0, totalMs: 0, maxMs: 0 },
+    background: { count: 0, totalMs: 0, maxMs: 0 },
+  };
+  private inFlight = 0;
+  private unclaimed = new Set<Waiter>();
+
+  constructor(private options: SchedulerOptions) {}
+
+  // 申请一次模型调用：返回选中的模型，调用结束后必须 release
+  async acquire(candidates: string[], priority: Priority): Promise<Lease> {
+    const waiter: Waiter = { candidates, priority, enqueuedAt: Date.now() };
+    this.queues[priority].push(waiter);
+    while (true) {
+      if (waiter.reclaimed) {
+        // 取走得太晚，分到的模型已被收回：重新排队
+        waiter.reclaimed = false;
+        this.queues[priority].push(waiter);
+      }
+      this.pump();
+      if (waiter.lease) {
+        this.unclaimed.delete(waiter);
+        return waiter.lease;
+      }
+      if (Date.now() - waiter.enqueuedAt >= this.options.queueTimeoutMs) {
+        this.removeWaiter(waiter);
+        throw new Error(`429 Too Many Requests: model queue timeout after ${this.options.queueTimeoutMs}ms (${candidates.join(', ')})`);
+      }
+      await sleep(WAIT_POLL_MS);
+    }
+  }
+
+  stats() {
+    const now = Date.now();
+    const waits = (p: Priority) => ({
+      count: this.waits[p].count,
+      avgMs: this.waits[p].count ? Math.round(this.waits[p].totalMs / this.waits[p].count) : 0,
+      maxMs: this.waits[p].maxMs,
+    });
+    const models: Record<string, unknown> = {};
+    for (const [name, state] of this.models) {
+      this.refill(name, state, now);
+      models[name] = {
+        tokens: Math.floor(state.tokens),
+        circuitOpenForMs: Math.max(0, state.openUntil - now),
+        calls: state.calls,
+        throttled: state.throttled,
+      };
+    }
+    return {
+      inFlight: this.inFlight,
+      maxInFlight: Number.isFinite(this.options.maxInFlight) ? this.options.maxInFlight : null,
+      queued: { interactive: this.queues.interactive.length, background: this.queues.background.length },
+      waits: { interactive: waits('interactive'), background: waits('background') },
+      models,
+    };
+  }
+
+  private state(model: string): ModelState {
+    let state = this.models.get(model);
+    if (!state) {
+      state = { tokens: this.options.burst, lastRefill: Date.now(), openUntil: 0, consecutiveThrottles: 0, calls: 0, throttled: 0 };
+      this.models.set(model, state);
+    }
+    return state;
+  }
+
+  private refill(model: string, state: ModelState, now: number) {
+    const perMinute = this.options.modelRates[model] || this.options.ratePerMinute;
+    state.tokens = Math.min(this.options.burst, state.tokens + (now - state.lastRefill) * perMinute / 60000);
+    state.lastRefill = now;
+  }
+
+  // 候选模型中第一个未熔断且有令牌的
+  private pick(candidates: string[], now: number): string | undefined {
+    for (const model of candidates) {
+      const state = this.state(model);
+      if (state.openUntil > now) continue;
+      this.refill(model, state, now);
+      if (state.tokens >= 1) return model;
+    }
+    return undefined;
+  }
+
+  private pump() {
+    const now = Date.now();
+    this.reclaim(now);
+    for (const priority of ['interactive', 'background'] as Priority[]) {
+      const queue = this.queues[priority];
+      for (let i = 0; i < queue.length && this.inFlight < this.options.maxInFlight;) {
+        const waiter = queue[i];
+        const model = this.pick(waiter.candidates, now);
+        if (!model) {
+          // 该请求的模型都在冷却或没有令牌，跳过它，让后面使用其他模型的请求先执行
+          i++;
+          continue;
+        }
+        queue.splice(i, 1);
+        this.start(waiter, model, now);
+      }
+    }
+  }
+
+  private start(waiter: Waiter, model: string, now: number) {
+    const state = this.state(model);
+    state.tokens -= 1;
+    state.calls++;
+    this.inFlight++;
+
+    const waitedMs = now - waiter.enqueuedAt;
+    const waits = this.waits[waiter.priority];
+    waits.count++;
+    waits.totalMs += waitedMs;
+    waits.maxMs = Math.max(waits.maxMs, waitedMs);
+
+    let released = false;
+    waiter.grantedAt = now;
+    this.unclaimed.add(waiter);
+    waiter.lease = {
+      model,
+      waitedMs,
+      release: (outcome, retryAfterMs) => {
+        if (released) return;
+        released = true;
+        this.inFlight--;
+        if (outcome === 'rate_limited') {
+          state.throttled++;
+          state.consecutiveThrottles++;
+          const backoff = Math.min(
+            this.options.maxCooldownMs,
+            this.options.cooldownMs * 2 ** (state.consecutiveThrottles - 1)
+          );
+          state.openUntil = Date.now() + Math.max(backoff, retryAfterMs || 0);
+        } else if (outcome === 'ok') {
+          state.consecutiveThrottles = 0;
+        }
+        this.pump();
+      },
+    };
+  }
+
+  // 收回长时间未被取走的模型：等待的请求已被取消时不会再有人 release
+  private reclaim(now: number) {
+    const stale = [...this.unclaimed].filter(waiter => now - (waiter.grantedAt || now) > LEASE_CLAIM_TIMEOUT_MS);
+    for (const waiter of stale) {
+      // release 会再次 pump，可能已经收回过
+      if (!this.unclaimed.delete(waiter)) continue;
+      const lease = waiter.lease!;
+      waiter.lease = undefined;
+      waiter.reclaimed = true;
+      lease.release('error');
+    }
+  }
+
+  private removeWaiter(waiter: Waiter) {
+    const queue = this.queues[waiter.priority];
+    const index = queue.indexOf(waiter);
+    if (index !== -1) queue.splice(index, 1);
+  }
+}
@@ -0,0 +1,211 @@
+import { base64ToBytes, type ImagePart } from './assetStore';
+
+// 评审前的分级预筛 (PRESCREEN=on)：结论明显的情况不再调用高质量评审模型
+// - local：本地检查，不调用模型。生成图能否解码、尺寸与长宽比；prompt 是否缺少必需的要求。只会给出明确不通过
+// - fast：FAST_MODEL 快速评分。分数（以及生成图的身份分）都不低于 passScore 为明确通过，
+//         任一分数不高于 failScore 或看不到人脸为明确不通过，其余为边界情况
+// - full：边界情况升级到原有的高质量评审
+// 人脸检测与人脸特征向量相似度需要图像解码和模型推理，Workers 运行时不具备，由 fast 层的 faceVisible / identityScore 代替
+
+export type PrescreenStage = 'reviewPrompt' | 'reviewResult';
+export type PrescreenTier = 'local' | 'fast';
+export type PrescreenVerdict = 'pass' | 'fail' | 'escalate';
+
+export interface PrescreenOptions {
+  enabled: boolean;
+  passScore: number;
+  failScore: number;
+  minImageSide: number;
+}
+
+export interface PrescreenEnv {
+  PRESCREEN?: string;
+  PRESCREEN_PASS_SCORE?: string;
+  PRESCREEN_FAIL_SCORE?: string;
+  PRESCREEN_MIN_IMAGE_SIDE?: string;
+}
+
+export function parsePrescreenOptions(env: PrescreenEnv): PrescreenOptions {
+  return {
+    enabled: env.PRESCREEN === 'on' || env.PRESCREEN === 'true',
+    passScore: parseInt(env.PRESCREEN_PASS_SCORE || '') || 90,
+    failScore: parseInt(env.PRESCREEN_FAIL_SCORE || '') || 40,
+    minImageSide: parseInt(env.PRESCREEN_MIN_IMAGE_SIDE || '') || 256,
+  };
+}
+
+// 一次预筛的结论；verdict 不是 escalate 时 review 为可直接使用的评审结果
+export interface PrescreenDecision {
+  tier: PrescreenTier;
+  verdict: PrescreenVerdict;
+  score?: number;
+  reasons: string[];
+  review?: any;
+  durationMs: number;
+}
+
+// --- local ---
+
+// 只解码开头部分：PNG / WebP 的尺寸在文件头，JPEG 的 SOF 一般在前几十 KB 内
+const HEADER_BASE64_CHARS = 349524; // 256KB
+
+export function imageDimensions(image: ImagePart): { width: number; height: number } | undefined {
+  let bytes: Uint8Array;
+  try {
+    bytes = base64ToBytes(image.data.slice(0, HEADER_BASE64_CHARS));
+  } catch {
+    return undefined;
+  }
+  const u16be = (i: number) => (bytes[i] << 8) | bytes[i + 1];
+  const u32be = (i: number) => ((bytes[i] << 24) | (bytes[i + 1] << 16) | (bytes[i + 2] << 8) | bytes[i + 3]) >>> 0;
+  const ascii = (i: number, n: number) => String.fromCharCode(...bytes.subarray(i, i + n));
+
+  // PNG：IHDR 紧跟在 8 字节签名之后
+  if (bytes.length >= 24 && bytes[0] === 0x89 && ascii(1, 3) === 'PNG') {
+    return { width: u32be(16), height: u32be(20) };
+  }
+  // JPEG：逐个段查找 SOF（C0-CF，除 C4 / C8 / CC）
+  if (bytes.length >= 4 && bytes[0] === 0xff && bytes[1] === 0xd8) {
+    let i = 2;
+    while (i + 9 < bytes.length) {
+      if (bytes[i] !== 0xff) return undefined;
+      const marker = bytes[i + 1];
+      if (marker >= 0xc0 && marker <= 0xcf && marker !== 0xc4 && marker !== 0xc8 && marker !== 0xcc) {
+        return { width: u16be(i + 7), height: u16be(i + 5) };
+      }
+      i += 2 + u16be(i + 2);
+    }
+    return undefined;
+  }
+  // WebP：VP8 / VP8L / VP8X 三种编码的尺寸位置不同
+  if (bytes.length >= 30 && ascii(0, 4) === 'RIFF' && ascii(8, 4) === 'WEBP') {
+    const chunk = ascii(12, 4);
+    if (chunk === 'VP8 ') {
+      return { width: (bytes[26] | (bytes[27] << 8)) & 0x3fff, height: (bytes[28] | (bytes[29] << 8)) & 0x3fff };
+    }
+    if (chunk === 'VP8L') {
+      return {
+        width: 1 + (((bytes[22] & 0x3f) << 8) | bytes[21]),
+        height: 1 + (((bytes[24] & 0x0f) << 10) | (bytes[23] << 2) | ((bytes[22] & 0xc0) >> 6)),
+      };
+    }
+    if (chunk === 'VP8X') {
+      return {
+        width: 1 + (bytes[24] | (bytes[25] << 8) | (bytes[26] << 16)),
+        height: 1 + (bytes[27] | (bytes[28] << 8) | (bytes[29] << 16)),
+      };
+    }
+  }
+  return undefined;
+}
+
+// 生成图的本地检查，返回不通过的原因（空数组表示交给下一层）
+export function checkGeneratedImage(image: ImagePart, options: PrescreenOptions): string[] {
+  const size = imageDimensions(image);
+  if (!size || size.width === 0 || size.height === 0) {
+    return ['Generated image could not be decoded'];
+  }
+  const reasons: string[] = [];
+  if (Math.min(size.width, size.height) < options.minImageSide) {
+    reasons.push(`Generated image is too small (${size.width}x${size.height}, minimum side ${options.minImageSide}px)`);
+  }
+  const ratio = size.width / size.height;
+  if (ratio < 0.4 || ratio > 2.5) {
+    reasons.push(`Generated image has an unusable aspect ratio (${size.width}x${size.height})`);
+  }
+  return reasons;
+}
+
+// prompt 的本地检查：完整评审的硬性规则中可以按关键词判断的部分
+const PROMPT_REQUIREMENTS: Array<{ pattern: RegExp; reason: string; suggestion: string }> = [
+  { pattern: /studio/i, reason: 'Prompt does not require a studio setting', suggestion: 'Require a professional studio with a seamless backdrop' },
+  { pattern: /dress shirt|suit|business attire/i, reason: 'Prompt does not specify formal attire', suggestion: 'Require formal business attire (dress shirt or dress shirt + suit jacket)' },
+  { pattern: /preserve|identical|same (person|individual)|recognizable/i, reason: 'Prompt does not require identity preservation', suggestion: 'Require the person to remain recognizable as the reference' },
+];
+
+export function checkPromptText(promptText: string, photoType: string): { reasons: string[]; suggestions: string[] } {
+  const missing = PROMPT_REQUIREMENTS.filter(r => !r.pattern.test(promptText));
+  const reasons = missing.map(r => r.reason);
+  const suggestions = missing.map(r => r.suggestion);
+  if (!promptText.includes(photoType)) {
+    reasons.push(`Prompt does not name the target pose ${photoType}`);
+    suggestions.push(`State the required ${photoType} pose explicitly`);
+  }
+  return { reasons, suggestions };
+}
+
+// --- fast ---
+
+// 模型有时把数字 / 布尔值输出为字符串
+export function scoreOf(value: unknown): number | undefined {
+  const n = typeof value === 'string' ? parseFloat(value) : value;
+  return typeof n === 'number' && !isNaN(n) ? n : undefined;
+}
+
+// fast 层的分数分类；identityScore 与 faceVisible 只用于生成图
+export function classifyFastScores(scores: any, options: PrescreenOptions): PrescreenVerdict {
+  const values = [scoreOf(scores?.overallScore), scoreOf(scores?.identityScore)].filter((v): v is number => v !== undefined);
+  if (values.length === 0) return 'escalate';
+  const faceMissing = scores.faceVisible === false || scores.faceVisible === 'false';
+  if (faceMissing || values.some(v => v <= options.failScore)) return 'fail';
+  if (values.every(v => v >= options.passScore)) return 'pass';
+  return 'escalate';
+}
+
+// --- stats ---
+
+interface StageStats {
+  decisions: Record<string, number>; // `${tier}:${verdict}`，如 local:fail、fast:pass、fast:escalate（升级到完整评审）
+  fullReviews: number;
+  fullReviewMs: number;              // 完整评审的累计耗时，用于估算被跳过的评审耗时
+  prescreenMs: number;
+  savedMs: number;
+}
+
+export interface PrescreenStats {
+  stages: Record<PrescreenStage, StageStats>;
+}
+
+export function createPrescreenStats(): PrescreenStats {
+  const stage = (): StageStats => ({ decisions: {}, fullReviews: 0, fullReviewMs: 0, prescreenMs: 0, savedMs: 0 });
+  return { stages: { reviewPrompt: stage(), reviewResult: stage() } };
+}
+
+// 记录一次预筛：被跳过的评审按该阶段完整评审的平均耗时估算节省的时间，升级时预筛耗时计为额外开销
+export function recordPrescreen(stats: PrescreenStats, stage: PrescreenStage, decision: PrescreenDecision) {
+  const s = stats.stages[stage];
+  const key = `${decision.tier}:${decision.verdict}`;
+  s.decisions[key] = (s.decisions[key] || 0) + 1;
+  s.prescreenMs += decision.durationMs;
+  const avgFullMs = s.fullReviews > 0 ? s.fullReviewMs / s.fullReviews : 0;
+  s.savedMs += decision.verdict === 'escalate' ? -decision.durationMs : avgFullMs - decision.durationMs;
+}
+
+export function recordFullReview(stats: PrescreenStats, stage: PrescreenStage, durationMs: number) {
+  const s = stats.stages[stage];
+  s.fullReviews++;
+  s.fullReviewMs += durationMs;
+}
+
+// stats action 中的摘要：各层结论占比（命中率）、升级率与累计节省时间
+export function summarizePrescreen(stats: PrescreenStats) {
+  const summary: Record<string, any> = {};
+  for (const [stage, s] of Object.entries(stats.stages)) {
+    const total = Object.values(s.decisions).reduce((sum, n) => sum + n, 0);
+    const rate = (n: number) => (total > 0 ? n / total : 0);
+    const count = (key: string) => s.decisions[key] || 0;
+    summary[stage] = {
+      screened: total,
+      hitRate: {
+        local: rate(count('local:fail')),
+        fast: rate(count('fast:pass') + count('fast:fail')),
+        escalated: rate(count('fast:escalate')),
+      },
+      decisions: s.decisions,
+      avgFullReviewMs: s.fullReviews > 0 ? Math.round(s.fullReviewMs / s.fullReviews) : 0,
+      prescreenMs: s.prescreenMs,
+      savedMs: Math.round(s.savedMs),
+    };
+  }
+  return summary;
+}
@@ -0,0 +1,335 @@
+// Prompt 构建：纯函数，gemini.ts 与 gemini.secure.ts 共用
+// 各姿势的说明表和不含变量的长段落在模块加载时构建一次，调用时只拼接变量部分
+
+const ANALYZE_PROMPT = `Analyze this reference image carefully and extract detailed person information.
+
+IMPORTANT: Focus on distinctive features that must be preserved in generated images.
+
+Output strict JSON:
+{
+  "race": "string (e.g., East Asian, Caucasian, African)",
+  "skinTone": "string with undertone details",
+  "gender": "string",
+  "age": "string (age range like '30-40')",
+  "faceShape": "string (oval, round, square, heart, etc.)",
+  "skinConcerns": ["list of visible skin characteristics"],
+  "uniqueFeatures": [
+    "extremely detailed list of ALL distinctive features",
+    "glasses: shape, color, style",
+    "hair: color, length, texture, style",
+    "facial structure: cheekbones, jawline, nose shape",
+    "eyes: shape, size, color",
+    "eyebrows: shape, thickness",
+    "lips: shape, fullness",
+    "any other distinctive marks or features"
+  ],
+  "preservationPoints": [
+    "CRITICAL: List features that MUST be identical in generated images",
+    "Include specific measurements and proportions if visible"
+  ],
+  "lighting": "current lighting description",
+  "expression": "facial expression description"
+}`;
+
+const INPUT_REVIEW_PROMPT = `Review this input photo for suitability for professional portrait generation.
+
+Evaluation Criteria:
+1. Face clearly visible and centered
+2. Adequate lighting (no extreme shadows or overexposure)
+3. Sufficient resolution and sharpness
+4. Minimal occlusion (no heavy遮挡 like masks or hands)
+5. Neutral expression preferred
+
+Output strict JSON:
+{
+  "overallScore": "number 0-100",
+  "approved": "boolean (true if score >= 70)",
+  "summary": "brief assessment",
+  "issues": ["list of issues if any"],
+  "suggestions": ["how to improve the input photo"]
+}`;
+
+const DESIGN_POSTURE_GUIDE: Record<string, string> = {
+  '正面头像': 'Front-facing headshot, shoulders slightly angled, direct eye contact with camera',
+  '侧面头像': 'Body angled 70–90 degrees to camera, face turned 30–45 degrees toward camera (not full profile), eyes toward camera, suitable for news/company profile',
+  '肖像照': 'Medium close-up, chest up, slightly angled pose with natural head tilt',
+  '半身照': 'Waist up, three-quarter view, one shoulder slightly forward, professional hand placement',
+  '全身照': 'Full body standing pose, confident posture, weight on one leg, professional stance'
+};
+
+const GENERATION_POSE_DESCRIPTIONS: Record<string, string> = {
+  '正面头像': 'Front-facing professional headshot. Face directly toward camera. Full face visible. Shoulders at slight angle.',
+  '侧面头像': 'Side-angle portrait. Body turned 70–90 degrees to camera, face turned back 30–45 degrees toward camera (not full profile). Eyes toward camera. Suitable for news/company profile use.',
+  '肖像照': 'Medium close-up portrait. Chest and up visible. Slight three-quarter angle. Natural relaxed pose.',
+  '半身照': 'Half-body shot from waist up. Three-quarter body angle. Professional arm and hand positioning visible.',
+  '全身照': 'Full body standing pose. Complete figure visible from head to toe. Professional business stance.'
+};
+
+const GENERATION_STUDIO_SETUP = `STUDIO SETUP - CRITICAL REQUIREMENTS:
+1. BACKGROUND: Seamless gradient backdrop (neutral gray, off-white, or subtle warm tone), smooth and clean, NO office furniture, NO windows, NO environmental elements
+2. LIGHTING: Professional studio three-point lighting setup - key light at 45 degrees, fill light for shadows, hair light for separation. Soft, even, flattering illumination
+3. ENVIRONMENT: Pure studio environment only. The background should be a professional photography backdrop, not an office or any real-world location
+4. MAKEUP: Professional makeup artist applied - natural but polished look, suitable for corporate headshots
+5. STYLING: Professional wardrobe stylist selected - premium business attire, perfectly fitted
+6. PHOTOGRAPHY: Shot by professional portrait photographer with high-end medium format camera, professional lenses`;
+
+const IDENTITY_CHECKS: Record<string, string[]> = {
+  '正面头像': [
+    'Face shape and proportions identical?',
+    'Eye shape, size, and position match?',
+    'Nose shape and bridge identical?',
+    'Lip shape and fullness match?',
+    'Facial structure (cheekbones, jawline) preserved?'
+  ],
+  '侧面头像': [
+    'Profile silhouette matches reference?',
+    'Nose bridge curve identical?',
+    'Chin and jawline profile match?',
+    'Forehead slope identical?',
+    'Overall facial proportions preserved?'
+  ],
+  '肖像照': [
+    'Facial features clearly recognizable?',
+    'Unique characteristics (glasses, etc.) preserved?',
+    'Facial structure maintained from this angle?',
+    'Expression natural and consistent?'
+  ],
+  '半身照': [
+    'Person clearly identifiable as same individual?',
+    'Facial features match reference?',
+    'Body proportions appropriate?',
+    'Professional posture achieved?'
+  ],
+  '全身照': [
+    'Same person clearly identifiable?',
+    'Facial structure preserved?',
+    'Professional full-body pose?',
+    'Business attire appropriate?'
+  ]
+};
+
+// 预先编号好的核对清单
+const IDENTITY_CHECKLISTS: Record<string, string> = Object.fromEntries(
+  Object.entries(IDENTITY_CHECKS).map(([photoType, checks]) => [
+    photoType,
+    checks.map((check, i) => `${i + 1}. ${check}`).join('\n'),
+  ])
+);
+
+export function buildAnalyzePrompt(): string {
+  return ANALYZE_PROMPT;
+}
+
+export function buildDesignPrompt(person: any, photoType: string): string {
+  return `Design professional photo setup for ${photoType}.
+
+Person Details: ${JSON.stringify(person)}
+
+REQUIRED POSE: ${DESIGN_POSTURE_GUIDE[photoType] || 'Professional business pose'}
+
+Output strict JSON:
+{
+  "makeup": {
+    "base": "natural professional base",
+    "eyes": "enhanced but natural eye makeup",
+    "lips": "neutral professional lip color",
+    "blush": "subtle contouring"
+  },
+  "styling": {
+    "clothing": "formal business attire only: dress shirt or dress shirt + suit jacket, tailored fit, no casual wear",
+    "colors": "color palette that complements skin tone",
+    "accessories": "minimal professional accessories"
+  },
+  "posture": {
+    "description": "detailed pose instructions for ${photoType}",
+    "headAngle": "specific head positioning",
+    "shoulderPosition": "shoulder alignment",
+    "expression": "professional expression"
+  },
+  "lighting": {
+    "type": "Rembrandt or butterfly lighting",
+    "position": "key light 45-degree angle",
+    "background": "clean professional background"
+  }
+}`;
+}
+
+export function buildGenerationPrompt(
+  person: any, 
+  design: any, 
+  photoType: string,
+  referenceImage?: string
+): string {
+  return `Generate a professional executive portrait photograph in a HIGH-END PROFESSIONAL PHOTOGRAPHY STUDIO.
+
+PHOTO TYPE: ${photoType}
+REQUIRED POSE: ${GENERATION_POSE_DESCRIPTIONS[photoType]}
+
+SUBJECT DESCRIPTION (MUST MATCH REFERENCE):
+- Race: ${person.race}
+- Gender: ${person.gender}
+- Age: ${person.age}
+- Face Shape: ${person.faceShape}
+- Skin Tone: ${person.skinTone}
+
+CRITICAL FEATURES TO PRESERVE (MAKE IDENTICAL):
+${person.uniqueFeatures?.map((f: string) => `- ${f}`).join('\n') || 'Preserve all facial features'}
+
+PRESERVATION REQUIREMENTS:
+${person.preservationPoints?.map((p: string) => `- ${p}`).join('\n') || 'Maintain exact facial structure'}
+
+${GENERATION_STUDIO_SETUP}
+
+DESIGN SPECIFICATIONS:
+- Clothing: ${design?.styling?.clothing || 'Formal business attire only: dress shirt or dress shirt + suit jacket, tailored fit'}
+- Lighting: Professional studio three-point lighting with softboxes
+- Expression: ${design?.posture?.expression || 'Professional confident expression'}
+- Background: Seamless studio backdrop, gradient from light to dark, no distractions
+
+MANDATORY RULES:
+1. The generated person MUST be recognizable as the same individual from the reference
+2. Facial features, proportions, and distinctive characteristics must match exactly
+3. BACKGROUND MUST BE: Professional studio seamless backdrop, NOT office, NOT environment, NOT location-based
+4. Lighting MUST BE: Professional studio lighting setup, NOT natural light, NOT ambient office light
+5. Maintain exact face shape, eye shape, nose shape, lip shape, and all unique features
+6. The pose must be exactly: ${GENERATION_POSE_DESCRIPTIONS[photoType]}
+7. Wardrobe must be formal business attire only (dress shirt or dress shirt + suit jacket). No casual, no streetwear.
+8. All poses must read as highly professional studio portraits suitable for corporate/news use
+9. Quality level: Executive portrait studio photography standard
+
+Generate a high-end, photorealistic professional studio portrait suitable for corporate executive profiles.`;
+}
+
+export function buildComparisonPrompt(
+  originalImage: string,
+  generatedImage: string,
+  person: any,
+  photoType: string
+): string {
+  return `Compare the REFERENCE image with the GENERATED image for ${photoType}.
+
+Task: Verify that the generated image depicts the SAME PERSON as the reference.
+
+Original Person Analysis:
+${JSON.stringify(person, null, 2)}
+
+IDENTITY VERIFICATION CHECKLIST:
+${IDENTITY_CHECKLISTS[photoType] || IDENTITY_CHECKLISTS['正面头像']}
+
+QUALITY CRITERIA:
+1. Facial Recognition: Can you confirm this is the same person?
+2. Feature Preservation: Are distinctive features maintained?
+3. Beautification Level: Is the enhancement appropriate (not overdone)?
+4. Professional Quality: Does it meet business photo standards?
+5. Pose Accuracy: Is the pose correct for ${photoType}?
+
+Output strict JSON:
+{
+  "identityMatch": {
+    "score": "number 0-100",
+    "confidence": "High/Medium/Low",
+    "verdict": "Same person/Different person/Uncertain"
+  },
+  "facialFeatures": {
+    "preservationScore": "number 0-100",
+    "matchingFeatures": ["list of matching features"],
+    "differences": ["any notable differences"]
+  },
+  "qualityAssessment": {
+    "professionalism": "number 0-100",
+    "beautification": "number 0-100 (100=perfect, 0=overdone)",
+    "lighting": "number 0-100",
+    "pose": "number 0-100"
+  },
+  "overallScore": "number 0-100",
+  "approved": "boolean",
+  "summary": "detailed assessment",
+  "recommendations": ["suggestions for improvement"]
+}`;
+}
+
+export function buildInputReviewPrompt(): string {
+  return INPUT_REVIEW_PROMPT;
+}
+
+export function buildPromptReviewText(promptText: string, photoType: string, iteration: number): string {
+  return `Review this prompt for generating a professional ${photoType} photo.
+
+Target Pose: ${photoType}
+
+Final Target Use Cases (MANDATORY):
+- Personal resume
+- Personal homepage
+- News publication
+- Company publicity board
+
+Prompt to Review:
+${promptText}
+
+Evaluation Criteria:
+1. Does the prompt clearly specify the pose requirements for ${photoType}?
+2. Does it preserve the person's unique features from the reference image?
+3. Is the styling appropriate for formal business photography (dress shirt or dress shirt + suit jacket only)?
+4. Is the lighting and background specification clear and studio-only?
+5. Does the prompt explicitly target suitability for resume/homepage/news/company publicity use?
+6. Are all poses framed as high-end professional studio portraits with professional styling/makeup/photography?
+7. Are there any missing or unclear elements?
+
+Strict Approval Rules:
+- If the prompt does NOT explicitly target the above use cases, set approved=false.
+- If formal attire or studio-only requirements are missing/ambiguous, set approved=false.
+
+Output strict JSON:
+{
+  "overallScore": "number 0-100",
+  "approved": "boolean (true if score >= 70)",
+  "summary": "brief assessment",
+  "strengths": ["what's good about this prompt"],
+  "weaknesses": ["what needs improvement"],
+  "suggestions": ["specific suggestions for improvement"],
+  "iteration": ${iteration}
+}`;
+}
+
+export function refinePromptText(promptText: string, review: any): string {
+  const suggestions = Array.isArray(review?.suggestions) ? review.suggestions : [];
+  if (suggestions.length === 0) {
+    return `${promptText}\n\nRefinement: Emphasize pose accuracy, identity preservation, studio lighting, and clean backdrop.`;
+  }
+  const suggestionText = suggestions.map((s: string) => `- ${s}`).join('\n');
+  return `${promptText}\n\nRefinements:\n${suggestionText}\n- Re-emphasize identity preservation and studio-only background.`;
+}
+
+
+// 预筛 (PRESCREEN=on) 使用 FAST_MODEL 的简短评分 prompt，只需要分数和明显的问题
+export function buildPromptPrescreenText(promptText: string, photoType: string): string {
+  return `Quick screen this prompt for a professional ${photoType} studio portrait.
+
+Prompt:
+${promptText}
+
+Score how well it specifies: the ${photoType} pose, identity preservation, formal business attire, studio-only lighting and backdrop,
+and suitability for resume / homepage / news / company publicity use.
+
+Output strict JSON only:
+{
+  "overallScore": "number 0-100",
+  "issues": ["obvious problems, empty if none"],
+  "suggestions": ["short fixes for the issues"]
+}`;
+}
+
+export function buildResultPrescreenPrompt(person: any, photoType: string): string {
+  return `Quick screen the GENERATED image (second image) against the REFERENCE image (first image) for a ${photoType} studio portrait.
+
+Key features to preserve: ${(person?.uniqueFeatures || []).join('; ') || 'face shape, eyes, nose, lips, hair'}
+
+Output strict JSON only:
+{
+  "faceVisible": "boolean, a clear human face is visible in the generated image",
+  "identityScore": "number 0-100, same person as the reference",
+  "overallScore": "number 0-100, professional quality and correct ${photoType} pose",
+  "issues": ["obvious problems, empty if none"],
+  "suggestions": ["short fixes for the issues"]
+}`;
+}
@@ -0,0 +1,71 @@
+import { BoundedMap } from './boundedMap';
+
+// 内容寻址的结果缓存：key 为 (图片 + prompt + 模型) 的 SHA-256，值为解析后的模型输出
+// LRU + TTL 淘汰（BoundedMap），记录命中/未命中次数
+
+export interface CacheStats {
+  size: number;
+  hits: number;
+  misses: number;
+  evictions: number;
+  hitRate: number;
+}
+
+export class LRUCache<V> {
+  private entries: BoundedMap<string, V>;
+  private hits = 0;
+  private misses = 0;
+
+  constructor(options: { maxEntries: number; ttlMs: number }) {
+    this.entries = new BoundedMap<string, V>({ ...options, lru: true });
+  }
+
+  get(key: string): V | undefined {
+    const value = this.entries.get(key);
+    if (value === undefined) {
+      this.misses++;
+      return undefined;
+    }
+    this.hits++;
+    return value;
+  }
+
+  set(key: string, value: V) {
+    this.entries.set(key, value);
+  }
+
+  stats(): CacheStats {
+    const lookups = this.hits + this.misses;
+    return {
+      size: this.entries.size,
+      hits: this.hits,
+      misses: this.misses,
+      evictions: this.entries.stats().evictions,
+      hitRate: lookups > 0 ? this.hits / lookups : 0,
+    };
+  }
+}
+
+const textEncoder = new TextEncoder();
+
+export async function sha256Hex(...parts: string[]): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', textEncoder.encode(parts.join('\u0000')));
+  return Array.from(new Uint8Array(digest))
+    .map(b => b.toString(16).padStart(2, '0'))
+    .join('');
+}
+
+// 键排序后的 JSON，使内容相同但键顺序不同的对象得到相同的 key
+export function stableStringify(value: unknown): string {
+  if (Array.isArray(value)) {
+    return `[${value.map(stableStringify).join(',')}]`;
+  }
+  if (value && typeof value === 'object') {
+    const entries = Object.keys(value as Record<string, unknown>)
+      .sort()
+      .filter(key => (value as Record<string, unknown>)[key] !== undefined)
+      .map(key => `${JSON.stringify(key)}:${stableStringify((value as Record<string, unknown>)[key])}`);
+    return `{${entries.join(',')}}`;
+  }
+  return JSON.stringify(value) ?? 'null';
+}
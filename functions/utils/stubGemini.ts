@@ -0,0 +1,251 @@
+import type { GenerateContentResult } from '@google/generative-ai';
+import { firstTextOf, type GeminiClient } from './geminiClient';
+
+// 离线 Gemini 替身 (GEMINI_BACKEND=stub)
+// 根据 prompt 的开头识别阶段，返回确定性的 JSON / 图像，用于无网络环境下跑通 E2E。
+
+export interface StubOptions {
+  latencyMs: number;          // 文本类调用的模拟延迟
+  imageLatencyMs: number;     // 图像生成调用的模拟延迟
+  failureRate: number;        // 随机失败概率 (0-1)，由 seed 决定，结果可复现
+  failModels: string[];       // 这些模型总是返回 429，用于验证模型降级
+  reviewScores: number[];     // 第 N 次评审返回的分数，超出后沿用最后一个
+  prescreenScores: number[];  // 第 N 次预筛返回的分数，默认 75（边界情况，升级到完整评审）
+  seed: number;
+}
+
+export interface StubEnv {
+  STUB_LATENCY_MS?: string;
+  STUB_IMAGE_LATENCY_MS?: string;
+  STUB_FAILURE_RATE?: string;
+  STUB_FAIL_MODELS?: string;
+  STUB_REVIEW_SCORES?: string;
+  STUB_PRESCREEN_SCORES?: string;
+  STUB_SEED?: string;
+}
+
+export function parseStubOptions(env: StubEnv): StubOptions {
+  const list = (value?: string) => (value ? value.split(',').map(s => s.trim()).filter(Boolean) : []);
+  const scores = list(env.STUB_REVIEW_SCORES).map(Number).filter(n => !isNaN(n));
+  const prescreenScores = list(env.STUB_PRESCREEN_SCORES).map(Number).filter(n => !isNaN(n));
+  return {
+    latencyMs: parseInt(env.STUB_LATENCY_MS || '0') || 0,
+    imageLatencyMs: parseInt(env.STUB_IMAGE_LATENCY_MS || env.STUB_LATENCY_MS || '0') || 0,
+    failureRate: parseFloat(env.STUB_FAILURE_RATE || '0') || 0,
+    failModels: list(env.STUB_FAIL_MODELS),
+    reviewScores: scores.length > 0 ? scores : [88],
+    prescreenScores: prescreenScores.length > 0 ? prescreenScores : [75],
+    seed: parseInt(env.STUB_SEED || '1') || 1,
+  };
+}
+
+// 256x320 灰度 PNG：渐变背景 + 人像轮廓
+const STUB_IMAGE_BASE64 =
+  'iVBORw0KGgoAAAANSUhEUgAAAQAAAAFACAAAAAB2Qf3WAAADv0lEQVR42u3SB1YbQRBF0VrYrHMOzhkrIJxzzl6WMcZYSCNZB6qq' +
+  'u+e/v4Gud0/bT/EZAAAAAIA0wA/xAQAAAOIA38UHAAAAiAN8Ex8AAAAAgDbAV/EBAAAA4gBfxAcAAACIA3wWHwAAAACANsAn8QEA' +
+  'AADiAB/FBwAAAIgDfBAfAAAAAIA2wHvxAQAAAGXXlwZ4V2j96grdYVXEF0SwivKLEFhV+QUIrLL8dAJ7m7h+1yXeZBXmpxJYnf15' +
+  'AlZpf5qAVZqfRmD19ucI2JuE9eddwm1Wc3+GgFXdnyBgdffHC1jl/eEC9jp2/cUXeyAA1fcHC1j9/bEC1kB/qIC9CpwbQOCN1kJ/' +
+  'pAAATfQHClgb/XECALwMWu+9oDsBaKU/SgCAZvqDBOxFyEIAQi4FoJ3+GAEA5AGeB6yPWsCtAADQUH+EAADyAM/8Fwjgf6w11R8g' +
+  'AAAA6gBP3RcK4H6ttdXvLwAAAOoAT7wXDOB9LgAAAACANsBj7wUDeJ8LQGP97gL8AHmAR94LBvA+FwAAABAHeOi9YADvcwEAAAAA' +
+  'WhJwv9YeuC8UwP1aAAAAoCUB/2Pt0H+BAP7HAgBASwKHAPgDLAIWBhBwawjAop1+AABYtCOwACAC4CBkIQAhlwYBHLTSD0AUwEEj' +
+  '/QDYPGrO/VFnAjBvQ2DeIMC8hX4AbBY4t/7AGwGYNSAwaxZgVn1/NMCs9n4AbBq8C/cH3xcOMK27PwFgWnV/BsC05v4UgGnF/VOb' +
+  'ZOyc/Rmn5QBMqu3PAjgHQdJdaQCTOvsTASZV9k/sfuJ2zk+8KRVgR4LUi5IBdiBIvicd4D8E6dcUANhCUOCWIgCDCIXusP3C6wu/' +
+  'XxxgHwAAACgKcE98AAAAwOZ1Y9k2gLtbNhqALY2m0L9NAACJ/i0CAMgD3Nm0blzblAmASP9GAQDkAW4PrxvfhkMBkOnfIACAPMCt' +
+  'oXXj3FAqAEL9gwIAACDUPyRgN9c3YoD1WJPqHxAAAACp/nUBu7G6kQOs5ppY/5oAAACI9a8K2PWzEwA4G2xy/SsCAAAg139WAIBr' +
+  'S+tUttQMAACC/csCAFw9Xae002oAAJDs/ycAwJWTdWo76QYAANH+vwIAyPafCNjl40kCHJcDoNv/RwAA4f5jAbt0NFmAo3YAlPt/' +
+  'CwAg3X8kYHt70gB7AGj3dx0AHQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA' +
+  'AAAAAAAAAAAAAAAAAAAAAAAwhv0CRWaA64YH2+oAAAAASUVORK5CYII=';
+
+type StubStage =
+  | 'analyze' | 'design' | 'generate' | 'reviewPrompt' | 'reviewResult' | 'reviewInput'
+  | 'prescreenPrompt' | 'prescreenResult' | 'unknown';
+
+export function detectStubStage(text: string): StubStage {
+  if (text.startsWith('Analyze this reference image')) return 'analyze';
+  if (text.startsWith('Design professional photo setup')) return 'design';
+  if (text.startsWith('Generate a professional executive portrait')) return 'generate';
+  if (text.startsWith('Review this prompt')) return 'reviewPrompt';
+  if (text.startsWith('Compare the REFERENCE image')) return 'reviewResult';
+  if (text.startsWith('Review this input photo')) return 'reviewInput';
+  if (text.startsWith('Quick screen this prompt')) return 'prescreenPrompt';
+  if (text.startsWith('Quick screen the GENERATED')) return 'prescreenResult';
+  return 'unknown';
+}
+
+const STUB_PERSON = {
+  race: 'East Asian',
+  skinTone: 'light with warm undertone',
+  gender: 'female',
+  age: '30-40',
+  faceShape: 'oval',
+  skinConcerns: ['even texture'],
+  uniqueFeatures: ['straight black shoulder-length hair', 'almond-shaped dark brown eyes', 'thin arched eyebrows'],
+  preservationPoints: ['CRITICAL: keep hair length and parting', 'CRITICAL: keep eye shape and spacing'],
+  lighting: 'soft indoor light from the left',
+  expression: 'gentle smile',
+};
+
+function stubDesign(photoType: string) {
+  return {
+    makeup: { base: 'natural matte base', eyes: 'soft brown liner', lips: 'neutral rose', blush: 'light peach' },
+    styling: {
+      clothing: 'formal business attire: white dress shirt with navy suit jacket, tailored fit',
+      colors: 'navy, white, light gray',
+      accessories: 'small stud earrings',
+    },
+    posture: {
+      description: `standard studio pose for ${photoType}`,
+      headAngle: 'slight tilt toward key light',
+      shoulderPosition: 'relaxed, slightly angled',
+      expression: 'confident, approachable smile',
+    },
+    lighting: { type: 'Rembrandt lighting', position: 'key light 45-degree angle', background: 'seamless gray backdrop' },
+  };
+}
+
+function stubReview(stage: StubStage, score: number, iteration: number) {
+  const approved = score >= 70;
+  if (stage === 'reviewResult') {
+    return {
+      identityMatch: { score, confidence: approved ? 'High' : 'Medium', verdict: approved ? 'Same person' : 'Uncertain' },
+      facialFeatures: { preservationScore: score, matchingFeatures: ['hair', 'eyes', 'face shape'], differences: [] },
+      qualityAssessment: { professionalism: score, beautification: score, lighting: score, pose: score },
+      overallScore: score,
+      approved,
+      summary: `Stub comparison review (score ${score})`,
+      recommendations: approved ? [] : ['Strengthen identity preservation'],
+    };
+  }
+  return {
+    overallScore: score,
+    approved,
+    summary: `Stub ${stage} (score ${score})`,
+    strengths: ['Pose and identity requirements present'],
+    weaknesses: approved ? [] : ['Use cases not explicit enough'],
+    suggestions: approved ? [] : ['Explicitly mention resume, homepage, news and company publicity use'],
+    issues: [],
+    iteration,
+  };
+}
+
+// mulberry32：小而确定的伪随机数生成器
+function createRandom(seed: number): () => number {
+  let a = seed >>> 0;
+  return () => {
+    a = (a + 0x6d2b79f5) >>> 0;
+    let t = a;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+function sleep(ms: number) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function textResult(text: string): GenerateContentResult {
+  return {
+    response: {
+      text: () => text,
+      candidates: [{ index: 0, content: { role: 'model', parts: [{ text }] } }],
+    },
+  } as unknown as GenerateContentResult;
+}
+
+function imageResult(data: string, mimeType: string): GenerateContentResult {
+  return {
+    response: {
+      text: () => '',
+      candidates: [{ index: 0, content: { role: 'model', parts: [{ inlineData: { data, mimeType } }] } }],
+    },
+  } as unknown as GenerateContentResult;
+}
+
+export function createStubGeminiClient(options: StubOptions): GeminiClient {
+  const random = createRandom(options.seed);
+  let reviewCount = 0;
+  let prescreenCount = 0;
+
+  return {
+    getGenerativeModel({ model }: { model: string }) {
+      return {
+        async generateContent(input: any): Promise<GenerateContentResult> {
+          const text = firstTextOf(input);
+          const stage = detectStubStage(text);
+          await sleep(stage === 'generate' ? options.imageLatencyMs : options.latencyMs);
+
+          if (options.failModels.includes(model)) {
+            throw new Error(`[GoogleGenerativeAI Error]: [429 Too Many Requests] Resource has been exhausted (e.g. check quota). model=${model}`);
+          }
+          if (options.failureRate > 0 && random() < options.failureRate) {
+            throw new Error(`[GoogleGenerativeAI Error]: [500 Internal Server Error] Stub injected failure (stage=${stage}, model=${model})`);
+          }
+
+          switch (stage) {
+            case 'analyze':
+              return textResult('```json\n' + JSON.stringify(STUB_PERSON, null, 2) + '\n```');
+            case 'design': {
+              const photoType = /for (.+?)\./.exec(text)?.[1] || '正面头像';
+              return textResult('```json\n' + JSON.stringify(stubDesign(photoType), null, 2) + '\n```');
+            }
+            case 'generate':
+              return imageResult(STUB_IMAGE_BASE64, 'image/png');
+            case 'reviewPrompt':
+            case 'reviewResult': {
+              const score = options.reviewScores[Math.min(reviewCount, options.reviewScores.length - 1)];
+              reviewCount++;
+              return textResult('```json\n' + JSON.stringify(stubReview(stage, score, reviewCount), null, 2) + '\n```');
+            }
+            case 'prescreenPrompt':
+            case 'prescreenResult': {
+              const score = options.prescreenScores[Math.min(prescreenCount, options.prescreenScores.length - 1)];
+              prescreenCount++;
+              const issues = score >= 70 ? [] : ['Stub pre-screen issue'];
+              return textResult(JSON.stringify({
+                overallScore: score,
+                ...(stage === 'prescreenResult' ? { identityScore: score, faceVisible: true } : {}),
+                issues,
+                suggestions: issues.length ? ['Explicitly mention resume, homepage, news and company publicity use'] : [],
+              }));
+            }
+            case 'reviewInput':
+              return textResult(JSON.stringify(stubReview(stage, 90, 1)));
+            default:
+              return textResult('{}');
+          }
+        },
+      };
+    },
+  };
+}
+
+// 故障注入（仅替身模式）：请求中指定的阶段前 times 次调用返回 500，用于验证任务中断后的恢复
+export interface StubFault {
+  stage: StubStage;
+  times: number;
+}
+
+export function parseStubFault(value: any): StubFault | undefined {
+  const stage = value?.stage;
+  if (typeof stage !== 'string' || !stage) return undefined;
+  return { stage: stage as StubStage, times: Math.max(1, parseInt(value.times) || 1) };
+}
+
+export function withStubFault(client: GeminiClient, fault: StubFault): GeminiClient {
+  let remaining = fault.times;
+  return {
+    getGenerativeModel(params: { model: string }) {
+      const model = client.getGenerativeModel(params);
+      return {
+        async generateContent(input: any): Promise<GenerateContentResult> {
+          if (remaining > 0 && detectStubStage(firstTextOf(input)) === fault.stage) {
+            remaining--;
+            throw new Error(`[GoogleGenerativeAI Error]: [500 Internal Server Error] Stub injected fault (stage=${fault.stage}, model=${params.model})`);
+          }
+          return model.generateContent(input);
+        },
+      };
+    },
+  };
+}
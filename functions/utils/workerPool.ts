@@ -0,0 +1,59 @@
+// 批量任务的工作池：当前实例所有批量任务共享一个并发上限
+// 模型调用总数仍由 ModelScheduler 限制；工作池限制的是同时进行的姿势流水线数，
+// 避免一次提交几十张图片时所有流水线同时持有图片、互相抢占调度器队列
+
+export interface WorkerPoolStats {
+  limit: number;
+  active: number;
+  queued: number;
+  completed: number;
+}
+
+// 等待者在自己的请求中按 WAIT_POLL_MS 检查是否已分到空位，而不是由释放空位的请求 resolve 它的 Promise：
+// Workers 中跨请求完成 Promise 会告警，发起等待的请求也可能因此挂起
+const WAIT_POLL_MS = 25;
+
+interface Waiter {
+  granted: boolean;
+}
+
+function sleep(ms: number) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+export class WorkerPool {
+  private active = 0;
+  private completed = 0;
+  private queue: Waiter[] = [];
+
+  constructor(private limit: number) {}
+
+  // 排队等到空位后执行 fn；按提交顺序先进先出
+  async run<T>(fn: () => Promise<T>): Promise<T> {
+    if (this.active >= this.limit) {
+      const waiter: Waiter = { granted: false };
+      this.queue.push(waiter);
+      while (!waiter.granted) {
+        await sleep(WAIT_POLL_MS);
+      }
+    } else {
+      this.active++;
+    }
+    try {
+      return await fn();
+    } finally {
+      this.completed++;
+      const next = this.queue.shift();
+      if (next) {
+        // 空位直接交给下一个等待者，active 不变
+        next.granted = true;
+      } else {
+        this.active--;
+      }
+    }
+  }
+
+  stats(): WorkerPoolStats {
+    return { limit: this.limit, active: this.active, queued: this.queue.length, completed: this.completed };
+  }
+}
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+API 客户端 - 直接调用 /api/gemini（与前端 callAPI 相同的请求体），订阅 streamJobStatus（SSE），对阶段顺序与耗时做断言
+
+用法:
+    job_id = submit_job(BASE_URL, "PHOTO2026", "processPose", {"originalImage": img, "photoType": "正面头像"})
+    events = collect_job_events(BASE_URL, "PHOTO2026", job_id)
+    assert_stage_order(events, ["design", "reviewPrompt", "generate", "reviewResult"])
+    print(stage_durations(events))
+"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+
+API_PATH = "/api/gemini"
+TERMINAL_EVENTS = ("completed", "failed", "timeout")
+BATCH_TERMINAL_EVENTS = ("done", "failed", "timeout")
+
+
+class ApiError(Exception):
+    """接口返回非 2xx；code 为响应体中的 error 字段（如 INVALID_INVITE_CODE、PROCESSING_ERROR）"""
+
+    def __init__(self, action: str, status: int, code: str, message: str = ""):
+        super().__init__(f"{action}: HTTP {status} {code} {message}".strip())
+        self.action = action
+        self.status = status
+        self.code = code
+
+
+def _open(request: urllib.request.Request, action: str, timeout: float):
+    try:
+        return urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        try:
+            body = json.loads(e.read().decode("utf-8"))
+        except ValueError:
+            body = {}
+        raise ApiError(action, e.code, body.get("error") or f"HTTP_{e.code}", body.get("message") or "") from None
+
+
+def server_reachable(base_url: str, timeout: float = 3) -> bool:
+    """服务是否在监听（任何 HTTP 响应都算可达，连接失败或超时不算）"""
+    try:
+        urllib.request.urlopen(base_url.rstrip("/") + "/", timeout=timeout).close()
+    except urllib.error.HTTPError:
+        return True
+    except (urllib.error.URLError, OSError):
+        return False
+    return True
+
+
+def post_action(base_url: str, code: str, action: str, data=None, image=None, timeout: float = 60):
+    """以 JSON 调用 /api/gemini，返回解析后的响应体"""
+    body = json.dumps({"code": code, "action": action, "image": image, "data": data}).encode("utf-8")
+    request = urllib.request.Request(
+        base_url.rstrip("/") + API_PATH,
+        data=body,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with _open(request, action, timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def upload_asset(base_url: str, code: str, image_bytes: bytes, content_type: str = "image/jpeg", timeout: float = 60) -> dict:
+    """二进制上传图片，返回 {"assetId", "url", "bytes", "contentType"}"""
+    request = urllib.request.Request(
+        base_url.rstrip("/") + API_PATH,
+        data=image_bytes,
+        headers={"Content-Type": content_type, "X-Action": "uploadAsset", "X-Invite-Code": code},
+        method="POST",
+    )
+    with _open(request, "uploadAsset", timeout) as response:
+        return json.loads(response.read().decode("utf-8"))["result"]
+
+
+def submit_job(base_url: str, code: str, job_action: str, data: dict, image=None) -> str:
+    result = post_action(base_url, code, "submitJob", {"action": job_action, "image": image, "data": data})
+    return result["result"]["jobId"]
+
+
+def resume_job(base_url: str, code: str, job_id: str) -> dict:
+    """从检查点继续失败的 processPose 任务，返回 {"jobId", "status", "resumedFrom"}"""
+    return post_action(base_url, code, "resumeJob", {"jobId": job_id})["result"]
+
+
+def submit_batch(base_url: str, code: str, items: list, speculative=None) -> dict:
+    """提交批量任务，items 为 [{"name", "imageId", "photoTypes"}]，返回批量清单（含 batchId 与每个姿势的 jobId）"""
+    data = {"items": items}
+    if speculative:
+        data["speculative"] = speculative
+    return post_action(base_url, code, "submitBatch", data, timeout=300)["result"]
+
+
+def get_batch_status(base_url: str, code: str, batch_id: str) -> dict:
+    return post_action(base_url, code, "getBatchStatus", {"batchId": batch_id})["result"]
+
+
+def stream_batch(base_url: str, code: str, batch_id: str, timeout: float = 3600):
+    """逐个产出批量任务事件：item（单个姿势完成或失败）、done（带完整清单）、failed、timeout"""
+    yield from _stream_action(base_url, code, "streamBatch", {"batchId": batch_id}, BATCH_TERMINAL_EVENTS, timeout)
+
+
+def iter_sse(lines):
+    """把 SSE 文本行解析为 (event, data) 元组；忽略 keepalive 注释"""
+    event, data = "message", []
+    for raw in lines:
+        line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        line = line.rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+    if data:
+        yield event, "\n".join(data)
+
+
+def parse_sse_events(text: str) -> list:
+    """解析一段完整的 SSE 响应体（例如 Playwright 捕获的 streamJobStatus 响应）"""
+    return [{"event": event, "status": json.loads(data)} for event, data in iter_sse(text.splitlines())]
+
+
+def _stream_action(base_url: str, code: str, action: str, data: dict, terminal: tuple, timeout: float):
+    body = json.dumps({"code": code, "action": action, "data": data}).encode("utf-8")
+    request = urllib.request.Request(
+        base_url.rstrip("/") + API_PATH,
+        data=body,
+        headers={"Content-Type": "application/json", "Accept": "text/event-stream"},
+        method="POST",
+    )
+    t0 = time.perf_counter()
+    with _open(request, action, timeout) as response:
+        for event, data in iter_sse(response):
+            yield {
+                "event": event,
+                "status": json.loads(data),
+                "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            }
+            if event in terminal:
+                return
+
+
+def stream_job(base_url: str, code: str, job_id: str, timeout: float = 660):
+    """
+    逐个产出任务事件：{"event", "status", "elapsed_ms"}
+    elapsed_ms 为客户端收到事件的时间（相对订阅开始）
+    """
+    yield from _stream_action(base_url, code, "streamJobStatus", {"jobId": job_id}, TERMINAL_EVENTS, timeout)
+
+
+def collect_job_events(base_url: str, code: str, job_id: str, timeout: float = 660) -> list:
+    return list(stream_job(base_url, code, job_id, timeout))
+
+
+def stage_sequence(events: list) -> list:
+    """按发生顺序列出步骤（progress.step），合并连续重复"""
+    steps = []
+    for e in events:
+        progress = e["status"].get("progress")
+        if e["event"] == "progress" and progress and (not steps or steps[-1] != progress["step"]):
+            steps.append(progress["step"])
+    return steps
+
+
+def assert_stage_order(events: list, expected: list):
+    """expected 中的步骤必须按顺序出现（允许中间有迭代产生的重复步骤），且流以 completed 结束"""
+    sequence = stage_sequence(events)
+    it = iter(sequence)
+    missing = [step for step in expected if step not in it]
+    if missing:
+        raise AssertionError(f"步骤顺序不符: 期望 {expected}，实际 {sequence}")
+    if not events or events[-1]["event"] != "completed":
+        last = events[-1] if events else {}
+        raise AssertionError(f"任务未完成: {last.get('event')} {last.get('status', {}).get('error')}")
+
+
+def stage_durations(events: list) -> list:
+    """
+    每个步骤的耗时（毫秒），基于服务端记录的 progress.at
+    最后一个步骤以终态事件的 updatedAt 作为结束时间
+    """
+    progress = [e["status"]["progress"] for e in events if e["event"] == "progress" and e["status"].get("progress")]
+    seen, entries = set(), []
+    for p in progress:
+        key = (p["step"], p["promptIteration"], p["generationIteration"])
+        if key not in seen:
+            seen.add(key)
+            entries.append(p)
+    end = events[-1]["status"].get("updatedAt") if events and events[-1]["event"] in TERMINAL_EVENTS else None
+    durations = []
+    for i, p in enumerate(entries):
+        next_at = entries[i + 1]["at"] if i + 1 < len(entries) else end
+        durations.append({
+            "step": p["step"],
+            "promptIteration": p["promptIteration"],
+            "generationIteration": p["generationIteration"],
+            "elapsed_ms": p["elapsedMs"],
+            "duration_ms": (next_at - p["at"]) if next_at is not None else None,
+        })
+    return durations
+
+
+def span_stages(status: dict) -> list:
+    """任务记录中模型调用 span 的阶段列表（按调用顺序），只含成功的调用"""
+    return [span["stage"] for span in status.get("spans") or [] if span.get("status") == "ok"]
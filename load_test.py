@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+API 级负载测试 - 模拟多个并发用户走完 邀请码 → 上传 → 输入审核 → 分析 → 选择姿势 → 生成 流程
+
+每个会话按 App.tsx 的顺序发送与前端 callAPI 相同的请求：
+    uploadAsset → reviewInput → analyze → 每个姿势并行 submitJob(processPose) → streamJobStatus
+（--poll 时改为与旧前端相同的 getJobStatus 轮询）
+
+用法:
+    GEMINI_BACKEND=stub npm run dev          # 另一个终端
+    python load_test.py --sessions 50 --ramp-up 60
+    python load_test.py --sessions 20 --poses 正面头像,肖像照 --poll
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from job_stream import ApiError, post_action, stream_job, submit_job, upload_asset
+
+# 配置
+IMAGE_DIR = "sys_init"
+OUTPUT_DIR = "output"
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+ALL_POSES = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
+JOB_TIMEOUT = 660
+
+
+class SessionError(Exception):
+    """会话中止；code 与接口 error 字段使用同一套分类"""
+
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(f"{code} {message}".strip())
+        self.code = code
+
+
+class Stats:
+    """线程安全的请求计数与错误分类"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = Counter()
+        self.active = 0
+        self.peak_active = 0
+        self.speculation = []
+
+    def request(self, action: str):
+        with self._lock:
+            self.requests[action] += 1
+
+    def error(self, code: str):
+        with self._lock:
+            self.errors[code] += 1
+
+    def add_speculation(self, reports: list):
+        with self._lock:
+            self.speculation.extend(reports)
+
+    def session_started(self):
+        with self._lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def session_finished(self):
+        with self._lock:
+            self.active -= 1
+
+
+def error_code_of(exc: Exception) -> str:
+    if isinstance(exc, (ApiError, SessionError)):
+        return exc.code
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return "TIMEOUT"
+    if isinstance(exc, urllib.error.URLError):
+        return "NETWORK_ERROR"
+    return type(exc).__name__
+
+
+def percentile(values: list, p: float):
+    """最近秩法百分位；无数据时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def call(stats: Stats, action: str, fn, *args, **kwargs):
+    stats.request(action)
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        stats.error(error_code_of(e))
+        raise
+
+
+def wait_job_polling(stats: Stats, base_url: str, code: str, job_id: str, interval: float, timeout: float) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        status = call(stats, "getJobStatus", post_action, base_url, code, "getJobStatus", {"jobId": job_id})["result"]
+        if status["status"] in ("completed", "failed"):
+            return status
+        time.sleep(interval)
+    stats.error("JOB_TIMEOUT")
+    raise SessionError("JOB_TIMEOUT", job_id)
+
+
+def wait_job_streaming(stats: Stats, base_url: str, code: str, job_id: str, timeout: float) -> dict:
+    stats.request("streamJobStatus")
+    try:
+        for event in stream_job(base_url, code, job_id, timeout):
+            if event["event"] in ("completed", "failed"):
+                return event["status"]
+            if event["event"] == "timeout":
+                raise SessionError("JOB_TIMEOUT", job_id)
+    except Exception as e:
+        stats.error(error_code_of(e))
+        raise
+    stats.error("STREAM_CLOSED")
+    raise SessionError("STREAM_CLOSED", job_id)
+
+
+def run_pose(stats: Stats, args, asset_id: str, person: dict, pose: str, t0: float) -> float:
+    """提交一个姿势并等待完成，返回相对会话开始的完成时间（秒）"""
+    job_data = {"originalImageId": asset_id, "photoType": pose, "person": person}
+    if args.speculative > 1:
+        job_data["speculative"] = args.speculative
+    job_id = call(stats, "submitJob", submit_job, args.base_url, args.code, "processPose", job_data)
+    if args.poll:
+        status = wait_job_polling(stats, args.base_url, args.code, job_id, args.poll_interval, JOB_TIMEOUT)
+    else:
+        status = wait_job_streaming(stats, args.base_url, args.code, job_id, JOB_TIMEOUT)
+    if status["status"] != "completed":
+        stats.error("JOB_FAILED")
+        raise SessionError("JOB_FAILED", status.get("error") or "")
+    stats.add_speculation((status.get("result") or {}).get("speculation") or [])
+    return time.perf_counter() - t0
+
+
+def run_session(index: int, image_bytes: bytes, args, stats: Stats) -> dict:
+    result = {"session": index, "ok": False, "photos": 0, "errors": []}
+    stats.session_started()
+    t0 = time.perf_counter()
+    try:
+        asset = call(stats, "uploadAsset", upload_asset, args.base_url, args.code, image_bytes)
+        asset_id = asset["assetId"]
+        result["upload_s"] = time.perf_counter() - t0
+
+        review = call(stats, "reviewInput", post_action, args.base_url, args.code, "reviewInput", {"imageId": asset_id})["result"]
+        if not (review.get("approved") or (review.get("overallScore") or 0) >= 70):
+            stats.error("INPUT_REJECTED")
+            raise SessionError("INPUT_REJECTED", review.get("summary") or "")
+
+        person = call(stats, "analyze", post_action, args.base_url, args.code, "analyze", {"imageId": asset_id})["result"]
+        result["analysis_s"] = time.perf_counter() - t0
+
+        # 与前端一致：分析完成后所有姿势并行提交
+        done_at = []
+        with ThreadPoolExecutor(max_workers=len(args.poses)) as pool:
+            futures = [pool.submit(run_pose, stats, args, asset_id, person, pose, t0) for pose in args.poses]
+            for future in as_completed(futures):
+                try:
+                    done_at.append(future.result())
+                except Exception as e:
+                    result["errors"].append(error_code_of(e))
+
+        result["photos"] = len(done_at)
+        if done_at:
+            result["first_photo_s"] = min(done_at)
+        if len(done_at) == len(args.poses):
+            result["all_photos_s"] = max(done_at)
+            result["ok"] = True
+    except Exception as e:
+        result["errors"].append(error_code_of(e))
+    finally:
+        result["duration_s"] = time.perf_counter() - t0
+        stats.session_finished()
+    return result
+
+
+def summarize(results: list, stats: Stats, wall_s: float, args) -> dict:
+    def dist(key):
+        values = [r[key] for r in results if key in r]
+        return {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    total_requests = sum(stats.requests.values())
+    total_errors = sum(stats.errors.values())
+    photos = sum(r["photos"] for r in results)
+    return {
+        "base_url": args.base_url,
+        "sessions": len(results),
+        "poses_per_session": len(args.poses),
+        "ramp_up_s": args.ramp_up,
+        "mode": "poll" if args.poll else "stream",
+        "wall_s": wall_s,
+        "peak_concurrent_sessions": stats.peak_active,
+        "sessions_ok": sum(1 for r in results if r["ok"]),
+        "throughput": {
+            "sessions_per_min": sum(1 for r in results if r["ok"]) / wall_s * 60 if wall_s else 0,
+            "photos_per_min": photos / wall_s * 60 if wall_s else 0,
+            "requests_per_s": total_requests / wall_s if wall_s else 0,
+        },
+        "time_to_first_photo_s": dist("first_photo_s"),
+        "time_to_all_photos_s": dist("all_photos_s"),
+        "time_to_analysis_s": dist("analysis_s"),
+        "requests": dict(stats.requests),
+        "errors": {
+            code: {"count": count, "rate": count / total_requests if total_requests else 0}
+            for code, count in stats.errors.most_common()
+        },
+        "error_rate": total_errors / total_requests if total_requests else 0,
+        "speculation": {
+            "candidates": args.speculative,
+            "rounds": len(stats.speculation),
+            "accepted": sum(1 for r in stats.speculation if r["accepted"]),
+            "saved_ms_total": sum(r["savedMs"] for r in stats.speculation),
+            "saved_ms_p50": percentile([r["savedMs"] for r in stats.speculation], 50),
+            "extra_calls_total": sum(r["extraCalls"] for r in stats.speculation),
+        } if stats.speculation else None,
+    }
+
+
+def print_summary(summary: dict):
+    def fmt(v):
+        return f"{v:7.2f}s" if v is not None else "      -"
+
+    print("\n" + "=" * 60)
+    print(f"📊 负载测试结果 ({summary['mode']})")
+    print("=" * 60)
+    print(f"会话: {summary['sessions_ok']}/{summary['sessions']} 成功，峰值并发 {summary['peak_concurrent_sessions']}，总耗时 {summary['wall_s']:.1f}s")
+    t = summary["throughput"]
+    print(f"吞吐: {t['sessions_per_min']:.2f} 会话/分钟, {t['photos_per_min']:.2f} 张/分钟, {t['requests_per_s']:.2f} 请求/秒")
+    print(f"\n{'指标':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  n")
+    for label, key in [("分析完成", "time_to_analysis_s"), ("首张照片", "time_to_first_photo_s"), ("全部照片", "time_to_all_photos_s")]:
+        d = summary[key]
+        print(f"{label:<14}{fmt(d['p50'])}{fmt(d['p95'])}{fmt(d['p99'])}{fmt(d['max'])}  {d['count']}")
+    print(f"\n请求数: {json.dumps(summary['requests'], ensure_ascii=False)}")
+    if summary["errors"]:
+        print(f"错误率: {summary['error_rate']:.2%}")
+        for code, e in summary["errors"].items():
+            print(f"   {code:<24} {e['count']:>5}  ({e['rate']:.2%})")
+    else:
+        print("错误率: 0")
+    spec = summary.get("speculation")
+    if spec:
+        print(f"\n推测式生成 K={spec['candidates']}: {spec['accepted']}/{spec['rounds']} 轮有候选通过，"
+              f"共节省 {spec['saved_ms_total'] / 1000:.1f}s（中位 {spec['saved_ms_p50'] / 1000:.2f}s/轮），多花 {spec['extra_calls_total']} 次模型调用")
+
+
+def load_images(path: str) -> list:
+    p = Path(path)
+    files = [p] if p.is_file() else sorted(f for f in p.iterdir() if f.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not files:
+        raise SystemExit(f"❌ 没有找到测试图片: {path}")
+    return [f.read_bytes() for f in files]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 级负载测试")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--code", default=INVITE_CODE, help="邀请码")
+    parser.add_argument("--sessions", type=int, default=10, help="会话（用户）总数")
+    parser.add_argument("--ramp-up", type=float, default=30, help="在多少秒内均匀启动全部会话")
+    parser.add_argument("--poses", default=",".join(ALL_POSES), help="每个会话选择的姿势，逗号分隔")
+    parser.add_argument("--images", default=IMAGE_DIR, help="测试图片文件或目录，会话轮流使用")
+    parser.add_argument("--poll", action="store_true", help="使用 getJobStatus 轮询代替状态流")
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--speculative", type=int, default=1, help="每轮并行生成的候选数 K（1 为串行）")
+    parser.add_argument("--output", default=f"{OUTPUT_DIR}/load_test_report.json")
+    args = parser.parse_args()
+    args.poses = [p.strip() for p in args.poses.split(",") if p.strip()]
+
+    images = load_images(args.images)
+    stats = Stats()
+    interval = args.ramp_up / args.sessions if args.sessions > 1 else 0
+    print(f"🚀 {args.sessions} 个会话，{args.ramp_up:.0f}s 内逐步启动，每个会话 {len(args.poses)} 个姿势 → {args.base_url}")
+
+    results = []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = []
+        for i in range(args.sessions):
+            delay = t0 + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(run_session, i, images[i % len(images)], args, stats))
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            status = "✅" if r["ok"] else f"❌ {','.join(r['errors'])}"
+            print(f"   会话 {r['session']:>3}: {r['photos']}/{len(args.poses)} 张, {r['duration_s']:.1f}s {status}")
+    wall_s = time.perf_counter() - t0
+
+    summary = summarize(sorted(results, key=lambda r: r["session"]), stats, wall_s, args)
+    print_summary(summary)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().isoformat(), "summary": summary, "sessions": results}, f, indent=2, ensure_ascii=False)
+    print(f"\n📄 报告: {args.output}")
+    return 0 if summary["sessions_ok"] == summary["sessions"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
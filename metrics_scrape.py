@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+指标抓取 - 读取 metrics action 的 Prometheus 文本，计算两次抓取之间的增量
+
+E2E 运行前后各抓取一次，把增量写入 ui_test_report.json 的 metrics 字段:
+    before = scrape(BASE_URL, INVITE_CODE)
+    ...  # 运行 E2E
+    report["metrics"] = metrics_delta(before, scrape(BASE_URL, INVITE_CODE))
+
+增量只包含有变化的序列：计数器给出差值，直方图给出本次的调用数、总和与平均值，gauge 给出结束时的值。
+指标保存在实例内存中，实例重启（计数器变小）时该序列按结束时的值计。
+服务端未配置 METRICS_TOKEN 或抓取失败时返回 None，不影响测试本身。
+
+用法:
+    METRICS_TOKEN=xxx python metrics_scrape.py                # 打印当前指标摘要
+    METRICS_TOKEN=xxx python metrics_scrape.py --raw          # 打印原始 Prometheus 文本
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import urllib.request
+
+from job_stream import API_PATH, ApiError, _open
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$")
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def fetch_metrics_text(base_url: str, code: str, token: str = METRICS_TOKEN, timeout: float = 30) -> str:
+    body = json.dumps({"code": code, "action": "metrics", "data": {}}).encode("utf-8")
+    request = urllib.request.Request(
+        base_url.rstrip("/") + API_PATH,
+        data=body,
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        method="POST",
+    )
+    with _open(request, "metrics", timeout) as response:
+        return response.read().decode("utf-8")
+
+
+def parse_metrics(text: str) -> dict:
+    """解析 Prometheus 文本，返回 {"types": {名称: 类型}, "samples": {(名称, 标签元组): 值}}"""
+    types, samples = {}, {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(None, 3)
+            types[name] = kind
+            continue
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        pairs = tuple(sorted((k, _unescape(v)) for k, v in _LABEL.findall(labels or "")))
+        samples[(name, pairs)] = float(value)
+    return {"types": types, "samples": samples}
+
+
+def scrape(base_url: str = BASE_URL, code: str = INVITE_CODE, token: str = METRICS_TOKEN):
+    """抓取并解析；未配置 METRICS_TOKEN 或请求失败时返回 None"""
+    if not token:
+        return None
+    try:
+        return parse_metrics(fetch_metrics_text(base_url, code, token))
+    except (ApiError, OSError) as e:
+        print(f"⚠️ 指标抓取失败: {e}")
+        return None
+
+
+def _series_name(name: str, labels: tuple) -> str:
+    return name + ("{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else "")
+
+
+def metrics_delta(before, after):
+    """两次抓取之间的增量；任一次抓取失败时返回 None"""
+    if before is None or after is None:
+        return None
+    types = after["types"]
+    old, new = before["samples"], after["samples"]
+
+    def diff(key):
+        value = new[key]
+        previous = old.get(key, 0.0)
+        # 计数器变小说明实例重启过，按结束时的值计
+        return value - previous if value >= previous else value
+
+    counters, histograms, gauges = {}, {}, {}
+    for key, value in new.items():
+        name, labels = key
+        kind = types.get(name)
+        if kind == "counter":
+            delta = diff(key)
+            if delta:
+                counters[_series_name(name, labels)] = delta
+        elif kind == "gauge":
+            gauges[_series_name(name, labels)] = value
+        elif name.endswith("_count") and types.get(name[:-6]) == "histogram":
+            base = name[:-6]
+            count = diff(key)
+            if count:
+                total = diff((base + "_sum", labels))
+                histograms[_series_name(base, labels)] = {
+                    "count": count,
+                    "sum": round(total, 3),
+                    "mean": round(total / count, 3),
+                }
+    return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+
+def format_metrics_delta(delta) -> str:
+    if delta is None:
+        return "  （未抓取指标：未设置 METRICS_TOKEN 或抓取失败）"
+    lines = [f"  {name}: +{value:g}" for name, value in sorted(delta["counters"].items())]
+    lines += [f"  {name}: {h['count']:g} 次，平均 {h['mean']:g}" for name, h in sorted(delta["histograms"].items())]
+    return "\n".join(lines) or "  （无变化）"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抓取 metrics action")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--code", default=INVITE_CODE, help="邀请码")
+    parser.add_argument("--token", default=METRICS_TOKEN, help="METRICS_TOKEN（默认读取环境变量）")
+    parser.add_argument("--raw", action="store_true", help="打印原始 Prometheus 文本")
+    args = parser.parse_args()
+    if not args.token:
+        print("❌ 需要 METRICS_TOKEN")
+        return 1
+    try:
+        text = fetch_metrics_text(args.base_url, args.code, args.token)
+    except ApiError as e:
+        print(f"❌ {e}")
+        return 1
+    if args.raw:
+        print(text, end="")
+    else:
+        parsed = parse_metrics(text)
+        print(format_metrics_delta(metrics_delta({"types": {}, "samples": {}}, parsed)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,40 @@ cd "$ROOT_DIR"
 OUTPUT_DIR="${OUTPUT_DIR:-output}"
 PORT="${PORT:-3000}"
 BASE_URL="${BASE_URL:-http://localhost:${PORT}}"
+export BASE_URL
+
+# 离线模式：GEMINI_BACKEND=stub 时使用本地 Gemini 替身，不需要网络和 API Key
+BINDINGS=()
+if [ "${GEMINI_BACKEND:-}" = "stub" ]; then
+  BINDINGS+=(--binding "INVITE_CODES=${INVITE_CODES:-PHOTO2026}")
+  for var in GEMINI_BACKEND STUB_LATENCY_MS STUB_IMAGE_LATENCY_MS STUB_FAILURE_RATE STUB_FAIL_MODELS STUB_REVIEW_SCORES STUB_SEED \
+      MAX_CONCURRENT_MODEL_CALLS MODEL_RATE_PER_MINUTE MODEL_RATE_LIMITS MODEL_BURST MODEL_COOLDOWN_MS SPECULATIVE_CANDIDATES \
+      PRESCREEN STUB_PRESCREEN_SCORES; do
+    if [ -n "${!var:-}" ]; then
+      BINDINGS+=(--binding "${var}=${!var}")
+    fi
+  done
+  echo "Using offline stub Gemini backend"
+fi
+
+# 录制 / 回放：GEMINI_BACKEND=record 调用真实 Gemini 并录制，replay 按录制离线回放（CASSETTE 为要导入的录制文件）
+KV_BINDINGS=(--kv JOBS_KV --r2 ASSETS_BUCKET)
+if [ "${GEMINI_BACKEND:-}" = "record" ] || [ "${GEMINI_BACKEND:-}" = "replay" ]; then
+  KV_BINDINGS+=(--kv CASSETTE_KV)
+  BINDINGS+=(--binding "GEMINI_BACKEND=${GEMINI_BACKEND}")
+  if [ "${GEMINI_BACKEND}" = "replay" ]; then
+    BINDINGS+=(--binding "INVITE_CODES=${INVITE_CODES:-PHOTO2026}")
+    if [ -n "${REPLAY_LATENCY_FACTOR:-}" ]; then
+      BINDINGS+=(--binding "REPLAY_LATENCY_FACTOR=${REPLAY_LATENCY_FACTOR}")
+    fi
+  fi
+  echo "Using Gemini ${GEMINI_BACKEND} backend"
+fi
+
+# 指标：未指定 METRICS_TOKEN 时生成临时 token，ui_acceptance_test.py 在运行前后抓取 metrics 并把增量写入报告
+METRICS_TOKEN="${METRICS_TOKEN:-e2e-${RANDOM}${RANDOM}}"
+export METRICS_TOKEN
+BINDINGS+=(--binding "METRICS_TOKEN=${METRICS_TOKEN}")
 
 mkdir -p "$OUTPUT_DIR"
 mkdir -p "$OUTPUT_DIR/wrangler-logs"
@@ -17,7 +51,7 @@ export CHOKIDAR_INTERVAL="${CHOKIDAR_INTERVAL:-1000}"
 
 echo "Starting dev server on ${BASE_URL}..."
 WRANGLER_INSPECTOR_PORT="${WRANGLER_INSPECTOR_PORT:-0}"
-npx wrangler pages dev --proxy "$PORT" --ip 127.0.0.1 --inspector-port "$WRANGLER_INSPECTOR_PORT" -- npm run dev:frontend > "$OUTPUT_DIR/dev_server.log" 2>&1 &
+npx wrangler pages dev "${KV_BINDINGS[@]}" --proxy "$PORT" --ip 127.0.0.1 --inspector-port "$WRANGLER_INSPECTOR_PORT" ${BINDINGS[@]+"${BINDINGS[@]}"} -- npm run dev:frontend > "$OUTPUT_DIR/dev_server.log" 2>&1 &
 DEV_PID=$!
 
 cleanup() {
@@ -41,5 +75,22 @@ for i in {1..60}; do
   fi
 done
 
+if [ "${GEMINI_BACKEND:-}" = "replay" ] && [ -n "${CASSETTE:-}" ]; then
+  python cassette.py import "$CASSETTE"
+fi
+
 # Run UI E2E test
 python ui_acceptance_test.py
+
+# 离线模式下额外验证任务状态流的步骤顺序
+if [ "${GEMINI_BACKEND:-}" = "stub" ]; then
+  python test_job_stream.py
+  python test_resume_job.py
+fi
+
+if [ "${GEMINI_BACKEND:-}" = "record" ] && [ -n "${CASSETTE:-}" ]; then
+  python cassette.py export "$CASSETTE"
+fi
+if [ "${GEMINI_BACKEND:-}" = "replay" ]; then
+  python cassette.py stats
+fi
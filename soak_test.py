@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+浸泡测试 - 对 Gemini 替身持续提交数千个合成任务，断言实例内存保持平稳
+
+每个任务使用不同的随机"图片"（替身不解码图片），不会被去重或命中结果缓存，
+所以每个任务都会在内存任务存储中留下一条记录。测试期间定期读取 stats action 的 memory 字段
+（各有界表的条数与记账字节数），以及本机 workerd 进程的 RSS（能找到时），断言：
+    - 各表始终不超过自身的条数 / 字节上限
+    - 后三分之一采样相对中间三分之一的增长不超过 --tolerance（RSS 为 --rss-tolerance）
+    - 已接受的任务在结束前不会从任务存储中消失（getJobStatus 返回 JOB_NOT_FOUND）；
+      存储中只剩未结束的任务时 submitJob 返回 JOB_STORE_FULL（503），这类提交计为 rejected，不算失败
+
+需要使用内存任务存储（不绑定 JOBS_KV），并放宽调度器限流，例如:
+    npx wrangler pages dev --proxy 3000 --binding GEMINI_BACKEND=stub --binding INVITE_CODES=PHOTO2026 \\
+        --binding MODEL_RATE_PER_MINUTE=100000 --binding MODEL_BURST=1000 --binding MAX_CONCURRENT_MODEL_CALLS=50 \\
+        -- npm run dev:frontend
+    python soak_test.py --jobs 5000 --concurrency 20
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from job_stream import ApiError, post_action, submit_job
+
+# 配置
+OUTPUT_DIR = "output"
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+ALL_POSES = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
+JOB_TIMEOUT = 120
+
+
+def synthetic_image(size: int) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(os.urandom(size)).decode("ascii")
+
+
+def wait_job(base_url: str, code: str, job_id: str, interval: float = 0.2) -> str:
+    deadline = time.perf_counter() + JOB_TIMEOUT
+    while time.perf_counter() < deadline:
+        try:
+            status = post_action(base_url, code, "getJobStatus", {"jobId": job_id})["result"]["status"]
+        except ApiError as e:
+            if e.code == "JOB_NOT_FOUND":
+                print(f"   ❌ 任务 {job_id} 在结束前消失")
+                return "lost"
+            raise
+        if status in ("completed", "failed"):
+            return status
+        time.sleep(interval)
+    return "timeout"
+
+
+def run_job(index: int, args) -> str:
+    image = synthetic_image(args.image_bytes)
+    try:
+        if args.action == "processPose":
+            data = {"originalImage": image, "photoType": ALL_POSES[index % len(ALL_POSES)]}
+            job_id = submit_job(args.base_url, args.code, "processPose", data)
+        else:
+            job_id = submit_job(args.base_url, args.code, "analyze", {}, image=image)
+    except ApiError as e:
+        if e.code == "JOB_STORE_FULL":
+            return "rejected"
+        raise
+    return wait_job(args.base_url, args.code, job_id)
+
+
+def find_workerd_pid():
+    """本机 wrangler dev 的 workerd 进程（只支持 Linux /proc）"""
+    proc = Path("/proc")
+    if not proc.exists():
+        return None
+    for entry in proc.iterdir():
+        if entry.name.isdigit():
+            try:
+                if (entry / "comm").read_text().strip() == "workerd":
+                    return int(entry.name)
+            except OSError:
+                continue
+    return None
+
+
+def rss_bytes(pid):
+    if pid is None:
+        return None
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def take_sample(args, done: int, pid) -> dict:
+    memory = post_action(args.base_url, args.code, "stats")["result"].get("memory") or {}
+    return {"done": done, "at": time.time(), "memory": memory, "rss": rss_bytes(pid)}
+
+
+def growth(samples: list, value) -> float:
+    """后三分之一采样的最大值相对中间三分之一平均值的增长比例"""
+    third = len(samples) // 3
+    middle = [value(s) for s in samples[third:2 * third] if value(s) is not None]
+    tail = [value(s) for s in samples[2 * third:] if value(s) is not None]
+    if not middle or not tail:
+        return 0.0
+    base = sum(middle) / len(middle)
+    return (max(tail) - base) / base if base > 0 else 0.0
+
+
+def check(samples: list, args) -> list:
+    failures = []
+    tables = sorted({name for s in samples for name in s["memory"]})
+    if "jobs" not in tables:
+        failures.append("stats 中没有 jobs 表：服务可能绑定了 JOBS_KV，浸泡测试需要内存任务存储")
+    for name in tables:
+        for s in samples:
+            t = s["memory"].get(name)
+            if not t:
+                continue
+            if t["size"] > t["maxEntries"]:
+                failures.append(f"{name} 条数 {t['size']} 超过上限 {t['maxEntries']}（已完成 {s['done']}）")
+                break
+            if t.get("maxBytes") and t["bytes"] > t["maxBytes"]:
+                failures.append(f"{name} 字节数 {t['bytes']} 超过上限 {t['maxBytes']}（已完成 {s['done']}）")
+                break
+        g = growth(samples, lambda s, n=name: (s["memory"].get(n) or {}).get("bytes") or None)
+        if g > args.tolerance:
+            failures.append(f"{name} 字节数在后段仍增长 {g:.0%}（允许 {args.tolerance:.0%}）")
+    g = growth(samples, lambda s: s["rss"])
+    if g > args.rss_tolerance:
+        failures.append(f"workerd RSS 在后段仍增长 {g:.0%}（允许 {args.rss_tolerance:.0%}）")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内存浸泡测试")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--code", default=INVITE_CODE, help="邀请码")
+    parser.add_argument("--jobs", type=int, default=3000, help="提交的任务总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时进行的任务数")
+    parser.add_argument("--action", choices=["analyze", "processPose"], default="analyze")
+    parser.add_argument("--image-bytes", type=int, default=16 * 1024, help="每个合成图片的大小")
+    parser.add_argument("--sample-every", type=int, default=100, help="每完成多少个任务采样一次")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="各表字节数后段允许的增长比例")
+    parser.add_argument("--rss-tolerance", type=float, default=0.25, help="workerd RSS 后段允许的增长比例")
+    parser.add_argument("--pid", type=int, help="workerd 进程 ID（默认在 /proc 中查找）")
+    parser.add_argument("--output", default=f"{OUTPUT_DIR}/soak_test_report.json")
+    args = parser.parse_args()
+
+    pid = args.pid or find_workerd_pid()
+    print(f"🚀 {args.jobs} 个 {args.action} 任务，并发 {args.concurrency} → {args.base_url}"
+          f"（workerd pid: {pid or '未找到，跳过 RSS'}）")
+
+    samples = [take_sample(args, 0, pid)]
+    outcomes = {"completed": 0, "failed": 0, "timeout": 0, "rejected": 0, "lost": 0, "error": 0}
+    lock = threading.Lock()
+    done = 0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_job, i, args) for i in range(args.jobs)]
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except ApiError as e:
+                print(f"   ⚠️ {e}")
+                outcome = "error"
+            with lock:
+                outcomes[outcome] += 1
+                done += 1
+                current = done
+            if current % args.sample_every == 0 or current == args.jobs:
+                sample = take_sample(args, current, pid)
+                samples.append(sample)
+                jobs = sample["memory"].get("jobs") or {}
+                rss = f"{sample['rss'] / 1048576:.0f}MB" if sample["rss"] else "-"
+                print(f"   {current:>6}/{args.jobs}  jobs {jobs.get('size', '-'):>5} 条 "
+                      f"{(jobs.get('bytes') or 0) / 1048576:7.2f}MB  淘汰 {jobs.get('evictions', '-'):>6}  RSS {rss}")
+    wall_s = time.perf_counter() - t0
+
+    failures = check(samples, args)
+    if outcomes["completed"] == 0:
+        failures.append("没有任务成功完成")
+    if outcomes["lost"]:
+        failures.append(f"{outcomes['lost']} 个已接受的任务在结束前从任务存储中消失")
+    summary = {
+        "jobs": args.jobs,
+        "action": args.action,
+        "wall_s": round(wall_s, 1),
+        "jobs_per_s": round(args.jobs / wall_s, 1) if wall_s > 0 else None,
+        "outcomes": outcomes,
+        "final_memory": samples[-1]["memory"],
+        "rss_start": samples[0]["rss"],
+        "rss_end": samples[-1]["rss"],
+        "failures": failures,
+    }
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().isoformat(), "summary": summary, "samples": samples}, f, indent=2, ensure_ascii=False)
+
+    print(f"\n完成 {outcomes['completed']}，失败 {outcomes['failed']}，超时 {outcomes['timeout']}，"
+          f"拒绝 {outcomes['rejected']}，消失 {outcomes['lost']}，请求错误 {outcomes['error']}，"
+          f"{summary['jobs_per_s']} 任务/秒")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ 内存保持平稳")
+    print(f"📄 报告: {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
-import { analyze, reviewInput, processPoseAsync, setOriginalImage, clearInviteCode, processFile, type JobStatus } from './api';
+import { analyze, reviewInput, processPoseAsync, setOriginalImage, clearInviteCode, processFile, type JobStatus, type JobProgress } from './api';
 import { useWorkflowStore } from './store';
+import { preloadFaceModels } from './face-api';
 import type { Person, Photo, ReviewResult } from './types';
 
 const PHOTO_TYPES = [
@@ -31,6 +32,15 @@ interface PoseState {
   steps: ProcessingStep[];
 }
 
+// 后端任务步骤 → 处理步骤时间轴索引
+const JOB_STEP_INDEX: Record<JobProgress['step'], number> = {
+  analyze: 0,
+  design: 0,
+  reviewPrompt: 1,
+  generate: 2,
+  reviewResult: 3,
+};
+
 // Review Panel Component
 function ReviewPanel({ review, title }: { review: ReviewResult | null; title?: string }) {
   if (!review) return <div className="text-gray-400 text-sm">审核中...</div>;
@@ -177,6 +187,11 @@ function InviteStep({ onEnter }: { onEnter: () => void }) {
 function ConsentStep({ onAgree }: { onAgree: () => void }) {
   const [checked, setChecked] = useState(false);
 
+  // 用户阅读协议时在 Worker 中预加载人脸检测模型
+  useEffect(() => {
+    preloadFaceModels();
+  }, []);
+
   return (
     <div className="panel-strong mx-auto max-w-2xl p-8 md:p-10">
       <div className="flex items-center justify-between">
@@ -230,6 +245,11 @@ function UploadStep({ onNext }: { onNext: (image: string) => Promise<void> }) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
 
+  // 已同意过协议时直接进入本步骤，在这里补做预加载（Worker 内只加载一次）
+  useEffect(() => {
+    preloadFaceModels();
+  }, []);
+
   const handleFile = useCallback(async (file: File) => {
     if (!file.type.startsWith('image/')) {
       setError('请上传图片文件');
@@ -455,14 +475,21 @@ function ProcessingStep({
         poseType,
         personData,
         (status: JobStatus) => {
-          // 根据任务状态更新进度
-          const progress = status.status === 'pending' ? 30 :
-                          status.status === 'processing' ? 60 :
-                          status.status === 'completed' ? 100 : 30;
+          // 根据任务状态更新进度；有步骤信息时按步骤细化
+          const stepIndex = status.progress ? JOB_STEP_INDEX[status.progress.step] : undefined;
+          const progress = status.status === 'completed' ? 100 :
+                          stepIndex !== undefined ? 40 + stepIndex * 15 :
+                          status.status === 'processing' ? 60 : 30;
           updatePoseState(poseType, {
             status: status.status === 'completed' ? 'completed' :
                     status.status === 'failed' ? 'error' : 'generating',
             progress,
+            ...(stepIndex !== undefined && status.progress ? {
+              step: stepIndex,
+              promptIteration: status.progress.promptIteration,
+              generationIteration: status.progress.generationIteration,
+              steps: updateSteps(poseType, stepIndex, 'active'),
+            } : {}),
           });
         }
       );
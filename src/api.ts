@@ -1,4 +1,5 @@
 import type { Person, Design, Photo, ReviewResult } from './types';
+import { getImageWorker, preprocessImage, type PreprocessOptions } from './imagePreprocess';
 
 const API_URL = import.meta.env.VITE_API_URL || '/api/gemini';
 
@@ -8,6 +9,26 @@ const MAX_IMAGE_SIZE = 2 * 1024 * 1024; // 2MB
 const COMPRESS_QUALITY = 0.85;
 const MAX_DIMENSION = 2048;
 
+// Worker 预处理：按人脸裁剪并缩放，人像不需要 2048px
+const PREPROCESS_OPTIONS: PreprocessOptions = {
+  maxBytes: MAX_IMAGE_SIZE,
+  maxDimension: 1536,
+  minFaceWidth: 256,
+  crop: true,
+};
+
+// 最近一次预处理的结果：上传时直接使用 Blob，并把预处理摘要放在 X-Image-Preprocess 头里供测试统计
+let preprocessed: { image: string; blob?: Blob; summary: string } | null = null;
+
+function blobToDataUrl(blob: Blob): Promise<string> {
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = (e) => resolve(e.target?.result as string);
+    reader.onerror = () => reject(new Error('文件读取失败'));
+    reader.readAsDataURL(blob);
+  });
+}
+
 /**
  * 压缩图片到指定大小以下
  */
@@ -66,30 +87,126 @@ export async function compressImage(file: File, maxSizeMB: number = 2): Promise<
 }
 
 /**
- * 处理文件：如果是图片则压缩
+ * 处理文件：优先在 Worker 中解码、按人脸裁剪并压缩；不支持时退回主线程压缩
+ * localStorage.image_preprocess = 'legacy' 强制使用旧流程（用于对比测试）
  */
 export async function processFile(file: File): Promise<string> {
+  const started = performance.now();
+  if (localStorage.getItem('image_preprocess') !== 'legacy' && getImageWorker()) {
+    try {
+      const result = await preprocessImage(file, PREPROCESS_OPTIONS);
+      const image = await blobToDataUrl(result.blob);
+      console.log(
+        `[Image] Preprocessed in worker: ${(file.size / 1024).toFixed(0)}KB ${result.sourceWidth}x${result.sourceHeight}` +
+        ` -> ${(result.blob.size / 1024).toFixed(0)}KB ${result.width}x${result.height}, quality: ${result.quality.toFixed(2)},` +
+        ` face: ${result.face ? result.detector : 'none'}, ${result.durationMs}ms`
+      );
+      preprocessed = {
+        image,
+        blob: result.blob,
+        summary: `mode=worker; ms=${Math.round(performance.now() - started)}; source=${file.size}; quality=${result.quality.toFixed(2)}; ` +
+          `size=${result.width}x${result.height}; face=${result.face ? 1 : 0}; cropped=${result.cropped ? 1 : 0}; detector=${result.detector}`,
+      };
+      return image;
+    } catch (e) {
+      console.warn('[Image] Worker preprocessing failed, using main thread:', e);
+    }
+  }
+
+  let image: string;
   // 如果文件小于 2MB 且是 JPEG/PNG，直接返回
   if (file.size <= MAX_IMAGE_SIZE && (file.type === 'image/jpeg' || file.type === 'image/png')) {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onload = (e) => resolve(e.target?.result as string);
-      reader.onerror = reject;
-      reader.readAsDataURL(file);
-    });
+    image = await blobToDataUrl(file);
+  } else {
+    // 否则压缩
+    image = await compressImage(file, 2);
+  }
+  preprocessed = { image, summary: `mode=legacy; ms=${Math.round(performance.now() - started)}; source=${file.size}` };
+  return image;
+}
+
+// --- 图片资源：上传一次，之后按 ID 引用 ---
+
+let imageAsset: { image: string; assetId: Promise<string | undefined> } | null = null;
+
+/**
+ * 以二进制上传图片，返回资源 ID（内容 SHA-256）
+ */
+export async function uploadAsset(blob: Blob, preprocessSummary?: string): Promise<{ assetId: string; url: string; bytes: number }> {
+  const headers: Record<string, string> = {
+    'Content-Type': blob.type || 'image/jpeg',
+    'X-Action': 'uploadAsset',
+    'X-Invite-Code': getCode(),
+  };
+  if (preprocessSummary) {
+    headers['X-Image-Preprocess'] = preprocessSummary;
+  }
+  const res = await fetch(API_URL, {
+    method: 'POST',
+    headers,
+    body: blob,
+  });
+  if (!res.ok) {
+    throw new Error(`图片上传失败 (HTTP ${res.status})`);
   }
-  // 否则压缩
-  return compressImage(file, 2);
+  const body = await res.json();
+  return body.result;
+}
+
+/**
+ * 同一张图片只上传一次；上传失败时返回 undefined，调用方退回发送 data URL
+ */
+export function ensureImageAsset(image: string): Promise<string | undefined> {
+  if (imageAsset?.image !== image) {
+    const source = preprocessed?.image === image ? preprocessed : null;
+    const blob = source?.blob ? Promise.resolve(source.blob) : fetch(image).then(res => res.blob());
+    const assetId = blob
+      .then(b => uploadAsset(b, source?.summary))
+      .then(asset => asset.assetId)
+      .catch(e => {
+        console.warn('[Asset] Upload failed, sending inline image instead:', e);
+        if (imageAsset?.assetId === assetId) imageAsset = null; // 下次调用时重试
+        return undefined;
+      });
+    imageAsset = { image, assetId };
+  }
+  return imageAsset.assetId;
 }
 
 // --- 异步任务轮询 ---
 
+export interface ModelCallSpan {
+  stage: string;
+  model: string;
+  attempt: number;
+  queueMs: number;
+  startMs: number;
+  durationMs: number;
+  requestBytes: number;
+  responseBytes: number;
+  status: 'ok' | 'rate_limited' | 'error';
+  error?: string;
+}
+
+export interface JobProgress {
+  step: 'analyze' | 'design' | 'reviewPrompt' | 'generate' | 'reviewResult';
+  promptIteration: number;
+  generationIteration: number;
+  elapsedMs: number;
+  at: number;
+}
+
 export interface JobStatus {
   jobId: string;
   status: 'pending' | 'processing' | 'completed' | 'failed';
   action: string;
+  photoType?: string;
+  progress?: JobProgress;
   result?: any;
   error?: string;
+  spans?: ModelCallSpan[];
+  checkpoint?: string; // processPose 最后完成的阶段，失败后可用 resumeJob 从这里继续
+  attempts?: number; // 已恢复的次数
   createdAt: number;
   updatedAt: number;
 }
@@ -97,8 +214,22 @@ export interface JobStatus {
 /**
  * 提交异步任务
  */
-export async function submitJob(action: string, image?: string, data?: any): Promise<{ jobId: string; status: string }> {
-  return callAPI<{ jobId: string; status: string }>('submitJob', image, { action, image, data });
+export interface SubmitJobResult {
+  jobId: string;
+  status: string;
+  deduplicated?: boolean; // 相同内容的任务已存在，返回的是已有任务
+  result?: any; // 已有任务已完成时直接返回结果
+}
+
+export async function submitJob(action: string, image?: string, data?: any): Promise<SubmitJobResult> {
+  return callAPI<SubmitJobResult>('submitJob', image, { action, image, data });
+}
+
+/**
+ * 从检查点继续失败的 processPose 任务
+ */
+export async function resumeJob(jobId: string): Promise<SubmitJobResult> {
+  return callAPI<SubmitJobResult>('resumeJob', undefined, { jobId });
 }
 
 /**
@@ -143,7 +274,67 @@ export async function pollJobUntilComplete(
 }
 
 /**
- * 异步处理单个姿势（提交任务 + 轮询）
+ * 通过 SSE 订阅任务状态，直到任务结束
+ * 返回最终状态（completed / failed）；连接异常或超时时抛出错误，由调用方退回轮询
+ */
+export async function streamJobUntilComplete(
+  jobId: string,
+  onProgress?: (status: JobStatus) => void
+): Promise<JobStatus> {
+  const res = await fetch(API_URL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+    body: JSON.stringify({ code: getCode(), action: 'streamJobStatus', data: { jobId } }),
+  });
+
+  if (!res.ok || !res.body) {
+    throw new Error(`状态流不可用 (HTTP ${res.status})`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE 事件以空行分隔
+    let boundary: number;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let payload = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) payload += line.slice(5).trim();
+      }
+      if (!payload) continue; // keepalive 注释
+
+      if (event === 'timeout') {
+        throw new Error('状态流超时');
+      }
+      const status: JobStatus = JSON.parse(payload);
+      if (onProgress) {
+        onProgress(status);
+      }
+      if (event === 'completed' || event === 'failed') {
+        reader.cancel().catch(() => {});
+        return status;
+      }
+    }
+  }
+
+  throw new Error('状态流意外结束');
+}
+
+const MAX_JOB_RESUMES = 1; // 任务中途失败后自动从检查点恢复的次数
+
+/**
+ * 异步处理单个姿势（提交任务 + SSE 推送，不可用时退回轮询）
  */
 export async function processPoseAsync(
   originalImage: string,
@@ -156,25 +347,54 @@ export async function processPoseAsync(
   promptIterations: number;
   generationIterations: number;
 }> {
-  // 提交任务
-  const { jobId } = await submitJob('processPose', undefined, {
-    originalImage,
+  // 提交任务；图片已上传时只传资源 ID
+  const originalImageId = await ensureImageAsset(originalImage);
+  const submitted = await submitJob('processPose', undefined, {
+    ...(originalImageId ? { originalImageId } : { originalImage }),
     photoType,
     person,
   });
+  const { jobId } = submitted;
 
-  console.log(`[Async] Job submitted: ${jobId}`);
+  if (submitted.deduplicated && submitted.status === 'completed') {
+    console.log(`[Async] Reusing completed job: ${jobId}`);
+    return withAssetCode(submitted.result);
+  }
+  console.log(`[Async] Job ${submitted.deduplicated ? 'attached' : 'submitted'}: ${jobId}`);
+
+  let finalStatus: JobStatus;
+  for (let resumes = 0; ; resumes++) {
+    try {
+      finalStatus = await streamJobUntilComplete(jobId, onProgress);
+    } catch (e) {
+      console.warn(`[Async] Status stream unavailable, falling back to polling: ${jobId}`, e);
+      return withAssetCode(await pollJobUntilComplete(jobId, onProgress));
+    }
 
-  // 轮询等待结果
-  const result = await pollJobUntilComplete(jobId, onProgress);
+    // 中途失败但已有检查点：从最后完成的阶段继续，不重新分析和设计
+    if (finalStatus.status !== 'failed' || resumes >= MAX_JOB_RESUMES || !finalStatus.checkpoint || finalStatus.checkpoint === 'none') {
+      break;
+    }
+    console.warn(`[Async] Job ${jobId} failed after ${finalStatus.checkpoint}, resuming: ${finalStatus.error}`);
+    await resumeJob(jobId);
+  }
 
-  return result;
+  if (finalStatus.status === 'failed') {
+    throw new Error(finalStatus.error || '任务处理失败');
+  }
+  return withAssetCode(finalStatus.result);
 }
 
 function getCode(): string {
   return localStorage.getItem('invite_code') || '';
 }
 
+// 读取资源同样需要邀请码；<img src> 无法带请求头，放在查询参数中
+function withAssetCode<T extends { image: string }>(result: T): T {
+  if (!result?.image?.includes('?asset=')) return result;
+  return { ...result, image: `${result.image}&code=${encodeURIComponent(getCode())}` };
+}
+
 interface APIResponse<T> {
   result: T;
   action: string;
@@ -287,6 +507,8 @@ let cachedPerson: Person | null = null;
 
 export function setOriginalImage(image: string) {
   cachedOriginalImage = image;
+  // 压缩完成后立即开始上传，后续请求按 ID 引用
+  void ensureImageAsset(image);
 }
 
 export function getOriginalImage(): string | null {
@@ -302,14 +524,20 @@ export function getCachedPerson(): Person | null {
 }
 
 export async function analyze(image: string): Promise<Person> {
-  const person = await callAPI<Person>('analyze', image);
+  const imageId = await ensureImageAsset(image);
+  const person = imageId
+    ? await callAPI<Person>('analyze', undefined, { imageId })
+    : await callAPI<Person>('analyze', image);
   cachedPerson = person;
   cachedOriginalImage = image;
   return person;
 }
 
 export async function reviewInput(image: string): Promise<ReviewResult> {
-  return callAPI<ReviewResult>('reviewInput', image);
+  const imageId = await ensureImageAsset(image);
+  return imageId
+    ? callAPI<ReviewResult>('reviewInput', undefined, { imageId })
+    : callAPI<ReviewResult>('reviewInput', image);
 }
 
 export async function design(person: Person, photoType: string): Promise<Design> {
@@ -321,13 +549,13 @@ export async function generate(
   design: Design, 
   photoType: string,
   referenceImage: string
-): Promise<{ image: string; text?: string }> {
-  return callAPI<{ image: string; text?: string }>('generate', undefined, {
+): Promise<{ image: string; imageId?: string; text?: string }> {
+  return withAssetCode(await callAPI<{ image: string; imageId?: string; text?: string }>('generate', undefined, {
     person,
     design,
     photoType,
     referenceImage
-  });
+  }));
 }
 
 export async function review(
@@ -345,23 +573,14 @@ export async function review(
 }
 
 
-// 完整的处理流程 - 批量处理所有姿势
-export async function processAll(image: string): Promise<{
-  person: Person;
-  photos: Photo[];
-}> {
-  // processAll 需要处理多个姿势，使用 300 秒超时
-  const result = await callAPI<{
-    person: Person;
-    photos: Array<{
-      type: string;
-      url: string;
-      review: ReviewResult;
-    }>;
-  }>('processAll', undefined, { originalImage: image }, 300000);
+interface ProcessAllPhoto {
+  type: string;
+  url: string;
+  review: ReviewResult;
+}
 
-  // 转换为Photo格式
-  const photos: Photo[] = result.photos.map(p => ({
+function toPhoto(p: ProcessAllPhoto): Photo {
+  return {
     id: `${p.type}-${Date.now()}`,
     type: p.type,
     url: p.url,
@@ -372,7 +591,23 @@ export async function processAll(image: string): Promise<{
       approved: true,
       summary: '批量处理完成'
     }
-  }));
+  };
+}
+
+// 完整的处理流程 - 批量处理所有姿势
+export async function processAll(image: string): Promise<{
+  person: Person;
+  photos: Photo[];
+}> {
+  // processAll 需要处理多个姿势，使用 300 秒超时
+  const originalImageId = await ensureImageAsset(image);
+  const result = await callAPI<{
+    person: Person;
+    photos: ProcessAllPhoto[];
+  }>('processAll', undefined, originalImageId ? { originalImageId } : { originalImage: image }, 300000);
+
+  // 转换为Photo格式
+  const photos: Photo[] = result.photos.map(toPhoto);
 
   cachedPerson = result.person;
   cachedOriginalImage = image;
@@ -1,25 +1,44 @@
-// 简化的人脸检测接口
+// 简化的人脸检测接口：支持 Worker / OffscreenCanvas 时模型加载与检测都在图片预处理 Worker 中进行，不占用主线程；
+// 否则（或 Worker 出错时）退回主线程检测，检测本身失败时才使用默认框
+import { detectFacesInWorker, getImageWorker, type FaceBox } from './imagePreprocess';
+
+export { preloadFaceModels } from './imagePreprocess';
+
+const DEFAULT_FACES: FaceBox[] = [{ x: 100, y: 50, w: 200, h: 250 }];
+
 let api: any = null;
 
-export async function detectFaces(imageData: string): Promise<{ x: number; y: number; w: number; h: number }[]> {
-  try {
-    if (!api) {
-      const faceapi = await import('face-api.js');
-      await Promise.all([
-        faceapi.loadTinyFaceDetectorModel('/models'),
-        faceapi.loadFaceLandmarkModel('/models'),
-      ]);
-      api = faceapi;
-    }
+async function detectFacesOnMainThread(imageData: string): Promise<FaceBox[]> {
+  if (!api) {
+    const faceapi = await import('face-api.js');
+    await Promise.all([
+      faceapi.loadTinyFaceDetectorModel('/models'),
+      faceapi.loadFaceLandmarkModel('/models'),
+    ]);
+    api = faceapi;
+  }
 
-    const img = new Image();
-    img.src = imageData;
-    await new Promise(r => img.onload = r);
+  const img = new Image();
+  img.src = imageData;
+  await new Promise(r => img.onload = r);
 
-    const det = await api.detectAllFaces(img, new api.TinyFaceDetectorOptions());
-    return det.map((d: any) => ({ x: d.box.x, y: d.box.y, w: d.box.width, h: d.box.height }));
+  const det = await api.detectAllFaces(img, new api.TinyFaceDetectorOptions());
+  return det.map((d: any) => ({ x: d.box.x, y: d.box.y, w: d.box.width, h: d.box.height }));
+}
+
+export async function detectFaces(imageData: string): Promise<FaceBox[]> {
+  if (getImageWorker()) {
+    try {
+      const blob = await (await fetch(imageData)).blob();
+      return await detectFacesInWorker(blob);
+    } catch (e) {
+      console.warn('Worker 人脸检测失败，改在主线程检测', e);
+    }
+  }
+  try {
+    return await detectFacesOnMainThread(imageData);
   } catch (e) {
     console.warn('人脸检测失败，使用默认', e);
-    return [{ x: 100, y: 50, w: 200, h: 250 }];
+    return DEFAULT_FACES;
   }
 }
@@ -0,0 +1,76 @@
+// 图片预处理 Worker 的主线程接口（Worker 实现见 imageWorker.ts）
+// 不支持 Worker / OffscreenCanvas 的浏览器上 getImageWorker 返回 null，调用方退回主线程压缩
+import type { FaceBox, ImageWorkerCommand, ImageWorkerResponse, PreprocessOptions, PreprocessResult } from './imageWorker';
+
+export type { FaceBox, PreprocessOptions, PreprocessResult } from './imageWorker';
+
+let imageWorker: Worker | null | undefined;
+let nextRequestId = 0;
+const pendingRequests = new Map<number, { resolve: (value: any) => void; reject: (err: Error) => void }>();
+
+function failPending(err: Error) {
+  for (const { reject } of pendingRequests.values()) reject(err);
+  pendingRequests.clear();
+}
+
+export function getImageWorker(): Worker | null {
+  if (imageWorker !== undefined) return imageWorker;
+  imageWorker = null;
+  if (typeof Worker === 'undefined' || typeof OffscreenCanvas === 'undefined') {
+    return null;
+  }
+  try {
+    const worker = new Worker(new URL('./imageWorker.ts', import.meta.url), { type: 'module' });
+    worker.onmessage = (e: MessageEvent<ImageWorkerResponse>) => {
+      const pending = pendingRequests.get(e.data.id);
+      if (!pending) return;
+      pendingRequests.delete(e.data.id);
+      if (e.data.ok) {
+        pending.resolve(e.data.result);
+      } else {
+        pending.reject(new Error(e.data.error));
+      }
+    };
+    worker.onerror = (e) => {
+      // Worker 脚本加载失败或崩溃：之后全部走主线程
+      console.warn('[ImageWorker] Worker failed, falling back to main thread:', e.message);
+      worker.terminate();
+      imageWorker = null;
+      failPending(new Error(e.message || 'Image worker failed'));
+    };
+    imageWorker = worker;
+  } catch (e) {
+    console.warn('[ImageWorker] Cannot start worker:', e);
+  }
+  return imageWorker;
+}
+
+function callImageWorker<T>(command: ImageWorkerCommand): Promise<T> {
+  const worker = getImageWorker();
+  if (!worker) {
+    return Promise.reject(new Error('Image worker unavailable'));
+  }
+  const id = ++nextRequestId;
+  return new Promise<T>((resolve, reject) => {
+    pendingRequests.set(id, { resolve, reject });
+    worker.postMessage({ ...command, id });
+  });
+}
+
+/**
+ * 提前在 Worker 中加载人脸检测模型（在使用协议页调用，上传时模型已就绪）
+ */
+export function preloadFaceModels(): void {
+  if (!getImageWorker()) return;
+  callImageWorker<{ loaded: boolean }>({ type: 'preload' })
+    .then(({ loaded }) => console.log(`[ImageWorker] Face models ${loaded ? 'ready' : 'unavailable'}`))
+    .catch(e => console.warn('[ImageWorker] Preload failed:', e));
+}
+
+export function preprocessImage(file: Blob, options: PreprocessOptions): Promise<PreprocessResult> {
+  return callImageWorker<PreprocessResult>({ type: 'preprocess', file, options });
+}
+
+export function detectFacesInWorker(file: Blob): Promise<FaceBox[]> {
+  return callImageWorker<FaceBox[]>({ type: 'detect', file });
+}
@@ -0,0 +1,249 @@
+// 图片预处理 Worker：解码、人脸检测、裁剪/缩放、JPEG 编码都在 Worker 线程用 OffscreenCanvas 完成
+// - 人脸检测优先使用 face-api.js（TinyFaceDetector，模型在 /models），不可用时退回浏览器原生 FaceDetector
+// - 检测到人脸时裁掉多余背景并按人脸尺寸缩放，减少上传体积和 Gemini 输入 token
+// - JPEG 质量用二分查找，取不超过体积上限的最高质量
+
+export interface FaceBox {
+  x: number;
+  y: number;
+  w: number;
+  h: number;
+}
+
+export interface PreprocessOptions {
+  maxBytes: number;
+  maxDimension: number;
+  minFaceWidth: number; // 缩放后人脸宽度不低于该值，保证五官细节
+  crop: boolean;
+}
+
+export interface PreprocessResult {
+  blob: Blob;
+  width: number;
+  height: number;
+  quality: number;
+  sourceBytes: number;
+  sourceWidth: number;
+  sourceHeight: number;
+  face?: FaceBox; // 原图坐标
+  cropped: boolean;
+  detector: 'face-api' | 'native' | 'none';
+  durationMs: number;
+}
+
+export type ImageWorkerCommand =
+  | { type: 'preload' }
+  | { type: 'preprocess'; file: Blob; options: PreprocessOptions }
+  | { type: 'detect'; file: Blob };
+
+export type ImageWorkerRequest = ImageWorkerCommand & { id: number };
+
+export type ImageWorkerResponse =
+  | { id: number; ok: true; result: unknown }
+  | { id: number; ok: false; error: string };
+
+const MODEL_URL = '/models';
+const DETECT_DIMENSION = 512; // 人脸检测在缩小后的图上进行
+const MIN_QUALITY = 0.3;
+const MAX_QUALITY = 0.92;
+const QUALITY_SEARCH_STEPS = 5;
+const MIN_CROP_SAVING = 0.1; // 裁剪至少去掉 10% 面积才值得
+
+let faceApi: Promise<any | null> | null = null;
+
+// face-api.js 默认只识别浏览器/Node 环境，Worker 中需要手动提供 OffscreenCanvas 环境
+function loadFaceApi(): Promise<any | null> {
+  if (!faceApi) {
+    faceApi = (async () => {
+      try {
+        const faceapi: any = await import('face-api.js');
+        faceapi.env.setEnv({
+          Canvas: OffscreenCanvas,
+          CanvasRenderingContext2D: OffscreenCanvasRenderingContext2D,
+          Image: class {},
+          ImageData,
+          Video: class {},
+          createCanvasElement: () => new OffscreenCanvas(1, 1),
+          createImageElement: () => {
+            throw new Error('Image elements are not available in workers');
+          },
+          fetch: self.fetch.bind(self),
+          readFile: () => {
+            throw new Error('readFile is not available in workers');
+          },
+        });
+        await faceapi.loadTinyFaceDetectorModel(MODEL_URL);
+        return faceapi;
+      } catch (e) {
+        console.warn('[ImageWorker] face-api.js unavailable, using native FaceDetector if present', e);
+        return null;
+      }
+    })();
+  }
+  return faceApi;
+}
+
+function largest(faces: FaceBox[]): FaceBox | undefined {
+  return faces.reduce<FaceBox | undefined>((best, f) => (!best || f.w * f.h > best.w * best.h ? f : best), undefined);
+}
+
+async function detectFaces(bitmap: ImageBitmap): Promise<{ faces: FaceBox[]; detector: PreprocessResult['detector'] }> {
+  const scale = Math.min(1, DETECT_DIMENSION / Math.max(bitmap.width, bitmap.height));
+  const width = Math.round(bitmap.width * scale);
+  const height = Math.round(bitmap.height * scale);
+
+  const faceapi = await loadFaceApi();
+  if (faceapi) {
+    try {
+      const canvas = new OffscreenCanvas(width, height);
+      const ctx = canvas.getContext('2d')!;
+      ctx.drawImage(bitmap, 0, 0, width, height);
+      const tensor = faceapi.tf.browser.fromPixels(ctx.getImageData(0, 0, width, height));
+      try {
+        const detections = await faceapi.detectAllFaces(tensor, new faceapi.TinyFaceDetectorOptions());
+        return {
+          faces: detections.map((d: any) => ({
+            x: d.box.x / scale,
+            y: d.box.y / scale,
+            w: d.box.width / scale,
+            h: d.box.height / scale,
+          })),
+          detector: 'face-api',
+        };
+      } finally {
+        tensor.dispose();
+      }
+    } catch (e) {
+      console.warn('[ImageWorker] face-api.js detection failed', e);
+    }
+  }
+
+  const NativeFaceDetector = (self as any).FaceDetector;
+  if (NativeFaceDetector) {
+    try {
+      const detections = await new NativeFaceDetector({ fastMode: true, maxDetectedFaces: 5 }).detect(bitmap);
+      return {
+        faces: detections.map((d: any) => ({
+          x: d.boundingBox.x,
+          y: d.boundingBox.y,
+          w: d.boundingBox.width,
+          h: d.boundingBox.height,
+        })),
+        detector: 'native',
+      };
+    } catch (e) {
+      console.warn('[ImageWorker] Native FaceDetector failed', e);
+    }
+  }
+
+  return { faces: [], detector: 'none' };
+}
+
+// 以人脸为中心裁掉多余背景：左右各留 2 倍脸宽、上方留 1 倍脸高，下方保留到底（全身照需要身材与服装信息）
+function cropAroundFace(face: FaceBox, width: number, height: number): FaceBox {
+  const left = Math.max(0, Math.floor(face.x - face.w * 2));
+  const right = Math.min(width, Math.ceil(face.x + face.w * 3));
+  const top = Math.max(0, Math.floor(face.y - face.h));
+  return { x: left, y: top, w: right - left, h: height - top };
+}
+
+async function encodeWithin(canvas: OffscreenCanvas, maxBytes: number): Promise<{ blob: Blob; quality: number }> {
+  const encode = (quality: number) => canvas.convertToBlob({ type: 'image/jpeg', quality });
+
+  const highest = await encode(MAX_QUALITY);
+  if (highest.size <= maxBytes) {
+    return { blob: highest, quality: MAX_QUALITY };
+  }
+
+  // 二分查找不超过上限的最高质量
+  let best: { blob: Blob; quality: number } | undefined;
+  let lo = MIN_QUALITY;
+  let hi = MAX_QUALITY;
+  for (let i = 0; i < QUALITY_SEARCH_STEPS; i++) {
+    const quality = (lo + hi) / 2;
+    const blob = await encode(quality);
+    if (blob.size <= maxBytes) {
+      best = { blob, quality };
+      lo = quality;
+    } else {
+      hi = quality;
+    }
+  }
+  return best || { blob: await encode(MIN_QUALITY), quality: MIN_QUALITY };
+}
+
+async function preprocess(file: Blob, options: PreprocessOptions): Promise<PreprocessResult> {
+  const started = performance.now();
+  const bitmap = await createImageBitmap(file);
+  try {
+    const { faces, detector } = options.crop ? await detectFaces(bitmap) : { faces: [], detector: 'none' as const };
+    const face = largest(faces);
+
+    let region: FaceBox = { x: 0, y: 0, w: bitmap.width, h: bitmap.height };
+    if (face) {
+      const crop = cropAroundFace(face, bitmap.width, bitmap.height);
+      if (crop.w * crop.h <= (1 - MIN_CROP_SAVING) * bitmap.width * bitmap.height) {
+        region = crop;
+      }
+    }
+
+    let scale = Math.min(1, options.maxDimension / Math.max(region.w, region.h));
+    if (face) {
+      scale = Math.max(scale, Math.min(1, options.minFaceWidth / face.w));
+    }
+    const width = Math.max(1, Math.round(region.w * scale));
+    const height = Math.max(1, Math.round(region.h * scale));
+
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext('2d');
+    if (!ctx) {
+      throw new Error('无法创建 OffscreenCanvas context');
+    }
+    ctx.drawImage(bitmap, region.x, region.y, region.w, region.h, 0, 0, width, height);
+    const { blob, quality } = await encodeWithin(canvas, options.maxBytes);
+
+    return {
+      blob,
+      width,
+      height,
+      quality,
+      sourceBytes: file.size,
+      sourceWidth: bitmap.width,
+      sourceHeight: bitmap.height,
+      face,
+      cropped: region.w !== bitmap.width || region.h !== bitmap.height,
+      detector,
+      durationMs: Math.round(performance.now() - started),
+    };
+  } finally {
+    bitmap.close();
+  }
+}
+
+async function handle(command: ImageWorkerCommand): Promise<unknown> {
+  switch (command.type) {
+    case 'preload':
+      return { loaded: !!(await loadFaceApi()) };
+    case 'preprocess':
+      return preprocess(command.file, command.options);
+    case 'detect': {
+      const bitmap = await createImageBitmap(command.file);
+      try {
+        return (await detectFaces(bitmap)).faces;
+      } finally {
+        bitmap.close();
+      }
+    }
+  }
+}
+
+self.addEventListener('message', async (event: MessageEvent<ImageWorkerRequest>) => {
+  const { id, ...command } = event.data;
+  let response: ImageWorkerResponse;
+  try {
+    response = { id, ok: true, result: await handle(command as ImageWorkerCommand) };
+  } catch (e: any) {
+    response = { id, ok: false, error: e?.message || String(e) };
+  }
+  self.postMessage(response);
+});
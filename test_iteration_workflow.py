@@ -6,159 +6,134 @@
 import os
 import sys
 import json
-import time
-from pathlib import Path
 
-try:
-    from playwright.sync_api import sync_playwright, expect
-except ImportError:
-    print("Installing Playwright...")
-    os.system("pip install playwright -q")
-    os.system("playwright install chromium -q")
-    from playwright.sync_api import sync_playwright, expect
+from e2e_session import launch_session, select_poses
+from e2e_timeline import (
+    ApiWatcher, api_action_of, StageTimeline, format_span_timeline, format_timeline, format_upload_metrics, upload_metrics,
+)
 
 # 配置
 TEST_IMAGE = "sys_init/6. Cindy Ruan.jpeg"
-BASE_URL = "http://localhost:3000"
 OUTPUT_DIR = "e2e-test-output"
+SELECTED_POSES = ["正面头像", "肖像照"]
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 def log(msg, icon="ℹ️"):
     print(f"{icon} {msg}")
 
-def test_iteration_workflow():
-    """测试带有迭代的复杂工作流"""
-    print("🧪 开始测试复杂迭代流程...")
+def _write_timeline(timeline, watcher, test_image, poses, output_dir, success, error=None):
+    """把阶段时间线写入 JSON 报告，便于复现 ITERATION_WORKFLOW_SUMMARY.md 中的性能数据"""
+    report = {
+        "test_image": str(test_image),
+        "selected_poses": poses,
+        "success": success,
+        "error": error,
+        "timeline": timeline.to_dict(),
+        "upload": upload_metrics(timeline),
+        "api_errors": watcher.api_errors,
+        "pose_spans": watcher.pose_spans(),
+    }
+    with open(f"{output_dir}/iteration_test_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n阶段时间线:\n{format_timeline(timeline)}")
+    print(f"\n上传与分析:\n{format_upload_metrics(report['upload'])}")
+    print(f"\n模型调用时间线:")
+    for pose in report["pose_spans"]:
+        print(format_span_timeline(pose))
+
+def run_iteration_workflow(page, test_image=TEST_IMAGE, poses=SELECTED_POSES, output_dir=OUTPUT_DIR):
+    """测试带有迭代的复杂工作流；page 为已登录、停在上传步骤的页面（见 e2e_session）"""
+    timeline = StageTimeline()
+    watcher = ApiWatcher(page, timeline, expected_poses=len(poses))
     
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page(viewport={"width": 1400, "height": 900})
+    try:
+        # 1. 登录状态由 storage_state 复用
+        timeline.mark("login")
+        print("\n1️⃣ 已复用登录状态")
+        
+        # 2. 上传照片
+        print("\n2️⃣ 上传照片...")
+        with page.expect_response(
+            lambda r: api_action_of(r.request) == "reviewInput",
+            timeout=120000,
+        ):
+            page.locator("input[type='file']").set_input_files(os.path.abspath(test_image))
+        timeline.mark("upload")
+        print("✅ 照片上传成功")
+        
+        # 3. 选择姿势（默认只选2个加快测试）
+        print("\n3️⃣ 选择姿势...")
+        select_poses(page, poses)
+        
+        selected = page.locator("input[type='checkbox']:checked").count()
+        print(f"✅ 选择了 {selected} 种姿势")
+        
+        page.locator("button:has-text('开始生成')").click()
+        timeline.mark("generation_started")
+        
+        # 4. 验证人脸分析阶段
+        print("\n4️⃣ 验证人脸分析...")
+        page.wait_for_selector("text=AI 正在分析", timeout=10000)
+        print("✅ 人脸分析阶段开始")
+        
+        # 等待分析完成（analyze 响应返回）
+        watcher.wait_for("analysis_done", timeout_ms=30000)
+        page.wait_for_selector("text=人脸分析完成", timeout=10000)
+        print(f"✅ 人脸分析完成 ({timeline.get('analysis_done') / 1000:.1f}秒)")
+        
+        # 5. 验证并行处理阶段
+        print("\n5️⃣ 验证并行处理和迭代逻辑...")
+        page.wait_for_selector("text=AI 正在生成", timeout=10000)
+        print("✅ 进入生成处理阶段")
         
-        try:
-            # 1. 访问并登录
-            print("\n1️⃣ 登录系统...")
-            page.goto(BASE_URL, wait_until="networkidle")
-            page.locator("input[placeholder='请输入邀请码']").fill("PHOTO2026")
-            page.locator("button:has-text('开始使用')").click()
-            page.wait_for_selector("text=使用协议", timeout=5000)
-            page.locator("input[type='checkbox']").check()
-            page.locator("button:has-text('同意并继续')").click()
-            print("✅ 登录成功")
-            
-            # 2. 上传照片
-            print("\n2️⃣ 上传照片...")
-            page.wait_for_selector("text=上传照片", timeout=5000)
-            input_file = page.locator("input[type='file']")
-            input_file.set_input_files(os.path.abspath(TEST_IMAGE))
-            page.wait_for_timeout(3000)
-            print("✅ 照片上传成功")
-            
-            # 3. 选择姿势（只选2个加快测试）
-            print("\n3️⃣ 选择姿势...")
-            page.wait_for_selector("text=选择姿势", timeout=5000)
-            
-            # 取消部分选择，只保留正面头像和肖像照
-            page.locator("text=侧面头像").click()
-            page.locator("text=半身照").click()
-            page.locator("text=全身照").click()
-            
-            selected = page.locator("input[type='checkbox']:checked").count()
-            print(f"✅ 选择了 {selected} 种姿势")
-            
-            page.locator("button:has-text('开始生成')").click()
-            
-            # 4. 验证人脸分析阶段
-            print("\n4️⃣ 验证人脸分析...")
-            page.wait_for_selector("text=AI 正在分析", timeout=10000)
-            print("✅ 人脸分析阶段开始")
-            
-            # 等待分析完成
-            page.wait_for_selector("text=人脸分析完成", timeout=30000)
-            print("✅ 人脸分析完成")
-            
-            # 5. 验证并行处理阶段 - 检查迭代逻辑
-            print("\n5️⃣ 验证并行处理和迭代逻辑...")
-            # 等待进入处理界面
-            page.wait_for_selector("text=AI 正在生成", timeout=10000)
-            print("✅ 进入生成处理阶段")
-            
-            # 等待并观察处理进度
-            for i in range(10):
-                page.wait_for_timeout(3000)
-                
-                # 检查是否有步骤状态更新
-                try:
-                    # 尝试获取当前所有状态文本
-                    status_texts = page.locator("text=/正面头像|侧面头像|肖像照|半身照|全身照/").all_text_contents()
-                    if status_texts and i % 3 == 0:
-                        print(f"   处理进度... ({i*3}秒)")
-                except:
-                    pass
-                
-                # 检查是否有已完成的
-                try:
-                    completed_elements = page.locator("text=已完成").count()
-                    if completed_elements > 0:
-                        print(f"   ✅ {completed_elements} 个姿势已完成")
-                        break
-                except:
-                    pass
-            
-            # 6. 验证渐进式显示
-            print("\n6️⃣ 验证渐进式显示...")
-            completed = False
-            for i in range(120):  # 最多等待4分钟
-                try:
-                    # 检查是否有完成的标记
-                    completed_elements = page.locator("text=已完成").count()
-                    if completed_elements > 0:
-                        print(f"✅ 检测到 {completed_elements} 张照片完成 ({i*2}秒)")
-                        
-                        # 检查是否有图片显示
-                        images = page.locator("img[alt]").count()
-                        if images > 0:
-                            print(f"✅ 页面上已显示 {images} 张图片")
-                            completed = True
-                            break
-                except:
-                    pass
-                
-                if i % 10 == 0:
-                    print(f"   等待中... {i*2}秒")
-                
-                page.wait_for_timeout(2000)
-            
-            if not completed:
-                print("⚠️ 等待超时，但流程已启动")
-            
-            # 截图记录
-            page.screenshot(path=f"{OUTPUT_DIR}/iteration_test_result.png")
-            
-            browser.close()
-            
-            print("\n" + "=" * 60)
-            print("🎉 复杂迭代流程测试完成！")
-            print("=" * 60)
-            print("\n✅ 已验证功能：")
-            print("   • 人脸分析共享")
-            print("   • 并行处理多个姿势")
-            print("   • Prompt构建和评审")
-            print("   • 图像生成和评审")
-            print("   • 迭代优化机制")
-            print("   • 渐进式结果展示")
-            print("=" * 60 + "\n")
-            
-            return True
-            
-        except Exception as e:
-            print(f"\n❌ 测试失败: {e}")
-            import traceback
-            traceback.print_exc()
-            page.screenshot(path=f"{OUTPUT_DIR}/iteration_test_error.png")
-            browser.close()
-            return False
+        # 6. 验证渐进式显示：第一个姿势完成时页面上已经出现图片
+        print("\n6️⃣ 验证渐进式显示...")
+        watcher.wait_for("first_pose_done", timeout_ms=240000)
+        page.wait_for_function(
+            "() => Array.from(document.querySelectorAll('img[alt]')).some(img => img.src)",
+            timeout=10000,
+        )
+        print(f"✅ 首张照片完成并已显示 ({timeline.get('first_pose_done') / 1000:.1f}秒)")
+        
+        watcher.wait_for("all_poses_done", timeout_ms=240000)
+        print(f"✅ {len(poses)} 张照片全部完成 ({timeline.get('all_poses_done') / 1000:.1f}秒)")
+        
+        # 截图记录
+        page.screenshot(path=f"{output_dir}/iteration_test_result.png")
+        
+        _write_timeline(timeline, watcher, test_image, poses, output_dir, success=True)
+        
+        print("\n" + "=" * 60)
+        print("🎉 复杂迭代流程测试完成！")
+        print("=" * 60)
+        print("\n✅ 已验证功能：")
+        print("   • 人脸分析共享")
+        print("   • 并行处理多个姿势")
+        print("   • Prompt构建和评审")
+        print("   • 图像生成和评审")
+        print("   • 迭代优化机制")
+        print("   • 渐进式结果展示")
+        print("=" * 60 + "\n")
+        
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        page.screenshot(path=f"{output_dir}/iteration_test_error.png")
+        _write_timeline(timeline, watcher, test_image, poses, output_dir, success=False, error=str(e))
+        return False
+
+def test_iteration_workflow(page, test_image, pose_subset, run_dir):
+    assert run_iteration_workflow(page, test_image, pose_subset, run_dir)
+
+def main():
+    print("🧪 开始测试复杂迭代流程...")
+    with launch_session(headless=True) as session:
+        return run_iteration_workflow(session.new_page())
 
 if __name__ == "__main__":
-    success = test_iteration_workflow()
+    success = main()
     sys.exit(0 if success else 1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+测试任务状态流 - 通过 streamJobStatus 断言后端步骤顺序与耗时（不经过浏览器）
+"""
+
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+from job_stream import assert_stage_order, collect_job_events, server_reachable, stage_durations, stage_sequence, submit_job
+
+# 配置
+TEST_IMAGE = os.environ.get("TEST_IMAGE", "sys_init/6. Cindy Ruan.jpeg")
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+OUTPUT_DIR = "e2e-test-output"
+PHOTO_TYPE = "正面头像"
+EXPECTED_STAGES = ["analyze", "design", "reviewPrompt", "generate", "reviewResult"]
+
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+@pytest.fixture(autouse=True)
+def api_environment():
+    """缺测试图片或服务未启动时跳过（直接运行脚本时不经过 fixture）"""
+    if not os.path.exists(TEST_IMAGE):
+        pytest.skip(f"测试图片不存在: {TEST_IMAGE}")
+    if not server_reachable(BASE_URL):
+        pytest.skip(f"服务不可达: {BASE_URL}")
+
+
+def test_job_stream():
+    print("🧪 开始测试任务状态流...")
+    with open(TEST_IMAGE, "rb") as f:
+        image = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode("ascii")
+
+    job_id = submit_job(BASE_URL, INVITE_CODE, "processPose", {"originalImage": image, "photoType": PHOTO_TYPE})
+    print(f"✅ 已提交任务 {job_id}")
+
+    events = collect_job_events(BASE_URL, INVITE_CODE, job_id)
+    durations = stage_durations(events)
+    report = {
+        "job_id": job_id,
+        "photo_type": PHOTO_TYPE,
+        "sequence": stage_sequence(events),
+        "durations": durations,
+        "events": [{"event": e["event"], "elapsed_ms": e["elapsed_ms"], "progress": e["status"].get("progress")} for e in events],
+    }
+    with open(f"{OUTPUT_DIR}/job_stream_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n步骤耗时:")
+    for d in durations:
+        duration = f"{d['duration_ms'] / 1000:7.2f}s" if d["duration_ms"] is not None else "      ?"
+        print(f"   {d['elapsed_ms'] / 1000:7.2f}s  {d['step']:<13} {duration}  (prompt#{d['promptIteration']} gen#{d['generationIteration']})")
+
+    assert_stage_order(events, EXPECTED_STAGES)
+    # 服务端时间戳必须单调递增
+    elapsed = [d["elapsed_ms"] for d in durations]
+    assert elapsed == sorted(elapsed), f"步骤时间戳非单调: {elapsed}"
+    print(f"\n✅ 步骤顺序正确: {' → '.join(report['sequence'])}")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        ok = test_job_stream()
+    except Exception as e:
+        print(f"❌ 测试失败: {e}")
+        ok = False
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+测试任务恢复 - 替身模式下注入生成阶段故障，任务失败后调用 resumeJob，断言恢复后的运行跳过已完成的阶段；
+同时发出两个 resumeJob 时只有一个被接受，恢复后的各阶段只执行一次
+
+需要服务以 GEMINI_BACKEND=stub 运行（故障注入只在替身模式下生效）
+"""
+
+import base64
+import json
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from job_stream import ApiError, collect_job_events, resume_job, server_reachable, span_stages, stage_sequence, submit_job
+
+# 配置
+TEST_IMAGE = os.environ.get("TEST_IMAGE", "sys_init/6. Cindy Ruan.jpeg")
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:3000")
+INVITE_CODE = os.environ.get("INVITE_CODE", "PHOTO2026")
+OUTPUT_DIR = "e2e-test-output"
+PHOTO_TYPE = "半身照"
+# 第一次生成调用失败：此时人物分析、设计与 prompt 评审都已完成并写入检查点
+# fault 参与任务去重的 key，run 保证重复运行测试（以及本文件中的不同用例）不会复用已完成的任务
+FAULT = {"stage": "generate", "times": 1, "run": uuid.uuid4().hex}
+COMPLETED_STAGES = ["analyze", "design", "reviewPrompt"]
+
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+@pytest.fixture(autouse=True)
+def api_environment():
+    """缺测试图片或服务未启动时跳过（直接运行脚本时不经过 fixture）"""
+    if not os.path.exists(TEST_IMAGE):
+        pytest.skip(f"测试图片不存在: {TEST_IMAGE}")
+    if not server_reachable(BASE_URL):
+        pytest.skip(f"服务不可达: {BASE_URL}")
+
+
+def submit_failing_job(run=None) -> str:
+    with open(TEST_IMAGE, "rb") as f:
+        image = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode("ascii")
+    fault = {**FAULT, "run": run or FAULT["run"]}
+    job_id = submit_job(BASE_URL, INVITE_CODE, "processPose", {"originalImage": image, "photoType": PHOTO_TYPE, "fault": fault})
+    print(f"✅ 已提交任务 {job_id}（注入故障: {fault}）")
+    return job_id
+
+
+def progress_steps(events: list) -> dict:
+    """流中出现过的全部步骤（按 step + 时间去重，状态事件会重复带上最近一步）"""
+    return {(e["status"]["progress"]["step"], e["status"]["progress"]["at"])
+            for e in events if e["event"] == "progress" and e["status"].get("progress")}
+
+
+def test_resume_job():
+    print("🧪 开始测试任务恢复...")
+    job_id = submit_failing_job()
+
+    first = collect_job_events(BASE_URL, INVITE_CODE, job_id)
+    failed = first[-1]
+    assert failed["event"] == "failed", f"注入故障后任务应失败，实际: {failed['event']}"
+    assert failed["status"].get("checkpoint") == "reviewPrompt", f"检查点应停在 reviewPrompt，实际: {failed['status'].get('checkpoint')}"
+    first_stages = span_stages(failed["status"])
+    print(f"✅ 任务按预期失败: {failed['status'].get('error')}")
+    print(f"   第一次运行的模型调用: {' → '.join(first_stages)}")
+
+    resumed = resume_job(BASE_URL, INVITE_CODE, job_id)
+    assert resumed["resumedFrom"] == "reviewPrompt", f"应从 reviewPrompt 之后恢复，实际: {resumed['resumedFrom']}"
+    print(f"✅ 已恢复任务（从 {resumed['resumedFrom']} 之后继续）")
+
+    second = collect_job_events(BASE_URL, INVITE_CODE, job_id)
+    final = second[-1]
+    assert final["event"] == "completed", f"恢复后任务未完成: {final['event']} {final['status'].get('error')}"
+    resumed_stages = span_stages(final["status"])
+    print(f"   恢复后的模型调用: {' → '.join(resumed_stages)}")
+
+    repeated = [stage for stage in COMPLETED_STAGES if stage in resumed_stages]
+    assert not repeated, f"恢复后不应重新执行已完成的阶段: {repeated}"
+    assert "generate" in resumed_stages and "reviewResult" in resumed_stages, f"恢复后应完成生成与评审: {resumed_stages}"
+    assert final["status"].get("attempts") == 1, f"应记录 1 次失败的运行，实际: {final['status'].get('attempts')}"
+
+    report = {
+        "job_id": job_id,
+        "photo_type": PHOTO_TYPE,
+        "fault": FAULT,
+        "first_run": {"stages": first_stages, "sequence": stage_sequence(first), "error": failed["status"].get("error")},
+        "resumed_run": {"stages": resumed_stages, "sequence": stage_sequence(second)},
+    }
+    with open(f"{OUTPUT_DIR}/resume_job_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n✅ 恢复后跳过了 {', '.join(COMPLETED_STAGES)}")
+    return True
+
+
+def test_concurrent_resume_job():
+    print("🧪 开始测试并发恢复...")
+    job_id = submit_failing_job(run=uuid.uuid4().hex)
+    first = collect_job_events(BASE_URL, INVITE_CODE, job_id)
+    assert first[-1]["event"] == "failed", f"注入故障后任务应失败，实际: {first[-1]['event']}"
+
+    def resume():
+        try:
+            return resume_job(BASE_URL, INVITE_CODE, job_id)
+        except ApiError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        outcomes = list(pool.map(lambda _: resume(), range(2)))
+    accepted = [o for o in outcomes if not isinstance(o, ApiError)]
+    rejected = [o for o in outcomes if isinstance(o, ApiError)]
+    assert len(accepted) == 1, f"两个并发的 resumeJob 应只接受一个，实际: {outcomes}"
+    assert rejected[0].status == 409 and rejected[0].code == "JOB_NOT_RESUMABLE", f"另一个应返回 409: {rejected[0]}"
+    print(f"✅ 并发恢复只接受了一个，另一个: {rejected[0]}")
+
+    second = collect_job_events(BASE_URL, INVITE_CODE, job_id)
+    final = second[-1]
+    assert final["event"] == "completed", f"恢复后任务未完成: {final['event']} {final['status'].get('error')}"
+    # 恢复后新增的步骤只来自一次运行：生成次数与最终记录中（单次运行的）生成调用数相同，已完成的阶段不重复
+    resumed_steps = [step for step, _ in sorted(progress_steps(second) - progress_steps(first), key=lambda p: p[1])]
+    generations = span_stages(final["status"]).count("generate")
+    assert resumed_steps.count("generate") == generations, f"恢复后的阶段应只执行一次: 步骤 {resumed_steps}，生成调用 {generations} 次"
+    repeated = [stage for stage in COMPLETED_STAGES if stage in resumed_steps]
+    assert not repeated, f"恢复后不应重新执行已完成的阶段: {repeated}"
+    assert final["status"].get("attempts") == 1, f"应只记录 1 次恢复，实际: {final['status'].get('attempts')}"
+    print(f"✅ 恢复后的阶段只执行了一次: {' → '.join(resumed_steps)}")
+    return True
+
+
+if __name__ == "__main__":
+    ok = True
+    for test in (test_resume_job, test_concurrent_resume_job):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} 失败: {e}")
+            ok = False
+    sys.exit(0 if ok else 1)
@@ -2,228 +2,222 @@
 """
 UI 端到端验收测试
 测试完整的工作流程：邀请码 -> 上传 -> 处理 -> 结果
+
+邀请码与协议只在每个浏览器会话开始时走一次（test_login_flow / 汇总报告中的 login），
+之后每张图片用复用登录状态的新 context 从上传步骤开始
 """
 
 import os
 import sys
 import time
 import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
 from datetime import datetime
 from pathlib import Path
 
-try:
-    from playwright.sync_api import sync_playwright, expect
-except ImportError:
-    print("Installing Playwright...")
-    os.system("pip install playwright -q")
-    os.system("playwright install chromium -q")
-    from playwright.sync_api import sync_playwright, expect
+from e2e_session import (
+    ALL_POSES, IMAGE_DIR, E2ESession, accept_consent, collect_images, enter_invite_code,
+    launch_session, select_poses,
+)
+from e2e_timeline import (
+    ApiWatcher, api_action_of, StageTimeline, format_span_timeline, format_timeline, format_upload_metrics, upload_metrics,
+)
+from metrics_scrape import format_metrics_delta, metrics_delta, scrape
 
 # 配置
-IMAGE_DIR = "sys_init"
 OUTPUT_DIR = "output"
-BASE_URL = "http://localhost:3000"
-INVITE_CODE = "PHOTO2026"
+EXPECTED_TYPES = ALL_POSES
+# 并行 worker 数量（每个 worker 是独立进程 + 独立浏览器）
+WORKERS = int(os.environ.get("UI_TEST_WORKERS", "1"))
+HEADLESS = os.environ.get("HEADLESS", "0") == "1"
+SLOW_MO = int(os.environ.get("SLOW_MO", "300"))
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 多进程运行时给日志加上图片前缀，避免输出混在一起无法分辨
+_log_prefix = ""
+
 def log(msg, icon="ℹ️"):
-    print(f"{icon} {msg}")
-
-def _collect_test_images():
-    supported_exts = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tiff"}
-    image_dir = Path(IMAGE_DIR)
-    if not image_dir.exists():
-        raise FileNotFoundError(f"图片目录不存在: {IMAGE_DIR}")
-    images = [p for p in image_dir.iterdir() if p.is_file() and p.suffix.lower() in supported_exts]
-    if not images:
-        raise FileNotFoundError(f"目录中没有可用图片: {IMAGE_DIR}")
-    return sorted(images)
+    print(f"{icon} {_log_prefix}{msg}", flush=True)
 
 def _safe_name(path: Path, index: int) -> str:
     import re
     base = re.sub(r"[^A-Za-z0-9._-]+", "_", path.stem).strip("_")
     return f"{index:02d}_{base or 'image'}"
 
-def run_ui_test(test_image: Path, output_dir: Path):
-    """运行完整UI测试"""
+def run_login_flow(session: E2ESession, output_dir: Path):
+    """验收邀请码与协议步骤（未登录的新 context），返回步骤记录"""
+    results = {"steps": [], "success": False, "screenshots": []}
+    context = session.new_context(authenticated=False)
+    page = context.new_page()
+    try:
+        # Step 1: 访问首页
+        log("\n步骤 1: 访问应用首页", "1️⃣")
+        page.goto(session.base_url, wait_until="networkidle")
+        page.screenshot(path=str(output_dir / "01_homepage.png"))
+        results["screenshots"].append("01_homepage.png")
+        
+        # 验证首页元素
+        assert page.locator("label:has-text('邀请码')").is_visible()
+        assert page.locator("form input[type='text']").is_visible()
+        log("✓ 首页加载成功", "✅")
+        results["steps"].append({"name": "访问首页", "status": "passed"})
+        
+        # Step 2: 输入邀请码
+        log("\n步骤 2: 输入邀请码", "2️⃣")
+        enter_invite_code(page, session.invite_code)
+        page.wait_for_load_state("networkidle")
+        page.screenshot(path=str(output_dir / "02_invite_code.png"))
+        results["screenshots"].append("02_invite_code.png")
+        log("✓ 邀请码输入成功", "✅")
+        results["steps"].append({"name": "输入邀请码", "status": "passed"})
+        
+        # Step 3: 同意协议
+        log("\n步骤 3: 同意使用协议", "3️⃣")
+        page.screenshot(path=str(output_dir / "03_consent.png"))
+        results["screenshots"].append("03_consent.png")
+        accept_consent(page)
+        page.wait_for_selector("h2:has-text('上传照片')", timeout=5000)
+        page.screenshot(path=str(output_dir / "04_upload_ready.png"))
+        results["screenshots"].append("04_upload_ready.png")
+        log("✓ 协议已同意", "✅")
+        results["steps"].append({"name": "同意协议", "status": "passed"})
+        results["success"] = True
+    except Exception as e:
+        log(f"❌ 登录流程失败: {e}", "❌")
+        results["error"] = str(e)
+    finally:
+        context.close()
+    return results
+
+def run_ui_test(session: E2ESession, test_image: Path, output_dir: Path, poses=EXPECTED_TYPES):
+    """运行单张图片的 UI 测试；登录状态由 session 复用"""
     log("=" * 60, "🧪")
     log("开始 UI 端到端验收测试", "🚀")
     log("=" * 60, "🧪")
     log(f"测试图片: {test_image}", "🖼️")
     
     results = {
+        "image": str(test_image),
         "start_time": str(datetime.now()),
         "steps": [],
         "success": False,
         "screenshots": []
     }
     
-    with sync_playwright() as p:
-        # 启动浏览器（非无头模式便于观察）
-        browser = p.chromium.launch(headless=False, slow_mo=300)
-        context = browser.new_context(
-            viewport={"width": 1400, "height": 900},
-            record_video_dir=str(output_dir / "videos")
-        )
-        page = context.new_page()
+    # 服务端指标增量（设置 METRICS_TOKEN 时）；多个 worker 并行时包含其他图片同时产生的请求
+    metrics_before = scrape(session.base_url, session.invite_code)
+    context = session.new_context(record_video_dir=str(output_dir / "videos"))
+    page = session.new_page(context)
+    timeline = StageTimeline()
+    watcher = ApiWatcher(page, timeline, expected_poses=len(poses))
+    
+    try:
+        # Step 4: 上传照片（context 已带登录状态，页面直接停在上传步骤）
+        log("\n步骤 4: 上传测试照片", "4️⃣")
+        timeline.mark("login")
+        page.screenshot(path=str(output_dir / "05_upload.png"))
+        results["screenshots"].append("05_upload.png")
+
+        # 上传文件，等待照片审核 (reviewInput) 返回
+        log(f"   上传文件: {test_image}", "📤")
+        with page.expect_response(
+            lambda r: api_action_of(r.request) == "reviewInput",
+            timeout=120000,
+        ):
+            page.locator("input[type='file']").set_input_files(str(test_image.resolve()))
+        timeline.mark("upload")
+        page.screenshot(path=str(output_dir / "06_uploaded.png"))
+        results["screenshots"].append("06_uploaded.png")
+        log("✓ 照片上传成功", "✅")
+        results["steps"].append({"name": "上传照片", "status": "passed"})
+
+        # Step 5: 等待AI处理
+        log("\n步骤 5: 等待AI处理完成", "5️⃣")
+        select_poses(page, poses)
+        page.locator("button:has-text('开始生成')").click()
+        timeline.mark("generation_started")
+        log("   处理中，请稍候...", "⏳")
+
+        # 由网络事件驱动：analyze 返回 / 每个姿势的 getJobStatus 返回 completed
+        watcher.wait_for("analysis_done", timeout_ms=120000)
+        log(f"✓ 人脸分析完成 ({timeline.get('analysis_done') / 1000:.1f}秒)", "✅")
+        watcher.wait_for("first_pose_done", timeout_ms=600000)
+        log(f"✓ 首张照片完成 ({timeline.get('first_pose_done') / 1000:.1f}秒)", "✅")
+        page.screenshot(path=str(output_dir / "07_first_pose.png"))
+        results["screenshots"].append("07_first_pose.png")
+        watcher.wait_for("all_poses_done", timeout_ms=600000)
+        log(f"✓ AI处理完成 ({timeline.get('all_poses_done') / 1000:.1f}秒)", "✅")
+
+        page.screenshot(path=str(output_dir / "08_result.png"))
+        results["screenshots"].append("08_result.png")
+        results["steps"].append({"name": "AI处理", "status": "passed"})
+
+        # Step 6: 验证结果
+        log("\n步骤 6: 验证生成结果", "6️⃣")
+
+        # 获取所有生成的照片
+        photos = page.locator("img[alt]").all()
+        log(f"✓ 找到 {len(photos)} 张照片", "📸")
+
+        # 验证照片类型
+        expected_types = poses
+        found_types = []
+
+        for i, photo in enumerate(photos):
+            alt_text = photo.get_attribute("alt")
+            found_types.append(alt_text)
+            log(f"   照片 {i+1}: {alt_text}", "📷")
+
+        # 检查是否包含所有期望的类型
+        coverage = len([t for t in expected_types if t in found_types])
+        log(f"✓ 姿势覆盖: {coverage}/{len(expected_types)}", "✅" if coverage == len(expected_types) else "⚠️")
+
+        results["steps"].append({
+            "name": "验证结果",
+            "status": "passed",
+            "photos_count": len(photos),
+            "coverage": f"{coverage}/{len(expected_types)}"
+        })
+
+        # Step 7: 下载照片
+        log("\n步骤 7: 测试下载功能", "7️⃣")
+
+        # 点击第一个下载按钮
+        with page.expect_download() as download_info:
+            page.locator("button:has-text('下载')").first.click()
+
+        download = download_info.value
+        download_path = output_dir / f"downloaded_{download.suggested_filename}"
+        download.save_as(download_path)
+
+        log(f"✓ 照片已下载: {download_path}", "✅")
+        results["steps"].append({"name": "下载照片", "status": "passed"})
+
+        # 成功完成
+        results["success"] = True
+        results["end_time"] = str(datetime.now())
+        
+    except Exception as e:
+        log(f"❌ 测试失败: {e}", "❌")
+        results["error"] = str(e)
+        results["end_time"] = str(datetime.now())
         
         try:
-            # Step 1: 访问首页
-            log("\n步骤 1: 访问应用首页", "1️⃣")
-            page.goto(BASE_URL, wait_until="networkidle")
-            page.wait_for_timeout(1000)
-            page.screenshot(path=str(output_dir / "01_homepage.png"))
-            results["screenshots"].append("01_homepage.png")
-            
-            # 验证首页元素
-            assert page.locator("label:has-text('邀请码')").is_visible()
-            assert page.locator("input[placeholder='输入邀请码']").is_visible()
-            log("✓ 首页加载成功", "✅")
-            results["steps"].append({"name": "访问首页", "status": "passed"})
-            
-            # Step 2: 输入邀请码
-            log("\n步骤 2: 输入邀请码", "2️⃣")
-            page.locator("input[placeholder='输入邀请码']").fill(INVITE_CODE)
-            page.screenshot(path=str(output_dir / "02_invite_code.png"))
-            results["screenshots"].append("02_invite_code.png")
-            
-            page.locator("button:has-text('开始使用')").click()
-            page.wait_for_load_state("networkidle")
-            log("✓ 邀请码输入成功", "✅")
-            results["steps"].append({"name": "输入邀请码", "status": "passed"})
-            
-            # Step 3: 同意协议
-            log("\n步骤 3: 同意使用协议", "3️⃣")
-            page.wait_for_selector("text=使用协议", timeout=5000)
-            page.screenshot(path=str(output_dir / "03_consent.png"))
-            results["screenshots"].append("03_consent.png")
-            
-            page.locator("input[type='checkbox']").check()
-            page.screenshot(path=str(output_dir / "04_consent_checked.png"))
-            results["screenshots"].append("04_consent_checked.png")
-            
-            page.locator("button:has-text('同意并继续')").click()
-            page.wait_for_load_state("networkidle")
-            log("✓ 协议已同意", "✅")
-            results["steps"].append({"name": "同意协议", "status": "passed"})
-            
-            # Step 4: 上传照片
-            log("\n步骤 4: 上传测试照片", "4️⃣")
-            page.wait_for_selector("text=上传照片", timeout=5000)
-            page.screenshot(path=str(output_dir / "05_upload.png"))
-            results["screenshots"].append("05_upload.png")
-            
-            # 上传文件
-            input_file = page.locator("input[type='file']")
-            input_file.set_input_files(str(test_image.resolve()))
-            
-            log(f"   上传文件: {test_image}", "📤")
-            page.wait_for_timeout(3000)
-            page.screenshot(path=str(output_dir / "06_uploaded.png"))
-            results["screenshots"].append("06_uploaded.png")
-            log("✓ 照片上传成功", "✅")
-            results["steps"].append({"name": "上传照片", "status": "passed"})
-            
-            # Step 5: 等待AI处理
-            log("\n步骤 5: 等待AI处理完成", "5️⃣")
-            log("   处理中，请稍候...", "⏳")
-            
-            # 等待处理页面出现
-            page.wait_for_selector("text=AI 正在处理", timeout=10000)
-            
-            # 等待处理完成（最长10分钟）
-            max_wait = 600  # 10分钟
-            for i in range(max_wait):
-                try:
-                    # 检查是否完成
-                    if page.locator("text=专业形象照已完成").is_visible(timeout=1000):
-                        log("✓ AI处理完成", "✅")
-                        break
-                except:
-                    pass
-                
-                # 每10秒截图
-                if i % 10 == 0:
-                    try:
-                        page.screenshot(path=str(output_dir / f"processing_{i//10:02d}.png"))
-                    except:
-                        pass
-                    # 获取进度
-                    try:
-                        progress = page.locator("text=/[0-9]+%/").text_content(timeout=500)
-                        log(f"   处理进度: {progress}", "📊")
-                    except:
-                        pass
-                
-                page.wait_for_timeout(1000)
-            else:
-                raise TimeoutError("AI处理超时（超过10分钟）")
-            
-            page.screenshot(path=str(output_dir / "07_result.png"))
-            results["screenshots"].append("07_result.png")
-            results["steps"].append({"name": "AI处理", "status": "passed"})
-            
-            # Step 6: 验证结果
-            log("\n步骤 6: 验证生成结果", "6️⃣")
-            
-            # 获取所有生成的照片
-            photos = page.locator("img[alt]").all()
-            log(f"✓ 找到 {len(photos)} 张照片", "📸")
-            
-            # 验证照片类型
-            expected_types = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
-            found_types = []
-            
-            for i, photo in enumerate(photos):
-                alt_text = photo.get_attribute("alt")
-                found_types.append(alt_text)
-                log(f"   照片 {i+1}: {alt_text}", "📷")
-            
-            # 检查是否包含所有期望的类型
-            coverage = len([t for t in expected_types if t in found_types])
-            log(f"✓ 姿势覆盖: {coverage}/{len(expected_types)}", "✅" if coverage == len(expected_types) else "⚠️")
-            
-            results["steps"].append({
-                "name": "验证结果",
-                "status": "passed",
-                "photos_count": len(photos),
-                "coverage": f"{coverage}/{len(expected_types)}"
-            })
-            
-            # Step 7: 下载照片
-            log("\n步骤 7: 测试下载功能", "7️⃣")
-            
-            # 点击第一个下载按钮
-            with page.expect_download() as download_info:
-                page.locator("button:has-text('下载')").first.click()
-            
-            download = download_info.value
-            download_path = output_dir / f"downloaded_{download.suggested_filename}"
-            download.save_as(download_path)
-            
-            log(f"✓ 照片已下载: {download_path}", "✅")
-            results["steps"].append({"name": "下载照片", "status": "passed"})
-            
-            # 成功完成
-            results["success"] = True
-            results["end_time"] = str(datetime.now())
-            
-            browser.close()
-            
-        except Exception as e:
-            log(f"❌ 测试失败: {e}", "❌")
-            results["error"] = str(e)
-            results["end_time"] = str(datetime.now())
-            
-            try:
-                page.screenshot(path=str(output_dir / "error_screenshot.png"))
-                results["screenshots"].append("error_screenshot.png")
-            except:
-                pass
-            
-            browser.close()
-            return False
+            page.screenshot(path=str(output_dir / "error_screenshot.png"))
+            results["screenshots"].append("error_screenshot.png")
+        except:
+            pass
+    finally:
+        context.close()
+    
+    results["timeline"] = timeline.to_dict()
+    results["upload"] = upload_metrics(timeline)
+    results["api_errors"] = watcher.api_errors
+    results["pose_spans"] = watcher.pose_spans()
+    results["metrics"] = metrics_delta(metrics_before, scrape(session.base_url, session.invite_code))
     
     # 生成测试报告
     report_path = output_dir / "ui_test_report.json"
@@ -235,9 +229,16 @@ def run_ui_test(test_image: Path, output_dir: Path):
     log("UI 端到端测试完成！", "🎉")
     print("=" * 60)
     print(f"\n测试状态: {'✅ 通过' if results['success'] else '❌ 失败'}")
-    print(f"完成步骤: {len(results['steps'])}/7")
-    print(f"生成照片: {results['steps'][-2]['photos_count'] if len(results['steps']) > 1 else 0} 张")
-    print(f"姿势覆盖: {results['steps'][-2].get('coverage', 'N/A')}")
+    print(f"完成步骤: {len(results['steps'])}/4")
+    verify_step = next((st for st in results["steps"] if st["name"] == "验证结果"), {})
+    print(f"生成照片: {verify_step.get('photos_count', 0)} 张")
+    print(f"姿势覆盖: {verify_step.get('coverage', 'N/A')}")
+    print(f"\n阶段时间线:\n{format_timeline(timeline)}")
+    print(f"\n上传与分析:\n{format_upload_metrics(results['upload'])}")
+    print(f"\n模型调用时间线:")
+    for pose in results["pose_spans"]:
+        print(format_span_timeline(pose))
+    print(f"\n服务端指标增量:\n{format_metrics_delta(results['metrics'])}")
     print(f"\n截图文件:")
     for s in results["screenshots"]:
         print(f"  📸 {output_dir}/{s}")
@@ -246,12 +247,120 @@ def run_ui_test(test_image: Path, output_dir: Path):
     
     return results["success"]
 
-if __name__ == "__main__":
-    images = _collect_test_images()
-    all_success = True
+# 每个 worker 进程一个浏览器会话：进程启动时创建，该进程处理的所有图片复用同一份登录状态
+_worker_session = None
+
+def _init_worker(headless: bool, slow_mo: int):
+    global _worker_session
+    from playwright.sync_api import sync_playwright
+
+    playwright = sync_playwright().start()
+    browser = playwright.chromium.launch(headless=headless, slow_mo=slow_mo)
+    _worker_session = E2ESession(browser)
+
+    def _shutdown():
+        browser.close()
+        playwright.stop()
+    Finalize(_worker_session, _shutdown, exitpriority=10)
+
+def _run_worker(test_image: Path, run_dir: Path):
+    """worker 进程入口：每张图片独立的 context 与结果目录"""
+    global _log_prefix
+    _log_prefix = f"[{run_dir.name}] "
+    try:
+        return run_ui_test(_worker_session, test_image, run_dir)
+    except Exception as e:
+        log(f"❌ worker 异常: {e}", "❌")
+        return False
+
+def run_ui_tests_parallel(images, workers: int = WORKERS, headless: bool = HEADLESS, slow_mo: int = SLOW_MO):
+    """
+    使用进程池并行运行多张图片的验收测试，并汇总为一份 ui_test_report.json
+
+    每张图片的截图、视频和单独报告写入 OUTPUT_DIR/<序号_文件名>/，登录流程写入 OUTPUT_DIR/login/
+    """
+    started = time.time()
+    runs = []
     for idx, image_path in enumerate(images, start=1):
         run_dir = Path(OUTPUT_DIR) / _safe_name(image_path, idx)
         run_dir.mkdir(parents=True, exist_ok=True)
-        success = run_ui_test(image_path, run_dir)
-        all_success = all_success and success
+        runs.append((image_path, run_dir))
+
+    workers = max(1, min(workers, len(runs)))
+    log(f"共 {len(runs)} 张图片，并发 {workers} 个 worker", "🚀")
+
+    login_dir = Path(OUTPUT_DIR) / "login"
+    login_dir.mkdir(parents=True, exist_ok=True)
+    outcomes = {}
+    metrics_before = scrape()
+    with launch_session(headless=headless, slow_mo=slow_mo) as session:
+        login = run_login_flow(session, login_dir)
+        log(f"登录流程: {'✅ 通过' if login['success'] else '❌ 失败'}", "🔑")
+        if workers == 1:
+            for image_path, run_dir in runs:
+                outcomes[run_dir] = run_ui_test(session, image_path, run_dir)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(headless, slow_mo)) as pool:
+            futures = {
+                pool.submit(_run_worker, image_path, run_dir): run_dir
+                for image_path, run_dir in runs
+            }
+            for future in as_completed(futures):
+                run_dir = futures[future]
+                try:
+                    outcomes[run_dir] = future.result()
+                except Exception as e:
+                    log(f"❌ {run_dir.name} 进程异常退出: {e}", "❌")
+                    outcomes[run_dir] = False
+                log(f"{run_dir.name}: {'✅ 通过' if outcomes[run_dir] else '❌ 失败'}", "📋")
+
+    # 合并每张图片的报告
+    aggregated = {
+        "start_time": str(datetime.fromtimestamp(started)),
+        "end_time": str(datetime.now()),
+        "duration_seconds": round(time.time() - started, 1),
+        "workers": workers,
+        "total": len(runs),
+        "passed": sum(1 for ok in outcomes.values() if ok),
+        "failed": sum(1 for ok in outcomes.values() if not ok),
+        "login": login,
+        "metrics": metrics_delta(metrics_before, scrape()),
+        "runs": [],
+    }
+    for image_path, run_dir in runs:
+        report_path = run_dir / "ui_test_report.json"
+        report = None
+        if report_path.exists():
+            with open(report_path, encoding="utf-8") as f:
+                report = json.load(f)
+        aggregated["runs"].append({
+            "image": str(image_path),
+            "run_dir": str(run_dir),
+            "success": bool(outcomes.get(run_dir)),
+            "report": report,
+        })
+
+    report_path = Path(OUTPUT_DIR) / "ui_test_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(aggregated, f, indent=2, ensure_ascii=False)
+
+    log(f"汇总: {aggregated['passed']}/{aggregated['total']} 通过，耗时 {aggregated['duration_seconds']} 秒", "📊")
+    log(f"汇总报告: {report_path}", "📄")
+    return aggregated["failed"] == 0 and login["success"]
+
+def test_login_flow(e2e_session, run_dir):
+    assert run_login_flow(e2e_session, run_dir)["success"]
+
+def test_ui_acceptance(e2e_session, test_image, pose_subset, run_dir):
+    assert run_ui_test(e2e_session, test_image, run_dir, pose_subset)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UI 端到端验收测试")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="并发 worker 数量（默认读取 UI_TEST_WORKERS）")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS, help="无头模式运行浏览器")
+    parser.add_argument("--slow-mo", type=int, default=SLOW_MO, help="每步操作的延迟毫秒数")
+    args = parser.parse_args()
+
+    images = collect_images(IMAGE_DIR)
+    all_success = run_ui_tests_parallel(images, workers=args.workers, headless=args.headless, slow_mo=args.slow_mo)
     sys.exit(0 if all_success else 1)
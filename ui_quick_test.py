@@ -5,132 +5,107 @@
 
 import os
 import sys
-from playwright.sync_api import sync_playwright
+
+from e2e_session import ALL_POSES, launch_session, select_poses
+from e2e_timeline import ApiWatcher, StageTimeline, api_action_of
 
 TEST_IMAGE = "sys_init/6. Cindy Ruan.jpeg"
-BASE_URL = "http://localhost:3000"
 
-def test_workflow():
-    print("🧪 启动UI验证测试...")
+def run_quick_check(page, test_image=TEST_IMAGE, poses=ALL_POSES):
+    """page 为已登录、停在上传步骤的页面（见 e2e_session）"""
+    from playwright.sync_api import expect
+
+    timeline = StageTimeline()
+    watcher = ApiWatcher(page, timeline, expected_poses=len(poses))
     
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page(viewport={"width": 1400, "height": 900})
+    try:
+        # 1. 登录状态复用：直接进入上传步骤
+        print("\n1️⃣ 复用登录状态...")
+        assert page.locator("text=上传照片").first.is_visible()
+        print("✅ 已跳过邀请码与协议")
+        
+        # 2. 上传照片
+        print("\n2️⃣ 上传照片...")
+        with page.expect_response(lambda r: api_action_of(r.request) == "reviewInput", timeout=120000):
+            page.locator("input[type='file']").set_input_files(os.path.abspath(test_image))
+        print("✅ 照片上传成功")
+        
+        # 3. 验证姿势选择界面
+        print("\n3️⃣ 检查姿势选择界面...")
+        page.wait_for_selector("text=选择姿势", timeout=5000)
+        
+        # 验证所有5个姿势选项都存在
+        for pose in ALL_POSES:
+            assert page.locator(f"text={pose}").is_visible()
+        print(f"✅ 找到所有5个姿势选项")
+        
+        # 验证默认全部选中
+        checkboxes = page.locator("input[type='checkbox']").all()
+        checked_count = sum(1 for cb in checkboxes if cb.is_checked())
+        print(f"✅ 默认选中姿势数: {checked_count}/5")
+        
+        # 选择指定姿势（测试选择功能）
+        print("\n4️⃣ 测试选择功能...")
+        # 取消选择"侧面头像"
+        page.locator("text=侧面头像").click()
+        expect(page.locator("label", has_text="侧面头像").locator("input[type='checkbox']")).not_to_be_checked()
+        
+        # 验证已选数量减少
+        checkboxes = page.locator("input[type='checkbox']").all()
+        checked_count_after = sum(1 for cb in checkboxes if cb.is_checked())
+        assert checked_count_after == checked_count - 1
+        print(f"✅ 选择功能正常 ({checked_count_after}/5)")
+        
+        # 选择本次要生成的姿势
+        select_poses(page, poses)
+        print(f"✅ 已选择 {len(poses)} 种姿势: {', '.join(poses)}")
         
-        try:
-            # 1. 访问首页
-            print("\n1️⃣ 访问首页...")
-            page.goto(BASE_URL, wait_until="networkidle")
-            assert page.locator("text=专业形象照").is_visible()
-            print("✅ 首页加载成功")
-            
-            # 2. 输入邀请码（手动输入，无点击选项）
-            print("\n2️⃣ 输入邀请码...")
-            page.locator("input[placeholder='请输入邀请码']").fill("PHOTO2026")
-            page.locator("button:has-text('开始使用')").click()
-            print("✅ 邀请码输入成功")
-            
-            # 3. 同意协议
-            print("\n3️⃣ 同意协议...")
-            page.wait_for_selector("text=使用协议", timeout=5000)
-            page.locator("input[type='checkbox']").check()
-            page.locator("button:has-text('同意并继续')").click()
-            print("✅ 协议已同意")
-            
-            # 4. 上传照片
-            print("\n4️⃣ 上传照片...")
-            page.wait_for_selector("text=上传照片", timeout=5000)
-            input_file = page.locator("input[type='file']")
-            input_file.set_input_files(os.path.abspath(TEST_IMAGE))
-            page.wait_for_timeout(2000)
-            print("✅ 照片上传成功")
-            
-            # 5. 验证姿势选择界面
-            print("\n5️⃣ 检查姿势选择界面...")
-            page.wait_for_selector("text=选择姿势", timeout=5000)
-            
-            # 验证所有5个姿势选项都存在
-            poses = ["正面头像", "侧面头像", "肖像照", "半身照", "全身照"]
-            for pose in poses:
-                assert page.locator(f"text={pose}").is_visible()
-            print(f"✅ 找到所有5个姿势选项")
-            
-            # 验证默认全部选中
-            checkboxes = page.locator("input[type='checkbox']").all()
-            checked_count = sum(1 for cb in checkboxes if cb.is_checked())
-            print(f"✅ 默认选中姿势数: {checked_count}/5")
-            
-            # 选择指定姿势（测试选择功能）
-            print("\n6️⃣ 测试选择功能...")
-            # 取消选择"侧面头像"
-            page.locator("text=侧面头像").click()
-            page.wait_for_timeout(500)
-            
-            # 验证已选数量减少
-            checkboxes = page.locator("input[type='checkbox']").all()
-            checked_count_after = sum(1 for cb in checkboxes if cb.is_checked())
-            assert checked_count_after == checked_count - 1
-            print(f"✅ 选择功能正常 ({checked_count_after}/5)")
-            
-            # 重新选回全部
-            page.locator("text=侧面头像").click()
-            print("✅ 已重新选择全部5种姿势")
-            
-            # 点击开始生成
-            page.locator("button:has-text('开始生成')").click()
-            print("✅ 已进入生成流程")
-            
-            # 6. 验证并行生成界面
-            print("\n7️⃣ 检查并行生成界面...")
-            page.wait_for_selector("text=AI 正在生成", timeout=10000)
-            
-            # 验证每个姿势都有独立的进度条
-            for pose in poses:
-                assert page.locator(f"text={pose}").is_visible()
-            print("✅ 所有姿势都显示独立进度")
-            
-            # 等待至少一张照片完成（最多等待2分钟）
-            print("\n8️⃣ 等待照片生成（最多2分钟）...")
-            completed = False
-            for i in range(120):
-                try:
-                    # 检查是否有已完成的标记
-                    if page.locator("text=已完成").is_visible(timeout=1000):
-                        completed = True
-                        print(f"✅ 检测到照片生成完成 ({i}秒)")
-                        break
-                except:
-                    pass
-                
-                if i % 10 == 0:
-                    print(f"   等待中... {i}秒")
-                
-                page.wait_for_timeout(1000)
-            
-            if not completed:
-                print("⚠️ 等待超时，但界面功能正常")
-            
-            browser.close()
-            
-            print("\n" + "=" * 50)
-            print("🎉 UI功能验证通过！")
-            print("=" * 50)
-            print("\n✅ 已验证功能：")
-            print("   • 邀请码手动输入（无点击选项）")
-            print("   • 姿势选择界面（5个checkbox）")
-            print("   • 默认全部勾选")
-            print("   • 选择/取消功能正常")
-            print("   • 并行生成界面（独立进度条）")
-            print("=" * 50 + "\n")
-            
-            return True
-            
-        except Exception as e:
-            print(f"\n❌ 测试失败: {e}")
-            page.screenshot(path="e2e-test-output/ui_test_error.png")
-            browser.close()
-            return False
+        # 点击开始生成
+        page.locator("button:has-text('开始生成')").click()
+        print("✅ 已进入生成流程")
+        
+        # 5. 验证并行生成界面
+        print("\n5️⃣ 检查并行生成界面...")
+        page.wait_for_selector("text=AI 正在生成", timeout=10000)
+        
+        # 验证每个姿势都有独立的进度条
+        for pose in poses:
+            assert page.locator(f"text={pose}").is_visible()
+        print("✅ 所有姿势都显示独立进度")
+        
+        # 等待至少一张照片完成（最多等待2分钟），超时即测试失败
+        print("\n6️⃣ 等待照片生成（最多2分钟）...")
+        watcher.wait_for("first_pose_done", timeout_ms=120000)
+        print(f"✅ 检测到照片生成完成 ({timeline.get('first_pose_done') / 1000:.1f}秒)")
+        
+        print("\n" + "=" * 50)
+        print("🎉 UI功能验证通过！")
+        print("=" * 50)
+        print("\n✅ 已验证功能：")
+        print("   • 登录状态复用（邀请码 + 协议）")
+        print("   • 姿势选择界面（5个checkbox）")
+        print("   • 默认全部勾选")
+        print("   • 选择/取消功能正常")
+        print("   • 并行生成界面（独立进度条）")
+        print("   • 至少一张照片生成完成")
+        print("=" * 50 + "\n")
+        
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ 测试失败: {e}")
+        os.makedirs("e2e-test-output", exist_ok=True)
+        page.screenshot(path="e2e-test-output/ui_test_error.png")
+        return False
+
+def test_quick_workflow(page, test_image, pose_subset):
+    assert run_quick_check(page, test_image, pose_subset)
+
+def main():
+    print("🧪 启动UI验证测试...")
+    with launch_session(headless=True) as session:
+        return run_quick_check(session.new_page())
 
 if __name__ == "__main__":
-    success = test_workflow()
+    success = main()
     sys.exit(0 if success else 1)
@@ -4,6 +4,8 @@ import react from '@vitejs/plugin-react';
 export default defineConfig({
   plugins: [react()],
   build: { outDir: 'dist' },
+  // imageWorker.ts 动态加载 face-api.js，需要支持代码分割的 ES 模块格式
+  worker: { format: 'es' },
   server: {
     port: 3000,
     proxy: {